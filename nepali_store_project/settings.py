@@ -24,6 +24,12 @@ BASE_DIR = Path(__file__).resolve().parent.parent
 # SECURITY WARNING: keep the secret key used in production secret!
 SECRET_KEY = 'django-insecure-r0)l%m#23xzf_ly(w@4*)l5oirqdkv@*80nu($+mh1#s$0vlth'
 STRIPE_SECRET_KEY = 'sk_test_51PRDH1KTI3hDF0HSvNZ9EEKUS4qxZDx39gJrCyUmvaoZd3eDpoCq5OOvqfxKVgZXaPnkZQCegZMyYESg4xkOpY6d00D8swNbE2'
+STRIPE_API_BASE = os.getenv('STRIPE_API_BASE', 'https://api.stripe.com')
+# Seconds before a Stripe call is abandoned, and how many may run at once per worker.
+STRIPE_TIMEOUT = int(os.getenv('STRIPE_TIMEOUT', 10))
+STRIPE_MAX_CONCURRENCY = int(os.getenv('STRIPE_MAX_CONCURRENCY', 8))
+# Signing secret of the webhook endpoint (whsec_...); webhooks are refused without it.
+STRIPE_WEBHOOK_SECRET = os.getenv('STRIPE_WEBHOOK_SECRET', '')
 
 # SECURITY WARNING: don't run with debug turned on in production!
 
@@ -58,9 +64,10 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'store_app.middleware.RequestMetricsMiddleware',
     'corsheaders.middleware.CorsMiddleware',
     'django.middleware.security.SecurityMiddleware',
-    "whitenoise.middleware.WhiteNoiseMiddleware",
+    "store_app.middleware.WhiteNoiseMiddleware",
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
@@ -69,6 +76,13 @@ MIDDLEWARE = [
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
 
+# Request timings: a Server-Timing header on responses to staff (or to
+# everyone with DEBUG on), and per-route histograms at /metrics, which needs
+# METRICS_TOKEN as a bearer token and is a 404 while no token is set.
+METRICS_ENABLED = os.getenv('METRICS_ENABLED', 'true').lower() == 'true'
+SERVER_TIMING = os.getenv('SERVER_TIMING', 'true').lower() == 'true'
+METRICS_TOKEN = os.getenv('METRICS_TOKEN', '')
+
 STATIC_ROOT = BASE_DIR / "staticfiles"
 
 STORAGES = {
@@ -84,11 +98,23 @@ STORAGES = {
 REST_FRAMEWORK = {
        'DEFAULT_AUTHENTICATION_CLASSES': [
            'rest_framework.authentication.SessionAuthentication',
-           'rest_framework_simplejwt.authentication.JWTAuthentication',
+           # JWT users come from the users cache rather than a query.
+           'store_app.authentication.CachedJWTAuthentication',
        ],
        'DEFAULT_PERMISSION_CLASSES': [
          'rest_framework.permissions.AllowAny',
-] }
+],
+       # orjson-backed JSON, falling back to the json module when orjson is not installed.
+       'DEFAULT_RENDERER_CLASSES': [
+           'store_app.fastjson.FastJSONRenderer',
+           'rest_framework.renderers.BrowsableAPIRenderer',
+       ],
+       'DEFAULT_PARSER_CLASSES': [
+           'store_app.fastjson.FastJSONParser',
+           'rest_framework.parsers.FormParser',
+           'rest_framework.parsers.MultiPartParser',
+       ],
+}
 
 
 
@@ -154,15 +180,146 @@ if APP_NAME:
   MEDIA_ROOT = '/mnt/volume_mount/media/'
 
 
+# Resized WebP derivatives of product images are built in this many worker
+# processes after upload; 0 builds them inline in the request.
+IMAGE_DERIVATIVE_WORKERS = int(os.getenv('IMAGE_DERIVATIVE_WORKERS', 1))
+
 
 # Database
 # https://docs.djangoproject.com/en/5.0/ref/settings/#databases
 
+# SQLite is shared by two gunicorn workers, so connections run in WAL mode
+# (readers never block on the writer) and wait on busy_timeout rather than
+# failing with "database is locked". Every value can be tuned per deploy.
+# The committed dev db.sqlite3 keeps the default rollback journal, since WAL
+# rewrites its header and leaves -wal/-shm files next to it.
+SQLITE_PRAGMAS = {
+    'journal_mode': os.getenv('SQLITE_JOURNAL_MODE', 'wal' if APP_NAME else 'delete'),
+    'synchronous': os.getenv('SQLITE_SYNCHRONOUS', 'normal'),
+    'busy_timeout': int(os.getenv('SQLITE_BUSY_TIMEOUT_MS', 5000)),
+    'mmap_size': int(os.getenv('SQLITE_MMAP_SIZE', 128 * 1024 * 1024)),
+    # Negative values are KiB rather than pages.
+    'cache_size': int(os.getenv('SQLITE_CACHE_SIZE', -32000)),
+    'temp_store': 'memory',
+}
+
+# Retries for write transactions that still can't get the lock in time.
+SQLITE_WRITE_RETRIES = int(os.getenv('SQLITE_WRITE_RETRIES', 3))
+SQLITE_WRITE_BACKOFF = float(os.getenv('SQLITE_WRITE_BACKOFF', 0.05))
+
+# Idempotency-Key replays: how long a stored response is replayed, how long a
+# duplicate waits for the first request to finish, and when an unfinished
+# first request is presumed dead and its key can be claimed again (seconds).
+IDEMPOTENCY_KEY_TTL = int(os.getenv('IDEMPOTENCY_KEY_TTL', 24 * 60 * 60))
+IDEMPOTENCY_WAIT = float(os.getenv('IDEMPOTENCY_WAIT', 10))
+IDEMPOTENCY_LOCK_TIMEOUT = int(os.getenv('IDEMPOTENCY_LOCK_TIMEOUT', 60))
+
+# How long an order awaiting payment holds its stock before
+# release_expired_reservations gives it back (seconds).
+STOCK_RESERVATION_TTL = int(os.getenv('STOCK_RESERVATION_TTL', 30 * 60))
+
 DATABASES = {
-	'default': {
-    		'ENGINE': 'django.db.backends.sqlite3',
-    		'NAME': DATABASE_PATH if APP_NAME else BASE_DIR / 'db.sqlite3',
-	}
+    'default': {
+        'ENGINE': 'store_app.sqlite_backend',
+        'NAME': DATABASE_PATH if APP_NAME else BASE_DIR / 'db.sqlite3',
+        # The app is served over ASGI, where each request's sync code runs in
+        # a fresh thread and so opens its own connection (and runs the
+        # PRAGMAs above) whatever CONN_MAX_AGE says. Keeping them open would
+        # only leave idle connections behind, so they close after each
+        # request; opening a local SQLite file costs well under a millisecond.
+        'CONN_MAX_AGE': int(os.getenv('CONN_MAX_AGE', 0)),
+        'CONN_HEALTH_CHECKS': True,
+        'OPTIONS': {
+            'pragmas': SQLITE_PRAGMAS,
+        },
+        'TEST': {
+            # A file, not the default in-memory database, so tests see WAL and
+            # real cross-connection locking, as the deployed database does.
+            'NAME': BASE_DIR / 'test_db.sqlite3',
+            'PRAGMAS': {'journal_mode': 'wal'},
+        },
+    }
+}
+
+# Cache
+# https://docs.djangoproject.com/en/5.0/topics/cache/
+#
+# The catalog cache holds rendered product/category payloads. Local memory is
+# per-process, so on fly (two gunicorn workers) it defaults to the file backend
+# on the volume, where a version bump from one worker is seen by the other.
+
+CACHE_BACKENDS = {
+    'locmem': 'django.core.cache.backends.locmem.LocMemCache',
+    'file': 'django.core.cache.backends.filebased.FileBasedCache',
+}
+
+CATALOG_CACHE_BACKEND = os.getenv('CATALOG_CACHE_BACKEND', 'file' if APP_NAME else 'locmem')
+CATALOG_CACHE_LOCATION = os.getenv(
+    'CATALOG_CACHE_LOCATION',
+    '/mnt/volume_mount/cache/catalog' if CATALOG_CACHE_BACKEND == 'file' else 'catalog',
+)
+CATALOG_CACHE_TIMEOUT = int(os.getenv('CATALOG_CACHE_TIMEOUT', 60 * 15))
+CATALOG_CACHE_ALIAS = 'catalog'
+
+# Sessions live in django_session by default: persistent, shared by every
+# worker and revocable on logout. SESSION_STORAGE=cached_db adds read-through
+# caching in the sessions cache. SESSION_STORAGE=cache keeps them only in
+# that cache, so anonymous carts never take the SQLite write lock; opt in
+# only with a cache that holds every live session, since Django's file cache
+# scans its directory on each write and, past MAX_ENTRIES, deletes a random
+# third of the entries, logging those users out. SESSION_STORAGE=cookie puts
+# them in signed cookies; a stolen cookie then stays valid until it expires,
+# logout or not, so only use it without session logins (admin). The cache
+# and cookie stores still read sessions left in django_session and move
+# them over.
+SESSION_ENGINES = {
+    'cookie': 'store_app.sessions.cookie',
+    'cache': 'store_app.sessions.cache',
+    'cached_db': 'django.contrib.sessions.backends.cached_db',
+    'db': 'django.contrib.sessions.backends.db',
+}
+SESSION_STORAGE = os.getenv('SESSION_STORAGE', 'db')
+SESSION_ENGINE = SESSION_ENGINES[SESSION_STORAGE]
+SESSION_CACHE_ALIAS = 'sessions'
+SESSION_CACHE_BACKEND = os.getenv('SESSION_CACHE_BACKEND', 'file' if APP_NAME else 'locmem')
+SESSION_CACHE_LOCATION = os.getenv(
+    'SESSION_CACHE_LOCATION',
+    '/mnt/volume_mount/cache/sessions' if SESSION_CACHE_BACKEND == 'file' else 'sessions',
+)
+
+# Users authenticated by JWT, with their profiles, are kept in a per-process
+# LRU of USER_CACHE_SIZE entries. Saves drop a user's entry in the worker that
+# made them; other workers see the change within USER_CACHE_TIMEOUT seconds.
+USER_CACHE_ALIAS = 'users'
+USER_CACHE_SIZE = int(os.getenv('USER_CACHE_SIZE', 1000))
+USER_CACHE_TIMEOUT = int(os.getenv('USER_CACHE_TIMEOUT', 5 * 60))
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    CATALOG_CACHE_ALIAS: {
+        'BACKEND': CACHE_BACKENDS[CATALOG_CACHE_BACKEND],
+        'LOCATION': CATALOG_CACHE_LOCATION,
+        'OPTIONS': {
+            'MAX_ENTRIES': 5000,
+        },
+    },
+    SESSION_CACHE_ALIAS: {
+        'BACKEND': CACHE_BACKENDS[SESSION_CACHE_BACKEND],
+        'LOCATION': SESSION_CACHE_LOCATION,
+        'OPTIONS': {
+            'MAX_ENTRIES': 50000,
+        },
+    },
+    USER_CACHE_ALIAS: {
+        'BACKEND': CACHE_BACKENDS['locmem'],
+        'LOCATION': 'users',
+        'TIMEOUT': USER_CACHE_TIMEOUT,
+        'OPTIONS': {
+            'MAX_ENTRIES': USER_CACHE_SIZE,
+        },
+    },
 }
 
 SIMPLE_JWT = {
@@ -16,7 +16,6 @@ Including another URLconf
 """
 from django.contrib import admin
 from django.urls import path, include
-from rest_framework_simplejwt.views import TokenObtainPairView
 from store_app.views import *
 from django.conf import settings
 from django.conf.urls.static import static
@@ -24,13 +23,16 @@ from django.conf.urls.static import static
 
 urlpatterns = [
     path('admin/', admin.site.urls),
-    path('token/', TokenObtainPairView.as_view(), name='token_obtain_pair'),
+    path('token/', CartMergingTokenObtainPairView.as_view(), name='token_obtain_pair'),
     path('products/', get_products, name='get_products'),
+    path('products/search/', search_products, name='search_products'),
     path('products/<int:pk>/', get_product_detail, name='get_product_detail'),
+    path('products/<int:pk>/reviews/', product_reviews, name='product_reviews'),
     path('user/create/', create_user, name='create_user'),
     path('user/profile/', get_profile, name='get_profile'),
     path('cart/', get_cart, name='get_cart'),
     path('cart/add/', add_to_cart, name='add_to_cart'),
+    path('cart/batch/', update_cart, name='update_cart'),
     path('orders/', create_order, name='create_order'),
     path('orders/get/', get_orders, name='get_orders'),
     path('products/add/', add_product, name='add_product'),
@@ -41,9 +43,11 @@ urlpatterns = [
     path('checkout/', checkout, name='checkout'),
     path('create-payment-intent/', create_payment_intent, name='create-payment-intent'),
     path('create-confirm-intent/', create_confirm_intent, name='create-confirm-intent'),
+    path('stripe/webhook/', stripe_webhook, name='stripe-webhook'),
     path('cart/<int:pk>/delete/', delete_cart_item, name='delete_cart_item'),
     path('orders/confirm/', confirm_order, name='confirm_order'),
     path('categories/', category_list, name='category-list'),
+    path('metrics', prometheus_metrics, name='metrics'),
 
 ]
 if settings.DEBUG:
@@ -0,0 +1,17 @@
+#!/usr/bin/env bash
+# Container entry point: the web server and the expired-reservation sweeper,
+# which has to run on the machine that holds the SQLite volume. If either
+# process exits the other is stopped and the container exits with its
+# status, so the platform restarts both rather than the sweeper staying dead.
+set -u
+
+python manage.py release_expired_reservations --every 300 &
+gunicorn --bind 0.0.0.0:8000 --workers 2 --worker-class uvicorn_worker.UvicornWorker \
+    nepali_store_project.asgi:application &
+
+trap 'kill -TERM $(jobs -p) 2>/dev/null' TERM INT
+wait -n
+status=$?
+kill -TERM $(jobs -p) 2>/dev/null
+wait
+exit $status
@@ -1,5 +1,6 @@
 from django.contrib import admin
 from store_app.models import *
+from store_app.search import matching_product_ids
 
 
 class ProfileAdmin(admin.ModelAdmin):
@@ -15,11 +16,17 @@ class ProductImageInline(admin.TabularInline):
 
 
 class ProductAdmin(admin.ModelAdmin):
-    list_display = ('name', 'description', 'price', 'category')
+    list_display = ('name', 'description', 'price', 'stock', 'category')
     list_filter = ('category',)
     search_fields = ('name', 'description')
     inlines = [ProductImageInline]
 
+    def get_search_results(self, request, queryset, search_term):
+        # Served from the FTS5 index instead of LIKE '%term%' scans.
+        if not search_term.strip():
+            return queryset, False
+        return queryset.filter(pk__in=matching_product_ids(search_term)), False
+
 admin.site.register(Product, ProductAdmin)
 
 
@@ -48,7 +55,9 @@ class OrderItemInline(admin.TabularInline):
 
 
 class OrderAdmin(admin.ModelAdmin):
-    list_display = ('user', 'created_at', 'total_price')
+    list_display = ('user', 'created_at', 'total_price', 'status')
+    list_filter = ('status',)
+    search_fields = ('payment_intent_id',)
     inlines = [OrderItemInline]
 
 admin.site.register(Order, OrderAdmin)
@@ -0,0 +1,67 @@
+"""
+JWT authentication that doesn't look the user up in SQLite.
+
+StatelessJWTAuthentication is for read-only views that only need the user's
+id: it trusts the verified token's claims and hands the view a TokenUser.
+CachedJWTAuthentication returns real User objects, with their profile
+loaded, from the users cache - a bounded per-process LRU whose entries also
+expire after USER_CACHE_TIMEOUT seconds. Saving or deleting a User or
+Profile drops its entry; other workers see the change once theirs expires.
+"""
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import caches
+from django.db import transaction
+from django.utils.translation import gettext_lazy as _
+from rest_framework_simplejwt.authentication import JWTAuthentication, JWTStatelessUserAuthentication
+from rest_framework_simplejwt.exceptions import AuthenticationFailed, InvalidToken
+from rest_framework_simplejwt.settings import api_settings
+
+
+def user_cache():
+    return caches[settings.USER_CACHE_ALIAS]
+
+
+def user_cache_key(user_id):
+    return f'user:{user_id}'
+
+
+def cached_user(user_id):
+    """The user with user_id, their profile selected along, or None."""
+    cache = user_cache()
+    key = user_cache_key(user_id)
+    user = cache.get(key)
+    if user is None:
+        user = get_user_model().objects.select_related('profile').filter(pk=user_id).first()
+        if user is not None:
+            cache.set(key, user)
+    return user
+
+
+def forget_user(user_id):
+    # Now, so this connection doesn't read its own old copy back, and again
+    # on commit for anyone who cached the old row in the meantime.
+    user_cache().delete(user_cache_key(user_id))
+    transaction.on_commit(lambda: user_cache().delete(user_cache_key(user_id)))
+
+
+class CachedJWTAuthentication(JWTAuthentication):
+    def get_user(self, validated_token):
+        try:
+            user_id = validated_token[api_settings.USER_ID_CLAIM]
+        except KeyError:
+            raise InvalidToken(_('Token contained no recognizable user identification'))
+
+        user = cached_user(user_id)
+        if user is None:
+            raise AuthenticationFailed(_('User not found'), code='user_not_found')
+        if not user.is_active:
+            raise AuthenticationFailed(_('User is inactive'), code='user_inactive')
+        return user
+
+
+class StatelessJWTAuthentication(JWTStatelessUserAuthentication):
+    """
+    The token's claims are the user: request.user is a TokenUser with the
+    token's user id, so views must filter on user_id=request.user.pk.
+    """
@@ -0,0 +1,68 @@
+import math
+from contextlib import contextmanager
+
+from django.db import connection
+from django.test.utils import setup_test_environment, teardown_test_environment
+
+
+@contextmanager
+def throwaway_database():
+    """
+    Run a benchmark against a freshly migrated test database so seeding never
+    touches the real one. The test environment is set up as well, which lets
+    the Django test client talk to the app.
+    """
+    old_name = connection.settings_dict['NAME']
+    setup_test_environment()
+    connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+    try:
+        yield
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=0)
+        teardown_test_environment()
+
+
+def percentile(samples, pct):
+    ordered = sorted(samples)
+    rank = max(math.ceil(pct / 100 * len(ordered)) - 1, 0)
+    return ordered[rank]
+
+
+def summarize(timings, queries, sizes):
+    """Collapse per-request samples for one route into its reported numbers."""
+    return {
+        'runs': len(timings),
+        'p50_ms': round(percentile(timings, 50), 3),
+        'p95_ms': round(percentile(timings, 95), 3),
+        'p99_ms': round(percentile(timings, 99), 3),
+        'queries': percentile(queries, 50),
+        'max_queries': max(queries),
+        'bytes': percentile(sizes, 50),
+    }
+
+
+# Latencies are noisy, so they only count as changed beyond a threshold;
+# query counts and payload sizes are deterministic and any change counts.
+TIMED_METRICS = ('p50_ms', 'p95_ms', 'p99_ms')
+EXACT_METRICS = ('queries', 'max_queries', 'bytes')
+
+
+def compare(results, baseline, threshold):
+    """
+    Diff two {route: summary} mappings, returning a row per metric that moved:
+    (route, metric, before, after, percent change, regressed).
+    """
+    rows = []
+    for route, after in results.items():
+        before = baseline.get(route)
+        if before is None:
+            continue
+        for metric in TIMED_METRICS + EXACT_METRICS:
+            old, new = before.get(metric), after.get(metric)
+            if old is None or new is None or old == new:
+                continue
+            change = (new - old) / old * 100 if old else math.inf
+            if metric in TIMED_METRICS and abs(change) < threshold:
+                continue
+            rows.append((route, metric, old, new, change, new > old))
+    return rows
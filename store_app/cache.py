@@ -0,0 +1,69 @@
+import hashlib
+import time
+from functools import wraps
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+from rest_framework import status
+from rest_framework.response import Response
+
+CATALOG_VERSION_KEY = 'catalog:version'
+
+
+def catalog_cache():
+    return caches[settings.CATALOG_CACHE_ALIAS]
+
+
+def _fresh_version():
+    # Seeded from the clock rather than 1 so a version key that was evicted
+    # can never come back as a number older entries were stored under.
+    return int(time.time() * 1000)
+
+
+def catalog_version():
+    cache = catalog_cache()
+    version = cache.get(CATALOG_VERSION_KEY)
+    if version is None:
+        cache.add(CATALOG_VERSION_KEY, _fresh_version(), timeout=None)
+        version = cache.get(CATALOG_VERSION_KEY)
+    return version
+
+
+def bump_catalog_version():
+    cache = catalog_cache()
+    try:
+        cache.incr(CATALOG_VERSION_KEY)
+    except ValueError:
+        cache.set(CATALOG_VERSION_KEY, _fresh_version(), timeout=None)
+
+
+def invalidate_catalog():
+    # Bump only once the write is visible to other connections, otherwise a
+    # concurrent reader could cache the old rows under the new version.
+    transaction.on_commit(bump_catalog_version)
+
+
+def catalog_cache_key(request):
+    url = request.build_absolute_uri().encode()
+    return f'catalog:{catalog_version()}:{hashlib.md5(url).hexdigest()}'
+
+
+def cache_catalog_response(view):
+    """
+    Serve a read-only catalog view from the catalog cache. Successful
+    payloads are stored under the current catalog version, so a bump from
+    invalidate_catalog() retires every cached page at once.
+    """
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        cache = catalog_cache()
+        key = catalog_cache_key(request)
+        data = cache.get(key)
+        if data is not None:
+            return Response(data, status=status.HTTP_200_OK)
+        response = view(request, *args, **kwargs)
+        if response.status_code == status.HTTP_200_OK:
+            cache.set(key, response.data, settings.CATALOG_CACHE_TIMEOUT)
+        return response
+    return wrapper
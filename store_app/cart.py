@@ -0,0 +1,268 @@
+from decimal import Decimal
+
+from django.db import connection
+from django.db.models import DecimalField, ExpressionWrapper, F, OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
+
+from .db import write_transaction
+from .models import Cart, CartProduct, Product
+
+TOTAL_FIELD = DecimalField(max_digits=10, decimal_places=2)
+
+
+class ProductNotFound(Product.DoesNotExist):
+    def __init__(self, product_ids):
+        self.product_ids = product_ids
+        super().__init__(f'Product with ID {product_ids[0]} not found')
+
+
+def cart_lines(cart):
+    """All lines of a database cart with their products, in one joined query."""
+    return CartProduct.objects.filter(cart=cart).select_related('product')
+
+
+def user_cart_lines(user):
+    # Filtering through the cart relation skips a separate Cart lookup. By id,
+    # so user can also be a TokenUser.
+    return CartProduct.objects.filter(cart__user_id=user.pk).select_related('product')
+
+
+def session_cart_quantities(session):
+    """
+    Map product id -> quantity for the anonymous cart. Older sessions store
+    a product dict per line instead of a bare quantity; both are accepted.
+    """
+    quantities = {}
+    for product_id, value in session.get('cart', {}).items():
+        quantities[str(product_id)] = value['quantity'] if isinstance(value, dict) else value
+    return quantities
+
+
+def compact_session_cart(session):
+    """
+    Rewrite an older session cart as product id -> quantity, in place.
+    Returns whether anything changed.
+    """
+    if not any(isinstance(value, dict) for value in session.get('cart', {}).values()):
+        return False
+    session['cart'] = session_cart_quantities(session)
+    return True
+
+
+def add_to_session_cart(session, product_id, quantity):
+    """Add quantity of a product to the anonymous cart and return the new line quantity."""
+    cart = session_cart_quantities(session)
+    cart[str(product_id)] = cart.get(str(product_id), 0) + quantity
+    session['cart'] = cart
+    return cart[str(product_id)]
+
+
+def cart_item(line_id, product, quantity):
+    return {
+        'id': line_id,
+        'product': {
+            'id': product.id,
+            'name': product.name,
+            'price': product.price,
+        },
+        'quantity': quantity,
+    }
+
+
+def read_cart(request):
+    """
+    The current shopper's cart as a list of items, costing one query for
+    both database and session carts.
+    """
+    if request.user.is_authenticated:
+        return [cart_item(line.id, line.product, line.quantity) for line in user_cart_lines(request.user)]
+
+    quantities = session_cart_quantities(request.session)
+    products = Product.objects.in_bulk([int(product_id) for product_id in quantities])
+    return [
+        cart_item(product_id, products[int(product_id)], quantity)
+        for product_id, quantity in quantities.items()
+        if int(product_id) in products
+    ]
+
+
+def product_prices(product_ids):
+    """
+    {product id: price} for product_ids in one query. Raises ProductNotFound
+    if any of them is unknown.
+    """
+    prices = dict(Product.objects.filter(pk__in=product_ids).values_list('pk', 'price'))
+    missing = [product_id for product_id in product_ids if product_id not in prices]
+    if missing:
+        raise ProductNotFound(missing)
+    return prices
+
+
+def fold_cart_operations(quantities, operations):
+    """
+    Apply add/set/remove operations, in order, on top of {product id:
+    quantity} and return the quantity each touched product ends with, 0 for
+    the ones removed.
+    """
+    result = {}
+    for operation in operations:
+        product_id = operation['product_id']
+        if operation['op'] == 'add':
+            result[product_id] = result.get(product_id, quantities.get(product_id, 0)) + operation['quantity']
+        elif operation['op'] == 'set':
+            result[product_id] = operation['quantity']
+        else:
+            result[product_id] = 0
+    return result
+
+
+@write_transaction
+def apply_cart_operations(user, operations):
+    """
+    Apply a batch of cart operations to the user's cart in the same few
+    statements however many lines it touches: the products' prices and the
+    lines the cart already has are read in one query each, every changed
+    line is written by one INSERT ... ON CONFLICT (cart, product) DO UPDATE,
+    removed lines go in one DELETE and the total moves in one UPDATE.
+    Raises ProductNotFound, writing nothing, if any product is unknown.
+    """
+    product_ids = list(dict.fromkeys(operation['product_id'] for operation in operations))
+    prices = product_prices(product_ids)
+    cart, created = Cart.objects.get_or_create(user=user)
+    current = dict(
+        CartProduct.objects.filter(cart=cart, product_id__in=product_ids).values_list('product_id', 'quantity')
+    )
+    quantities = fold_cart_operations(current, operations)
+
+    CartProduct.objects.bulk_create(
+        [
+            CartProduct(cart=cart, product_id=product_id, quantity=quantity)
+            for product_id, quantity in quantities.items()
+            if quantity and quantity != current.get(product_id)
+        ],
+        update_conflicts=True, unique_fields=['cart', 'product'], update_fields=['quantity'],
+    )
+    removed = [product_id for product_id, quantity in quantities.items() if not quantity and product_id in current]
+    if removed:
+        CartProduct.objects.filter(cart=cart, product_id__in=removed).delete()
+    delta = sum(prices[product_id] * (quantity - current.get(product_id, 0)) for product_id, quantity in quantities.items())
+    if delta:
+        adjust_cart_total(cart.pk, delta)
+    return cart
+
+
+def apply_session_cart_operations(session, operations):
+    """apply_cart_operations() for the anonymous cart, checking the products exist in one query."""
+    product_prices(list(dict.fromkeys(operation['product_id'] for operation in operations)))
+    cart = {int(product_id): quantity for product_id, quantity in session_cart_quantities(session).items()}
+    cart.update(fold_cart_operations(cart, operations))
+    session['cart'] = {str(product_id): quantity for product_id, quantity in cart.items() if quantity}
+
+
+def merge_session_cart(user, session):
+    """
+    Move the anonymous cart in session into the user's cart and empty it.
+    Products deleted since they were added are dropped.
+    """
+    quantities = {
+        int(product_id): quantity for product_id, quantity in session_cart_quantities(session).items() if quantity > 0
+    }
+    if quantities:
+        add_cart_lines(user, quantities)
+    session.pop('cart', None)
+
+
+@write_transaction
+def add_cart_lines(user, quantities):
+    """
+    Add {product id: quantity} to the user's cart with a fixed number of
+    statements however many lines there are: every line goes in one INSERT
+    that adds its quantity to the user's existing line for the product on
+    conflict with unique_cart_product, and the total moves in one UPDATE.
+    """
+    prices = dict(Product.objects.filter(pk__in=quantities).values_list('pk', 'price'))
+    lines = [(product_id, quantity) for product_id, quantity in quantities.items() if product_id in prices]
+    if not lines:
+        return
+    cart, created = Cart.objects.get_or_create(user=user)
+    table = connection.ops.quote_name(CartProduct._meta.db_table)
+    with connection.cursor() as cursor:
+        # bulk_create(update_conflicts=True) can only overwrite the quantity.
+        cursor.execute(
+            f'INSERT INTO {table} (cart_id, product_id, quantity) VALUES {", ".join(["(%s, %s, %s)"] * len(lines))} '
+            'ON CONFLICT (cart_id, product_id) DO UPDATE SET quantity = quantity + excluded.quantity',
+            [value for product_id, quantity in lines for value in (cart.pk, product_id, quantity)],
+        )
+    adjust_cart_total(cart.pk, sum(prices[product_id] * quantity for product_id, quantity in lines))
+
+
+@write_transaction
+def add_to_user_cart(user, product, quantity):
+    """
+    Add quantity of product to the user's cart and return its CartProduct.
+    The line and the total both move by deltas under the write lock, so
+    concurrent adds can't lose an increment the total has counted.
+    """
+    add_cart_lines(user, {product.pk: quantity})
+    return CartProduct.objects.get(cart__user=user, product=product)
+
+
+@write_transaction
+def remove_cart_line(cart_product_id):
+    """Delete a cart line and take it out of its cart's total."""
+    cart_product = CartProduct.objects.select_related('product').get(pk=cart_product_id)
+    cart_product.delete()
+    adjust_cart_total(cart_product.cart_id, -cart_product.product.price * cart_product.quantity)
+
+
+def adjust_cart_total(cart_id, amount):
+    """Apply a price delta to a cart's running total in one atomic UPDATE."""
+    Cart.objects.filter(pk=cart_id).update(total_price=F('total_price') + amount)
+
+
+def reprice_carts(product, old_price):
+    """
+    Shift the total of every cart holding ``product`` by the price change
+    times that cart's quantity, in one statement.
+    """
+    quantity = CartProduct.objects.filter(cart=OuterRef('pk'), product=product).values('quantity')[:1]
+    Cart.objects.filter(cart_products__product=product).update(
+        total_price=F('total_price') + (product.price - old_price) * Subquery(quantity)
+    )
+
+
+def remove_from_carts(product):
+    """
+    Take ``product``'s lines, at their stored price, out of every cart
+    total before the product and its cart lines are deleted.
+    """
+    line_total = (
+        CartProduct.objects.filter(cart=OuterRef('pk'), product=product)
+        .annotate(total=ExpressionWrapper(F('quantity') * F('product__price'), output_field=TOTAL_FIELD))
+        .values('total')[:1]
+    )
+    Cart.objects.filter(cart_products__product=product).update(
+        total_price=F('total_price') - Subquery(line_total, output_field=TOTAL_FIELD)
+    )
+
+
+def computed_cart_totals(cart_product_model=CartProduct):
+    line_totals = (
+        cart_product_model.objects.filter(cart=OuterRef('pk'))
+        .values('cart')
+        .annotate(total=Sum(ExpressionWrapper(F('quantity') * F('product__price'), output_field=TOTAL_FIELD)))
+        .values('total')
+    )
+    return Coalesce(Subquery(line_totals, output_field=TOTAL_FIELD), Value(Decimal('0')), output_field=TOTAL_FIELD)
+
+
+def rebuild_cart_totals(cart_model=Cart, cart_product_model=CartProduct):
+    """
+    Recompute every cart total from its lines. Returns the number of carts.
+    Migrations pass their historical models.
+    """
+    return cart_model.objects.update(total_price=computed_cart_totals(cart_product_model))
+
+
+def mismatched_cart_totals():
+    return Cart.objects.annotate(expected=computed_cart_totals()).exclude(total_price=F('expected'))
@@ -0,0 +1,55 @@
+import random
+import time
+from contextlib import contextmanager
+from functools import wraps
+
+from django.conf import settings
+from django.db import OperationalError, transaction
+
+
+@contextmanager
+def immediate_atomic(using=None):
+    """
+    transaction.atomic() that opens with BEGIN IMMEDIATE when it is the
+    outermost block, so the write lock is taken (waiting up to busy_timeout)
+    before the first read instead of on the first write.
+    """
+    connection = transaction.get_connection(using)
+    connection.begin_immediate = True
+    try:
+        with transaction.atomic(using=using):
+            # Only the BEGIN needed it; nested blocks are savepoints.
+            connection.begin_immediate = False
+            yield
+    finally:
+        connection.begin_immediate = False
+
+
+def is_lock_error(error):
+    message = str(error)
+    return 'database is locked' in message or 'database table is locked' in message
+
+
+def write_transaction(func=None, *, using=None):
+    """
+    Run ``func`` in an immediate_atomic() block, retrying with jittered
+    exponential backoff if the write lock can't be had within busy_timeout.
+    Only the outermost transaction retries: inside an existing atomic block
+    the error is re-raised for the caller's transaction to handle.
+    """
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            attempts = settings.SQLITE_WRITE_RETRIES + 1
+            for attempt in range(attempts):
+                try:
+                    with immediate_atomic(using=using):
+                        return func(*args, **kwargs)
+                except OperationalError as e:
+                    connection = transaction.get_connection(using)
+                    if not is_lock_error(e) or connection.in_atomic_block or attempt == attempts - 1:
+                        raise
+                    delay = settings.SQLITE_WRITE_BACKOFF * 2 ** attempt
+                    time.sleep(delay + random.uniform(0, delay))
+        return wrapper
+    return decorator(func) if func is not None else decorator
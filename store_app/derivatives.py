@@ -0,0 +1,56 @@
+"""
+Resized WebP derivatives of uploaded product images.
+
+This module only depends on Pillow so it can be imported by worker
+processes that never set up Django; reading the source and writing the
+results through the storage backend is left to store_app.images.
+"""
+import io
+import os
+
+from PIL import Image, ImageOps
+
+# name -> maximum width in pixels
+DERIVATIVE_WIDTHS = {
+    'thumbnail': 160,
+    'card': 480,
+    'detail': 1200,
+}
+DERIVATIVE_DIR = 'derivatives'
+WEBP_QUALITY = 80
+
+
+def derivative_name(name, size):
+    directory, filename = os.path.split(name)
+    stem = os.path.splitext(filename)[0]
+    return os.path.join(directory, DERIVATIVE_DIR, f'{stem}-{size}.webp')
+
+
+def thumbnail_name(name, variants):
+    """The thumbnail derivative of name, or name itself if it has none yet."""
+    return variants.get('sizes', {}).get('thumbnail', {}).get('name') or name
+
+
+def render_derivatives(data, name):
+    """
+    Encode every derivative of the image ``data`` stored as ``name`` and
+    return the source dimensions, a {size: {name, width, height}} map and
+    the encoded files as {name: bytes}.
+    Images narrower than a size are re-encoded, never upscaled.
+    """
+    with Image.open(io.BytesIO(data)) as original:
+        image = ImageOps.exif_transpose(original)
+        image = image.convert('RGBA' if image.mode in ('RGBA', 'LA', 'P') else 'RGB')
+        width, height = image.size
+
+        sizes, files = {}, {}
+        for size, max_width in DERIVATIVE_WIDTHS.items():
+            resized = image.copy()
+            resized.thumbnail((max_width, max_width * height // width or 1), Image.LANCZOS)
+            path = derivative_name(name, size)
+            buffer = io.BytesIO()
+            resized.save(buffer, 'WEBP', quality=WEBP_QUALITY, method=4)
+            files[path] = buffer.getvalue()
+            sizes[size] = {'name': path, 'width': resized.width, 'height': resized.height}
+
+    return {'source': name, 'width': width, 'height': height, 'sizes': sizes, 'files': files}
@@ -0,0 +1,129 @@
+"""
+A local stand-in for the parts of the Stripe API the store uses, for tests
+and benchmarks. Point stripe-python at it with::
+
+    with FakeStripe(latency=0.2) as fake:
+        ...
+
+which serves POST /v1/payment_intents and GET /v1/payment_intents/<id>
+on an ephemeral port and swaps stripe.api_base for the duration.
+signed_event() builds webhook deliveries for the intents it holds.
+"""
+import itertools
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl
+
+import stripe
+
+
+class FakeStripe:
+    def __init__(self, latency=0.0, email='buyer@example.com'):
+        self.latency = latency
+        self.email = email
+        self.intents = {}
+        self.requests = []
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+
+    def __enter__(self):
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), self._handler())
+        self.server.daemon_threads = True
+        self._thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self._thread.start()
+        self._api_base = stripe.api_base
+        stripe.api_base = f'http://127.0.0.1:{self.server.server_port}'
+        return self
+
+    def __exit__(self, *exc_info):
+        stripe.api_base = self._api_base
+        self.server.shutdown()
+        self.server.server_close()
+
+    def create_intent(self, amount, confirm=False, **fields):
+        with self._lock:
+            intent_id = f'pi_fake_{next(self._ids)}'
+            self.intents[intent_id] = {
+                'id': intent_id,
+                'object': 'payment_intent',
+                'amount': amount,
+                'amount_received': 0,
+                'currency': fields.get('currency', 'usd'),
+                'client_secret': f'{intent_id}_secret_fake',
+                'status': 'requires_payment_method',
+                'charges': {'object': 'list', 'data': []},
+                'metadata': {},
+            }
+        if confirm:
+            self.succeed(intent_id)
+        return self.intents[intent_id]
+
+    def succeed(self, intent_id, email=None):
+        intent = self.intents[intent_id]
+        intent.update(
+            status='succeeded',
+            amount_received=intent['amount'],
+            charges={'object': 'list', 'data': [{
+                'object': 'charge',
+                'amount': intent['amount'],
+                'billing_details': {'email': email or self.email},
+            }]},
+        )
+        return intent
+
+    def signed_event(self, intent_id, secret, event_type='payment_intent.succeeded'):
+        """
+        Return (payload, Stripe-Signature header) for a webhook event about
+        the intent, signed with the endpoint secret the way Stripe does.
+        """
+        payload = json.dumps({
+            'id': f'evt_fake_{next(self._ids)}',
+            'object': 'event',
+            'type': event_type,
+            'data': {'object': self.intents[intent_id]},
+        })
+        timestamp = int(time.time())
+        signature = stripe.WebhookSignature._compute_signature(f'{timestamp}.{payload}', secret)
+        return payload, f't={timestamp},v1={signature}'
+
+    def _handler(self):
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, format, *args):
+                pass
+
+            def _reply(self, status, body):
+                payload = json.dumps(body).encode()
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def _not_found(self):
+                self._reply(404, {'error': {'type': 'invalid_request_error', 'message': f'No such resource: {self.path}'}})
+
+            def do_GET(self):
+                fake.requests.append(('GET', self.path))
+                time.sleep(fake.latency)
+                prefix = '/v1/payment_intents/'
+                intent_id = self.path[len(prefix):] if self.path.startswith(prefix) else None
+                if intent_id not in fake.intents:
+                    return self._not_found()
+                self._reply(200, fake.intents[intent_id])
+
+            def do_POST(self):
+                fake.requests.append(('POST', self.path))
+                time.sleep(fake.latency)
+                if self.path != '/v1/payment_intents':
+                    return self._not_found()
+                length = int(self.headers.get('Content-Length', 0))
+                params = dict(parse_qsl(self.rfile.read(length).decode()))
+                intent = fake.create_intent(int(params['amount']), confirm=params.get('confirm', '').lower() == 'true',
+                                            currency=params.get('currency', 'usd'))
+                self._reply(200, intent)
+
+        return Handler
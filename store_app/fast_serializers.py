@@ -0,0 +1,164 @@
+"""
+Read-only serialization for the hot list endpoints.
+
+These build the same dicts as ProductSerializer, OrderSerializer and
+CategorySerializer - same keys, same order, same formatting - straight from
+values() rows, skipping model instances and per-instance serializer fields.
+Decimals and datetimes are formatted by shared DRF field objects so the
+output stays identical. Keep the field lists in step with serializers.py;
+the tests compare the two byte for byte.
+"""
+from functools import lru_cache
+
+from django.core.files.storage import FileSystemStorage, default_storage
+from rest_framework import serializers
+
+from .metrics import serializes
+from .models import Category, OrderItem, Product, ProductImage
+from .ratings import STARS
+
+RATING_FIELDS = ('rating__count', 'rating__total', 'rating__stars_1', 'rating__stars_2', 'rating__stars_3',
+                 'rating__stars_4', 'rating__stars_5')
+PRODUCT_FIELDS = ('id', 'name', 'description', 'price', 'category_id', 'created_at', 'image', 'image_width',
+                  'image_height', 'image_variants') + RATING_FIELDS
+IMAGE_FIELDS = ('id', 'product_id', 'image', 'image_width', 'image_height', 'image_variants')
+ORDER_FIELDS = ('id', 'user_id', 'user__username', 'user__email', 'user__first_name', 'user__last_name',
+                'created_at', 'total_price', 'payment_intent_id', 'status')
+ORDER_ITEM_FIELDS = ('id', 'order_id', 'product_id', 'product_name', 'product_image', 'quantity', 'price')
+
+_money = serializers.DecimalField(max_digits=10, decimal_places=2)
+_datetime = serializers.DateTimeField()
+
+
+def media_url(name):
+    """
+    default_storage.url(name), or None for an empty file field. Local storage
+    URLs depend only on the name and MEDIA_URL, so those are memoized.
+    """
+    if not name:
+        return None
+    if isinstance(default_storage, FileSystemStorage):
+        return _local_media_url(default_storage.base_url, name)
+    return default_storage.url(name)
+
+
+@lru_cache(maxsize=8192)
+def _local_media_url(base_url, name):
+    return default_storage.url(name)
+
+
+def image_sizes(variants):
+    return {
+        size: {'url': media_url(variant['name']), 'width': variant['width'], 'height': variant['height']}
+        for size, variant in variants.get('sizes', {}).items()
+    }
+
+
+def image_srcset(variants):
+    return ', '.join(f"{media_url(variant['name'])} {variant['width']}w" for variant in variants.get('sizes', {}).values())
+
+
+def rating_summary(count, total, histogram):
+    """A product's rating from its ProductRating counts; histogram is stars 1-5."""
+    return {
+        'count': count,
+        'average': round(total / count, 2) if count else None,
+        'histogram': {str(stars): n for stars, n in zip(STARS, histogram)},
+    }
+
+
+def product_values(queryset=None):
+    return (Product.objects.all() if queryset is None else queryset).values(*PRODUCT_FIELDS)
+
+
+@serializes
+def serialize_products(rows):
+    """
+    ProductSerializer output for product_values() rows, with every product's
+    images loaded in one further query.
+    """
+    rows = list(rows)
+    images = {}
+    image_rows = ProductImage.objects.filter(product_id__in=[row['id'] for row in rows]).values(*IMAGE_FIELDS)
+    for image in image_rows:
+        variants = image['image_variants']
+        images.setdefault(image['product_id'], []).append({
+            'id': image['id'],
+            'product': image['product_id'],
+            'image': media_url(image['image']),
+            'image_width': image['image_width'],
+            'image_height': image['image_height'],
+            'image_sizes': image_sizes(variants),
+            'image_srcset': image_srcset(variants),
+        })
+    return [
+        {
+            'id': row['id'],
+            'name': row['name'],
+            'description': row['description'],
+            'price': _money.to_representation(row['price']),
+            'category': row['category_id'],
+            'created_at': _datetime.to_representation(row['created_at']),
+            'image': media_url(row['image']),
+            'image_width': row['image_width'],
+            'image_height': row['image_height'],
+            'image_sizes': image_sizes(row['image_variants']),
+            'image_srcset': image_srcset(row['image_variants']),
+            'images': images.get(row['id'], []),
+            # Products nobody has reviewed have no rating row to join.
+            'rating': rating_summary(
+                row['rating__count'] or 0, row['rating__total'] or 0,
+                [row[f'rating__stars_{stars}'] or 0 for stars in STARS],
+            ),
+        }
+        for row in rows
+    ]
+
+
+@serializes
+def serialize_categories(queryset=None):
+    return list((Category.objects.all() if queryset is None else queryset).values('id', 'name'))
+
+
+def order_values(queryset):
+    return queryset.values(*ORDER_FIELDS)
+
+
+@serializes
+def serialize_orders(rows):
+    """
+    OrderSerializer output for order_values() rows, with the items of every
+    order loaded in one further query. Items carry their product snapshot,
+    so no product rows are read.
+    """
+    orders = list(rows)
+    items_by_order = {}
+    items = OrderItem.objects.filter(order_id__in=[order['id'] for order in orders]).values(*ORDER_ITEM_FIELDS)
+    for item in items:
+        items_by_order.setdefault(item['order_id'], []).append({
+            'id': item['id'],
+            'order': item['order_id'],
+            'product': item['product_id'],
+            'product_name': item['product_name'],
+            'product_image': media_url(item['product_image']),
+            'quantity': item['quantity'],
+            'price': _money.to_representation(item['price']),
+        })
+    return [
+        {
+            'id': order['id'],
+            'user': {
+                'id': order['user_id'],
+                'username': order['user__username'],
+                'email': order['user__email'],
+                'first_name': order['user__first_name'],
+                'last_name': order['user__last_name'],
+            } if order['user_id'] is not None else None,
+            'created_at': _datetime.to_representation(order['created_at']),
+            'total_price': _money.to_representation(order['total_price']),
+            'order_items': items_by_order.get(order['id'], []),
+            'payment_intent_id': order['payment_intent_id'],
+            'status': order['status'],
+        }
+        for order in orders
+    ]
@@ -0,0 +1,78 @@
+"""
+JSON rendering and parsing through orjson when it is installed, with the
+standard library as the fallback.
+
+FastJSONRenderer and FastJSONParser are drop-in replacements for DRF's
+JSONRenderer and JSONParser, and FastJsonResponse for Django's JsonResponse.
+Types orjson does not handle itself - Decimal, lazy strings and datetimes
+among them - go through the same encoder default() as before, so prices and
+timestamps come out exactly as they did with the stdlib encoder.
+"""
+import json
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.http import HttpResponse
+from rest_framework.exceptions import ParseError
+from rest_framework.parsers import JSONParser
+from rest_framework.renderers import JSONRenderer
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# Datetimes are passed to default() so that they keep the encoder's format
+# rather than orjson's; dict keys that are not strings are stringified as
+# the json module does.
+OPTIONS = orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_NON_STR_KEYS if orjson else 0
+
+
+class FastJSONRenderer(JSONRenderer):
+    """
+    JSONRenderer through orjson. Indented output, and the non-default
+    UNICODE_JSON and COMPACT_JSON settings, are left to JSONRenderer.
+    """
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        if (orjson is None or self.ensure_ascii or not self.compact
+                or self.get_indent(accepted_media_type, renderer_context or {}) is not None):
+            return super().render(data, accepted_media_type, renderer_context)
+        ret = orjson.dumps(data, default=self.encoder_class().default, option=OPTIONS)
+        # Escape U+2028 and U+2029 as JSONRenderer does, keeping the output a
+        # strict JavaScript subset.
+        return ret.replace(b'\xe2\x80\xa8', b'\\u2028').replace(b'\xe2\x80\xa9', b'\\u2029')
+
+
+class FastJSONParser(JSONParser):
+    renderer_class = FastJSONRenderer
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        encoding = (parser_context or {}).get('encoding', settings.DEFAULT_CHARSET)
+        if orjson is None or not self.strict or encoding.lower().replace('_', '-') not in ('utf-8', 'utf8'):
+            return super().parse(stream, media_type, parser_context)
+        try:
+            return orjson.loads(stream.read())
+        except orjson.JSONDecodeError as exc:
+            raise ParseError('JSON parse error - %s' % str(exc))
+
+
+class FastJsonResponse(HttpResponse):
+    """
+    JsonResponse, encoded compactly by orjson. Passing json_dumps_params
+    falls back to json.dumps().
+    """
+
+    def __init__(self, data, encoder=DjangoJSONEncoder, safe=True, json_dumps_params=None, **kwargs):
+        if safe and not isinstance(data, dict):
+            raise TypeError(
+                'In order to allow non-dict objects to be serialized set the safe parameter to False.'
+            )
+        kwargs.setdefault('content_type', 'application/json')
+        if orjson is None or json_dumps_params is not None:
+            content = json.dumps(data, cls=encoder, **(json_dumps_params or {}))
+        else:
+            content = orjson.dumps(data, default=encoder().default, option=OPTIONS)
+        super().__init__(content=content, **kwargs)
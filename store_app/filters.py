@@ -0,0 +1,56 @@
+"""
+Query-string filtering and sorting for the product list.
+
+Every filter and sort combination is served by one of Product's indexes
+rather than a table scan; the EXPLAIN QUERY PLAN tests hold it to that.
+"""
+from decimal import Decimal, InvalidOperation
+
+# sort parameter -> ordering, ending in id so the pagination cursor holds a
+# unique (column, id) keyset. SQLite indexes end in the rowid, so (price)
+# orders by (price, id).
+PRODUCT_SORTS = {
+    'newest': ('-created_at', '-id'),
+    'price': ('price', 'id'),
+    '-price': ('-price', '-id'),
+}
+DEFAULT_SORT = 'newest'
+
+
+class InvalidFilter(ValueError):
+    pass
+
+
+def parse_price(param, value):
+    try:
+        price = Decimal(value)
+    except InvalidOperation:
+        raise InvalidFilter(f'{param} must be a number')
+    if not price.is_finite() or price < 0:
+        raise InvalidFilter(f'{param} must be a number of at least 0')
+    return price
+
+
+def filter_products(queryset, params):
+    """
+    Narrow queryset by the category, min_price, max_price and name_prefix
+    params and return it with the ordering that sort asks for. Raises
+    InvalidFilter for values that don't parse.
+    """
+    sort = params.get('sort') or DEFAULT_SORT
+    if sort not in PRODUCT_SORTS:
+        raise InvalidFilter(f'sort must be one of: {", ".join(PRODUCT_SORTS)}')
+
+    category = params.get('category')
+    if category:
+        if not category.isdigit():
+            raise InvalidFilter('category must be a category ID')
+        queryset = queryset.filter(category_id=int(category))
+    for param, lookup in (('min_price', 'price__gte'), ('max_price', 'price__lte')):
+        if params.get(param):
+            queryset = queryset.filter(**{lookup: parse_price(param, params[param])})
+    name_prefix = params.get('name_prefix')
+    if name_prefix:
+        # LIKE 'prefix%', a range seek on product_name_nocase_idx.
+        queryset = queryset.filter(name__istartswith=name_prefix)
+    return queryset, PRODUCT_SORTS[sort]
@@ -0,0 +1,174 @@
+"""
+Idempotency-Key support for the endpoints that place orders.
+
+A client that retries a POST with the same Idempotency-Key header gets the
+first response replayed instead of placing the order again. The first
+request claims the key in IdempotencyRecord before the view runs and stores
+the rendered response when it is done; a duplicate that arrives meanwhile
+polls for that response rather than doing the work a second time, for up
+to IDEMPOTENCY_WAIT seconds; one still unanswered after that gets 409 with
+Retry-After.
+"""
+import asyncio
+import hashlib
+import time
+from datetime import timedelta
+from functools import wraps
+
+from asgiref.sync import iscoroutinefunction, sync_to_async
+from django.conf import settings
+from django.http import HttpResponse, JsonResponse
+from django.utils import timezone
+from rest_framework import exceptions
+from rest_framework.request import Request
+from rest_framework.settings import api_settings
+
+from .db import write_transaction
+from .models import IdempotencyRecord
+
+HEADER = 'Idempotency-Key'
+POLL_INTERVAL = 0.05
+# Seconds a duplicate still in flight is told to wait before retrying.
+RETRY_AFTER = 1
+
+
+def request_user_id(request):
+    """
+    The id of the user making the request, by session or by any of the API's
+    authenticators, without touching request.user. None for anonymous or
+    unauthenticatable requests, which the view itself will deal with.
+    """
+    user = getattr(request, 'user', None)
+    if user is not None and user.is_authenticated:
+        return user.pk
+    api_request = Request(request)
+    for authentication in api_settings.DEFAULT_AUTHENTICATION_CLASSES:
+        try:
+            result = authentication().authenticate(api_request)
+        except exceptions.APIException:
+            return None
+        if result is not None:
+            return result[0].pk
+    return None
+
+
+def identify(request, idempotency_key):
+    """Return (record key, request fingerprint) for a keyed request."""
+    scope = f'{request_user_id(request)}:{request.path}:{idempotency_key}'
+    return hashlib.sha256(scope.encode()).hexdigest(), hashlib.sha256(request.body).hexdigest()
+
+
+@write_transaction
+def claim(key, fingerprint):
+    """
+    Claim key for this request and return None, or return the record of the
+    request that already holds it. Expired records and claims abandoned by
+    a request that died mid-flight are cleared first.
+    """
+    now = timezone.now()
+    IdempotencyRecord.objects.filter(created_at__lt=now - timedelta(seconds=settings.IDEMPOTENCY_KEY_TTL)).delete()
+    IdempotencyRecord.objects.filter(
+        key=key, status_code=None, created_at__lt=now - timedelta(seconds=settings.IDEMPOTENCY_LOCK_TIMEOUT),
+    ).delete()
+    record, created = IdempotencyRecord.objects.get_or_create(key=key, defaults={'fingerprint': fingerprint})
+    return None if created else record
+
+
+def poll(key, fingerprint):
+    # If the first request gave up its claim, this one takes over the work.
+    return IdempotencyRecord.objects.filter(key=key).first() or claim(key, fingerprint)
+
+
+def in_flight(record, fingerprint):
+    return record is not None and record.status_code is None and record.fingerprint == fingerprint
+
+
+def release(key):
+    IdempotencyRecord.objects.filter(key=key, status_code=None).delete()
+
+
+def finish(key, response):
+    """
+    Store the response for replay and return it. Server errors are not
+    stored, so a retry after one runs the view again.
+    """
+    if hasattr(response, 'render') and not response.is_rendered:
+        response.render()
+    if response.streaming or response.status_code >= 500:
+        release(key)
+    else:
+        IdempotencyRecord.objects.filter(key=key).update(
+            status_code=response.status_code,
+            content_type=response.get('Content-Type', ''),
+            body=response.content,
+        )
+    return response
+
+
+def replay(record, fingerprint):
+    if record.fingerprint != fingerprint:
+        return JsonResponse({'error': f'{HEADER} has already been used for a different request'}, status=422)
+    if record.status_code is None:
+        response = JsonResponse({'error': f'A request with this {HEADER} is still being processed'}, status=409)
+        response['Retry-After'] = str(RETRY_AFTER)
+        return response
+    response = HttpResponse(bytes(record.body), status=record.status_code, content_type=record.content_type)
+    response['Idempotent-Replayed'] = 'true'
+    return response
+
+
+def idempotent(view):
+    """
+    Replay the first response to POSTs that repeat an Idempotency-Key.
+
+    Keys are scoped to the user and the path. Reusing a key with a different
+    body is refused with 422, and a duplicate still waiting on the original
+    after IDEMPOTENCY_WAIT seconds gets 409. Works on sync and async views; apply it outermost so DRF
+    responses arrive ready to render.
+    """
+    if iscoroutinefunction(view):
+        @wraps(view)
+        async def async_wrapper(request, *args, **kwargs):
+            idempotency_key = request.headers.get(HEADER)
+            if request.method != 'POST' or not idempotency_key:
+                return await view(request, *args, **kwargs)
+
+            key, fingerprint = await sync_to_async(identify)(request, idempotency_key)
+            record = await sync_to_async(claim)(key, fingerprint)
+            deadline = time.monotonic() + settings.IDEMPOTENCY_WAIT
+            while in_flight(record, fingerprint) and time.monotonic() < deadline:
+                await asyncio.sleep(POLL_INTERVAL)
+                record = await sync_to_async(poll)(key, fingerprint)
+            if record is not None:
+                return replay(record, fingerprint)
+
+            try:
+                response = await view(request, *args, **kwargs)
+            except BaseException:
+                await sync_to_async(release)(key)
+                raise
+            return await sync_to_async(finish)(key, response)
+        return async_wrapper
+
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        idempotency_key = request.headers.get(HEADER)
+        if request.method != 'POST' or not idempotency_key:
+            return view(request, *args, **kwargs)
+
+        key, fingerprint = identify(request, idempotency_key)
+        record = claim(key, fingerprint)
+        deadline = time.monotonic() + settings.IDEMPOTENCY_WAIT
+        while in_flight(record, fingerprint) and time.monotonic() < deadline:
+            time.sleep(POLL_INTERVAL)
+            record = poll(key, fingerprint)
+        if record is not None:
+            return replay(record, fingerprint)
+
+        try:
+            response = view(request, *args, **kwargs)
+        except BaseException:
+            release(key)
+            raise
+        return finish(key, response)
+    return wrapper
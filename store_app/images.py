@@ -0,0 +1,103 @@
+import logging
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+
+from .cache import invalidate_catalog
+from .derivatives import render_derivatives
+from .models import OrderItem
+
+logger = logging.getLogger(__name__)
+
+_pool = None
+
+
+def derivative_pool():
+    # Spawned rather than forked: workers only import store_app.derivatives,
+    # so they stay small and never inherit the parent's database connections.
+    global _pool
+    if _pool is None:
+        _pool = ProcessPoolExecutor(
+            max_workers=settings.IMAGE_DERIVATIVE_WORKERS,
+            mp_context=multiprocessing.get_context('spawn'),
+        )
+    return _pool
+
+
+def read_source(name):
+    with default_storage.open(name) as source:
+        return source.read()
+
+
+def save_derivative(name, data):
+    # Rebuilding an image writes the same names again; replace the old files
+    # rather than letting the storage pick a fresh suffixed name.
+    default_storage.delete(name)
+    return default_storage.save(name, ContentFile(data))
+
+
+def store_derivatives(model, pk, result):
+    sizes = {size: {**variant, 'name': save_derivative(variant['name'], result['files'][variant['name']])}
+             for size, variant in result['sizes'].items()}
+    # Guarding on the source name drops results for an image that has been
+    # replaced again while this one was being processed.
+    stored = model.objects.filter(pk=pk, image=result['source']).update(
+        image_width=result['width'],
+        image_height=result['height'],
+        image_variants={'source': result['source'], 'sizes': sizes},
+    )
+    if not stored:
+        delete_derivatives({'sizes': sizes})
+        return
+    invalidate_catalog()
+
+
+def delete_derivatives(variants):
+    """
+    Delete the derivative files listed in ``variants``, keeping thumbnails
+    that order items still show for past purchases.
+    """
+    names = {variant['name'] for variant in variants.get('sizes', {}).values()}
+    names -= set(OrderItem.objects.filter(product_image__in=names).values_list('product_image', flat=True))
+    for name in names:
+        default_storage.delete(name)
+
+
+def _derivatives_done(model, pk, future):
+    # Runs on the executor's management thread, which keeps its own
+    # database connection between jobs.
+    try:
+        store_derivatives(model, pk, future.result())
+    except Exception:
+        logger.exception('Could not build image derivatives for %s %s', model.__name__, pk)
+
+
+def schedule_derivatives(instance):
+    """
+    Build the derivatives for ``instance.image`` in the process pool, or
+    inline when IMAGE_DERIVATIVE_WORKERS is 0. Files are read and written
+    through default_storage; the workers only encode.
+    """
+    model, name = type(instance), instance.image.name
+    try:
+        data = read_source(name)
+        if not settings.IMAGE_DERIVATIVE_WORKERS:
+            store_derivatives(model, instance.pk, render_derivatives(data, name))
+            return
+    except Exception:
+        logger.exception('Could not build image derivatives for %s %s', model.__name__, instance.pk)
+        return
+    future = derivative_pool().submit(render_derivatives, data, name)
+    future.add_done_callback(partial(_derivatives_done, model, instance.pk))
+
+
+def wait_for_derivatives():
+    """Block until every scheduled derivative has been built and stored."""
+    global _pool
+    if _pool is not None:
+        _pool.shutdown(wait=True)
+        _pool = None
@@ -0,0 +1,50 @@
+import time
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test import Client
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from store_app.bench import percentile, throwaway_database
+from store_app.models import Cart, CartProduct, Category, Product
+from django.contrib.auth.models import User
+
+
+class Command(BaseCommand):
+    help = 'Time checkout against carts of increasing size on a throwaway database.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', type=int, nargs='+', default=[1, 10, 50, 200])
+        parser.add_argument('--runs', type=int, default=20)
+
+    def handle(self, *args, **options):
+        with throwaway_database():
+            category = Category.objects.create(name='Bench')
+            products = Product.objects.bulk_create([
+                Product(name=f'Bench {i}', description='', price=Decimal('9.99'),
+                        category=category, image='product_images/bench.jpg')
+                for i in range(max(options['sizes']))
+            ])
+            client = Client()
+            url = reverse('checkout')
+
+            self.stdout.write(f'{"lines":>6} {"p50 ms":>8} {"p95 ms":>8} {"queries":>8}')
+            for size in options['sizes']:
+                timings, queries = [], 0
+                for run in range(options['runs']):
+                    user = User.objects.create(username=f'bench-{size}-{run}')
+                    cart = Cart.objects.create(user=user)
+                    CartProduct.objects.bulk_create([
+                        CartProduct(cart=cart, product=product, quantity=2) for product in products[:size]
+                    ])
+                    with CaptureQueriesContext(connection) as captured:
+                        start = time.perf_counter()
+                        response = client.post(url, {'cart_id': cart.pk})
+                        timings.append((time.perf_counter() - start) * 1000)
+                    assert response.status_code == 200, response.content
+                    queries = len(captured)
+                self.stdout.write(
+                    f'{size:>6} {percentile(timings, 50):>8.2f} {percentile(timings, 95):>8.2f} {queries:>8}'
+                )
@@ -0,0 +1,66 @@
+import io
+import time
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand, CommandError
+from django.http import JsonResponse
+from rest_framework.parsers import JSONParser
+from rest_framework.renderers import JSONRenderer
+
+from store_app.bench import percentile, throwaway_database
+from store_app.fast_serializers import product_values, serialize_products
+from store_app.fastjson import FastJSONParser, FastJSONRenderer, FastJsonResponse, orjson
+from store_app.management.commands.bench_serializers import VARIANTS
+from store_app.models import Category, Product, ProductImage
+
+
+class Command(BaseCommand):
+    help = 'Compare stdlib and orjson encoding and decoding of a large catalog payload.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--products', type=int, default=5000)
+        parser.add_argument('--images-per-product', type=int, default=2)
+        parser.add_argument('--runs', type=int, default=20)
+
+    def handle(self, *args, **options):
+        if orjson is None:
+            raise CommandError('orjson is not installed; the fast classes would only time the json module.')
+        with throwaway_database():
+            categories = Category.objects.bulk_create([Category(name=f'Bench {i}') for i in range(20)])
+            products = Product.objects.bulk_create([
+                Product(name=f'Dhaka topi {i}', description='Hand-woven dhaka fabric from Palpa. ' * 4,
+                        price=Decimal('9.99') + i % 500, category=categories[i % 20], image='product_images/bench.jpg',
+                        image_width=1600, image_height=1200, image_variants=VARIANTS)
+                for i in range(options['products'])
+            ])
+            ProductImage.objects.bulk_create([
+                ProductImage(product=product, image=f'product_images/bench-{n}.jpg', image_variants=VARIANTS)
+                for product in products
+                for n in range(options['images_per_product'])
+            ])
+            # The API payload has prices as strings; the rows keep Decimals and
+            # datetimes for the encoder's default() to handle.
+            catalog = serialize_products(product_values())
+            rows = list(product_values())
+
+        body = JSONRenderer().render(catalog)
+        if FastJSONRenderer().render(catalog) != body:
+            raise CommandError('FastJSONRenderer output differs from JSONRenderer.')
+        cases = [
+            ('render', lambda: JSONRenderer().render(catalog), lambda: FastJSONRenderer().render(catalog)),
+            ('parse', lambda: JSONParser().parse(io.BytesIO(body)), lambda: FastJSONParser().parse(io.BytesIO(body))),
+            ('JsonResponse', lambda: JsonResponse(rows, safe=False), lambda: FastJsonResponse(rows, safe=False)),
+        ]
+        self.stdout.write(f'{len(catalog)} products, {len(body) / 1e6:.1f} MB rendered')
+        self.stdout.write(f'{"case":<14} {"stdlib ms":>10} {"orjson ms":>10} {"speedup":>8}')
+        for name, stdlib, fast in cases:
+            stdlib_ms, fast_ms = self.time(stdlib, options['runs']), self.time(fast, options['runs'])
+            self.stdout.write(f'{name:<14} {stdlib_ms:>10.1f} {fast_ms:>10.1f} {stdlib_ms / fast_ms:>7.1f}x')
+
+    def time(self, encode, runs):
+        timings = []
+        for _ in range(runs):
+            start = time.process_time()
+            encode()
+            timings.append((time.process_time() - start) * 1000)
+        return percentile(timings, 50)
@@ -0,0 +1,66 @@
+import time
+from decimal import Decimal
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+
+from store_app.bench import percentile, throwaway_database
+from store_app.fast_serializers import order_values, product_values, serialize_categories, serialize_orders, serialize_products
+from store_app.models import Category, Order, Product, ProductImage
+from store_app.orders import place_order
+from store_app.serializers import CategorySerializer, OrderSerializer, ProductSerializer
+
+VARIANTS = {'source': 'product_images/bench.jpg', 'sizes': {
+    'thumbnail': {'name': 'product_images/derivatives/bench-thumbnail.webp', 'width': 160, 'height': 120},
+    'card': {'name': 'product_images/derivatives/bench-card.webp', 'width': 480, 'height': 360},
+    'detail': {'name': 'product_images/derivatives/bench-detail.webp', 'width': 1200, 'height': 900},
+}}
+
+
+class Command(BaseCommand):
+    help = 'Compare per-item serialization time of the DRF serializers and the fast read path.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--items', type=int, default=100, help='Products, orders and categories per list.')
+        parser.add_argument('--runs', type=int, default=30)
+
+    def handle(self, *args, **options):
+        items = options['items']
+        with throwaway_database():
+            categories = Category.objects.bulk_create([Category(name=f'Bench {i}') for i in range(items)])
+            products = Product.objects.bulk_create([
+                Product(name=f'Bench {i}', description='', price=Decimal('9.99'), category=categories[i % 10],
+                        image='product_images/bench.jpg', image_width=1600, image_height=1200, image_variants=VARIANTS)
+                for i in range(items)
+            ])
+            ProductImage.objects.bulk_create([
+                ProductImage(product=product, image=f'product_images/bench-{n}.jpg', image_variants=VARIANTS)
+                for product in products
+                for n in range(2)
+            ])
+            user = User.objects.create(username='bench')
+            for n in range(items):
+                place_order([(products[(n + k) % items], 1) for k in range(3)], Decimal('29.97'), user=user)
+
+            cases = [
+                ('products', lambda: ProductSerializer(Product.objects.catalog(), many=True).data,
+                 lambda: serialize_products(product_values())),
+                ('orders', lambda: OrderSerializer(Order.objects.filter(user=user).with_items(), many=True).data,
+                 lambda: serialize_orders(order_values(Order.objects.filter(user=user)))),
+                ('categories', lambda: CategorySerializer(Category.objects.all(), many=True).data,
+                 lambda: serialize_categories()),
+            ]
+            self.stdout.write(f'{"list":<12} {"drf us/item":>12} {"fast us/item":>13} {"speedup":>8}')
+            for name, drf, fast in cases:
+                assert drf() == fast(), name
+                drf_us, fast_us = self.time_per_item(drf, items, options['runs']), self.time_per_item(fast, items, options['runs'])
+                self.stdout.write(f'{name:<12} {drf_us:>12.1f} {fast_us:>13.1f} {drf_us / fast_us:>7.1f}x')
+
+    def time_per_item(self, serialize, items, runs):
+        # CPU time, so the figure is the serializer's own work rather than waiting.
+        timings = []
+        for _ in range(runs):
+            start = time.process_time()
+            serialize()
+            timings.append((time.process_time() - start) * 1e6 / items)
+        return percentile(timings, 50)
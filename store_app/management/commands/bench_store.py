@@ -0,0 +1,324 @@
+import contextlib
+import io
+import json
+import tempfile
+import time
+from datetime import datetime, timezone
+from decimal import Decimal
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import URLPattern, get_resolver, reverse
+from PIL import Image
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import RefreshToken
+
+from store_app.bench import compare, summarize, throwaway_database
+from store_app.cache import catalog_cache
+from store_app.cart import rebuild_cart_totals
+from store_app.fake_stripe import FakeStripe
+from store_app.images import wait_for_derivatives
+from store_app.models import Cart, CartProduct, Category, IssuedPaymentIntent, Product, ProductImage, Profile, Review
+from store_app.orders import place_order
+from store_app.ratings import rebuild_ratings
+
+PASSWORD = 'bench-password'
+WEBHOOK_SECRET = 'whsec_bench'
+METRICS_TOKEN = 'bench-metrics'
+WORDS = ['pashmina', 'singing bowl', 'thangka', 'khukuri', 'prayer flag', 'dhaka topi', 'ilam tea', 'rudraksha']
+DATASET_OPTIONS = (
+    'products', 'categories', 'images_per_product', 'orders', 'cart_lines', 'reviews', 'runs', 'warmup', 'cold',
+)
+
+
+def png_upload(name):
+    buffer = io.BytesIO()
+    Image.new('RGB', (64, 48), 'teal').save(buffer, 'PNG')
+    return SimpleUploadedFile(name, buffer.getvalue(), content_type='image/png')
+
+
+class Command(BaseCommand):
+    help = (
+        'Benchmark every route on a seeded throwaway database with Stripe stubbed out, reporting '
+        'p50/p95/p99 latency, SQL queries and response bytes, optionally diffed against a baseline.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--products', type=int, default=500)
+        parser.add_argument('--categories', type=int, default=10)
+        parser.add_argument('--images-per-product', type=int, default=2)
+        parser.add_argument('--orders', type=int, default=50, help='Past orders of the benchmark user.')
+        parser.add_argument('--cart-lines', type=int, default=20)
+        parser.add_argument('--reviews', type=int, default=100, help='Reviews of each product whose reviews are listed.')
+        parser.add_argument('--runs', type=int, default=30)
+        parser.add_argument('--warmup', type=int, default=3)
+        parser.add_argument('--routes', nargs='+', help='Only benchmark these URL names.')
+        parser.add_argument('--cold', action='store_true', help='Clear the catalog cache before every request.')
+        parser.add_argument('--stripe-latency', type=float, default=0.0, help='Seconds the Stripe stub takes per call.')
+        parser.add_argument('--output', help='Write the results to this JSON file.')
+        parser.add_argument('--baseline', help='A previous --output file to diff the results against.')
+        parser.add_argument('--threshold', type=float, default=10.0,
+                            help='Smallest latency change, in percent, reported against the baseline.')
+        parser.add_argument('--fail-on-regression', action='store_true')
+
+    def handle(self, *args, **options):
+        baseline = None
+        if options['baseline']:
+            with open(options['baseline']) as f:
+                baseline = json.load(f)
+
+        with contextlib.ExitStack() as stack:
+            stack.enter_context(throwaway_database())
+            stack.enter_context(override_settings(
+                MEDIA_ROOT=stack.enter_context(tempfile.TemporaryDirectory()),
+                STRIPE_WEBHOOK_SECRET=WEBHOOK_SECRET,
+                METRICS_TOKEN=METRICS_TOKEN,
+                # Keep benchmark responses out of the real catalog cache.
+                CACHES={**settings.CACHES, settings.CATALOG_CACHE_ALIAS: {
+                    'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+                    'LOCATION': 'bench-catalog',
+                }},
+                # The admin's static URLs need no collectstatic manifest this way.
+                STORAGES={**settings.STORAGES, 'staticfiles': {
+                    'BACKEND': 'django.contrib.staticfiles.storage.StaticFilesStorage',
+                }},
+            ))
+            # Uploads hand their derivatives to the process pool; let those
+            # land before the media root and database go away.
+            stack.callback(wait_for_derivatives)
+            self.fake = stack.enter_context(FakeStripe(latency=options['stripe_latency']))
+            self.seed(options)
+            results = self.run_routes(options)
+
+        report = {
+            'created_at': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+            'dataset': {name: options[name] for name in DATASET_OPTIONS},
+            'routes': results,
+        }
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                json.dump(report, f, indent=2, sort_keys=True)
+            self.stdout.write(f'Wrote {options["output"]}')
+        if baseline is not None:
+            self.diff(report, baseline, options)
+
+    def seed(self, options):
+        categories = Category.objects.bulk_create([
+            Category(name=f'Category {i}') for i in range(options['categories'])
+        ])
+        self.products = Product.objects.bulk_create([
+            Product(
+                name=f'{WORDS[i % len(WORDS)].title()} {i}',
+                description=f'Handmade {WORDS[i % len(WORDS)]} from the hills, item {i}.',
+                price=Decimal(f'{5 + i % 95}.99'),
+                category=categories[i % len(categories)],
+                image=f'product_images/bench-{i}.jpg',
+            )
+            for i in range(options['products'])
+        ])
+        self.images = ProductImage.objects.bulk_create([
+            ProductImage(product=product, image=f'product_images/bench-{product.pk}-{n}.jpg')
+            for product in self.products
+            for n in range(options['images_per_product'])
+        ])
+
+        self.user = User.objects.create_superuser('bench', 'bench@example.com', PASSWORD)
+        Profile.objects.create(user=self.user, first_name='Bench', last_name='Mark', email='bench@example.com')
+        for n in range(options['orders']):
+            lines = [(self.products[(n + k) % len(self.products)], k + 1) for k in range(3)]
+            place_order(lines, sum(product.price * quantity for product, quantity in lines), user=self.user)
+        self.cart = Cart.objects.create(user=self.user)
+        CartProduct.objects.bulk_create([
+            CartProduct(cart=self.cart, product=product, quantity=1)
+            for product in self.products[:options['cart_lines']]
+        ])
+        rebuild_cart_totals()
+        self.reviewed = self.products[:10]
+        Review.objects.bulk_create([
+            Review(product=product, user=self.user, rating=1 + n % 5, comment=f'Review {n} of {product.name}.')
+            for product in self.reviewed
+            for n in range(options['reviews'])
+        ])
+        rebuild_ratings()
+
+        self.anonymous = APIClient()
+        self.api = APIClient()
+        self.api.credentials(HTTP_AUTHORIZATION=f'Bearer {RefreshToken.for_user(self.user).access_token}')
+        self.session = APIClient()
+        self.session.force_login(self.user)
+        self.cart_lines = options['cart_lines']
+
+    def product(self, run):
+        return self.products[run % len(self.products)]
+
+    def order_lines(self, run, key='product_id'):
+        return [{key: self.product(run + k).pk, 'quantity': k + 1} for k in range(3)]
+
+    def scenarios(self):
+        """
+        URL name -> (client, method, build), where build(run) returns the path
+        and request kwargs for that run. Any fixtures a run needs are created
+        by build, outside the timed request.
+        """
+        def get(name):
+            return lambda run: (reverse(name), {})
+
+        def delete_cart_item(run):
+            product = self.products[-1]
+            # Small catalogs may already have it in the cart from add_to_cart.
+            line, _ = CartProduct.objects.get_or_create(cart=self.cart, product=product, defaults={'quantity': 1})
+            return reverse('delete_cart_item', args=[line.pk]), {}
+
+        def checkout(run):
+            user = User.objects.create(username=f'checkout-{run}')
+            cart = Cart.objects.create(user=user)
+            CartProduct.objects.bulk_create([
+                CartProduct(cart=cart, product=self.product(run + k), quantity=1) for k in range(3)
+            ])
+            return reverse('checkout'), {'data': {'cart_id': cart.pk}}
+
+        def product_form(run):
+            return {
+                'name': f'Bench upload {run}',
+                'description': 'Uploaded by the benchmark.',
+                'price': f'{10 + run % 2}.50',
+                'category': self.products[0].category_id,
+                'image': png_upload(f'bench-upload-{run}.png'),
+            }
+
+        def confirm_order(run):
+            intent = self.fake.create_intent(2500, confirm=True)
+            # As create_payment_intent would have recorded it.
+            IssuedPaymentIntent.objects.create(payment_intent_id=intent['id'], amount=2500)
+            return reverse('confirm_order'), {
+                'data': {'payment_intent_id': intent['id'], 'cart': self.order_lines(run)}, 'format': 'json',
+            }
+
+        def update_cart(run):
+            # A page of cart edits: bump most lines, reset one and drop one.
+            products = [self.product(run + k) for k in range(10)]
+            operations = [{'op': 'add', 'product_id': product.pk, 'quantity': 1} for product in products[:8]]
+            operations += [
+                {'op': 'set', 'product_id': products[8].pk, 'quantity': 2},
+                {'op': 'remove', 'product_id': products[9].pk},
+            ]
+            return reverse('update_cart'), {'data': {'operations': operations}, 'format': 'json'}
+
+        def stripe_webhook(run):
+            intent = self.fake.create_intent(2500, confirm=True)
+            payload, signature = self.fake.signed_event(intent['id'], WEBHOOK_SECRET)
+            return reverse('stripe-webhook'), {
+                'data': payload, 'content_type': 'application/json', 'HTTP_STRIPE_SIGNATURE': signature,
+            }
+
+        return {
+            'get_products': (self.anonymous, 'get', get('get_products')),
+            'search_products': (self.anonymous, 'get', lambda run: (
+                reverse('search_products'), {'data': {'q': WORDS[run % len(WORDS)]}})),
+            'get_product_detail': (self.anonymous, 'get', lambda run: (
+                reverse('get_product_detail', args=[self.product(run).pk]), {})),
+            'product_reviews': (self.anonymous, 'get', lambda run: (
+                reverse('product_reviews', args=[self.reviewed[run % len(self.reviewed)].pk]), {})),
+            'category-list': (self.anonymous, 'get', get('category-list')),
+            'product_image_list_create': (self.anonymous, 'get', get('product_image_list_create')),
+            'product_image_detail': (self.anonymous, 'get', lambda run: (
+                reverse('product_image_detail', args=[self.images[run % len(self.images)].pk]), {})),
+            'get_cart': (self.api, 'get', get('get_cart')),
+            'get_profile': (self.api, 'get', get('get_profile')),
+            'get_orders': (self.api, 'get', get('get_orders')),
+            'token_obtain_pair': (self.anonymous, 'post', lambda run: (
+                reverse('token_obtain_pair'), {'data': {'username': 'bench', 'password': PASSWORD}, 'format': 'json'})),
+            'create_user': (self.anonymous, 'post', lambda run: (reverse('create_user'), {'data': {
+                'username': f'new-{run}', 'password': PASSWORD, 'email': f'new-{run}@example.com',
+                'first_name': 'New', 'last_name': 'Shopper',
+            }, 'format': 'json'})),
+            'add_to_cart': (self.session, 'post', lambda run: (reverse('add_to_cart'), {
+                'data': {'product_id': self.products[run % self.cart_lines].pk, 'quantity': 1}})),
+            'update_cart': (self.api, 'post', update_cart),
+            'update_cart:anonymous': (self.anonymous, 'post', update_cart),
+            'delete_cart_item': (self.api, 'delete', delete_cart_item),
+            'add_product': (self.anonymous, 'post', lambda run: (
+                reverse('add_product'), {'data': product_form(run), 'format': 'multipart'})),
+            'update_product': (self.anonymous, 'put', lambda run: (
+                reverse('update_product', args=[self.products[0].pk]), {'data': product_form(run), 'format': 'multipart'})),
+            'create_order': (self.api, 'post', lambda run: (reverse('create_order'), {
+                'data': {'total_price': '25.00', 'products': self.order_lines(run)}, 'format': 'json'})),
+            'create_guest_order': (self.anonymous, 'post', lambda run: (reverse('create_guest_order'), {'data': {
+                'email': 'guest@example.com', 'total_price': '25.00', 'items': self.order_lines(run, key='product'),
+            }, 'format': 'json'})),
+            'checkout': (self.anonymous, 'post', checkout),
+            'create-payment-intent': (self.anonymous, 'post', lambda run: (
+                reverse('create-payment-intent'), {'data': {'amount': 2500}, 'format': 'json'})),
+            'create-confirm-intent': (self.anonymous, 'post', lambda run: (reverse('create-confirm-intent'), {
+                'data': {'amount': 2500, 'confirmation_token_id': 'ctoken_bench'}, 'format': 'json'})),
+            'confirm_order': (self.anonymous, 'post', confirm_order),
+            'stripe-webhook': (self.anonymous, 'post', stripe_webhook),
+            'metrics': (self.anonymous, 'get', lambda run: (
+                reverse('metrics'), {'HTTP_AUTHORIZATION': f'Bearer {METRICS_TOKEN}'})),
+            'admin:index': (self.session, 'get', get('admin:index')),
+            'admin:store_app_product_changelist': (self.session, 'get', get('admin:store_app_product_changelist')),
+        }
+
+    def run_routes(self, options):
+        scenarios = self.scenarios()
+        missing = sorted(self.url_names() - set(scenarios))
+        if missing:
+            self.stderr.write(f'No benchmark scenario for: {", ".join(missing)}')
+        names = options['routes'] or list(scenarios)
+        unknown = sorted(set(names) - set(scenarios))
+        if unknown:
+            raise CommandError(f'Unknown routes: {", ".join(unknown)}')
+
+        self.stdout.write(f'{"route":<36} {"p50 ms":>8} {"p95 ms":>8} {"p99 ms":>8} {"queries":>8} {"bytes":>9}')
+        results = {}
+        for name in names:
+            client, method, build = scenarios[name]
+            results[name] = result = self.measure(client, method, build, options)
+            self.stdout.write(
+                f'{name:<36} {result["p50_ms"]:>8.2f} {result["p95_ms"]:>8.2f} {result["p99_ms"]:>8.2f} '
+                f'{result["queries"]:>8} {result["bytes"]:>9}'
+            )
+        return results
+
+    def measure(self, client, method, build, options):
+        timings, queries, sizes = [], [], []
+        for run in range(options['warmup'] + options['runs']):
+            path, kwargs = build(run)
+            if options['cold']:
+                catalog_cache().clear()
+            with CaptureQueriesContext(connection) as captured:
+                start = time.perf_counter()
+                response = getattr(client, method)(path, **kwargs)
+                elapsed = (time.perf_counter() - start) * 1000
+            if response.status_code >= 400:
+                raise CommandError(f'{method.upper()} {path} returned {response.status_code}: {response.content[:300]!r}')
+            if run >= options['warmup']:
+                timings.append(elapsed)
+                queries.append(len(captured))
+                sizes.append(len(response.content))
+        return summarize(timings, queries, sizes)
+
+    def url_names(self):
+        return {
+            pattern.name for pattern in get_resolver().url_patterns
+            if isinstance(pattern, URLPattern) and pattern.name
+        }
+
+    def diff(self, report, baseline, options):
+        if baseline.get('dataset') != report['dataset']:
+            self.stderr.write('Baseline was recorded with a different dataset; numbers may not be comparable.')
+        rows = compare(report['routes'], baseline['routes'], options['threshold'])
+        if not rows:
+            self.stdout.write('No changes against the baseline.')
+            return
+        self.stdout.write(f'\n{"route":<36} {"metric":<12} {"baseline":>10} {"now":>10} {"change":>8}')
+        for route, metric, old, new, change, regressed in rows:
+            line = f'{route:<36} {metric:<12} {old:>10} {new:>10} {change:>+7.1f}%'
+            self.stdout.write(self.style.ERROR(line) if regressed else self.style.SUCCESS(line))
+        if options['fail_on_regression'] and any(row[-1] for row in rows):
+            raise CommandError('Benchmark regressed against the baseline.')
@@ -0,0 +1,44 @@
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+from django.core.management.base import BaseCommand
+
+from store_app.derivatives import render_derivatives
+from store_app.images import read_source, store_derivatives
+from store_app.models import Product, ProductImage
+
+
+class Command(BaseCommand):
+    help = 'Build missing WebP derivatives for existing product images.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--force', action='store_true', help='Rebuild derivatives that are already current.')
+        parser.add_argument('--workers', type=int, default=os.cpu_count())
+
+    def handle(self, *args, **options):
+        pool = ProcessPoolExecutor(max_workers=options['workers'], mp_context=multiprocessing.get_context('spawn'))
+        with pool:
+            for model in (Product, ProductImage):
+                pending = [
+                    (pk, name)
+                    for pk, name, variants in model.objects.exclude(image='').values_list('pk', 'image', 'image_variants')
+                    if options['force'] or variants.get('source') != name
+                ]
+                built = 0
+                # Sources are read here and shipped to the workers as bytes,
+                # so only keep a couple of images per worker in flight.
+                for start in range(0, len(pending), options['workers'] * 2):
+                    jobs = []
+                    for pk, name in pending[start:start + options['workers'] * 2]:
+                        try:
+                            jobs.append((pk, pool.submit(render_derivatives, read_source(name), name)))
+                        except Exception as e:
+                            self.stderr.write(f'{model.__name__} {pk}: {e}')
+                    for pk, job in jobs:
+                        try:
+                            store_derivatives(model, pk, job.result())
+                            built += 1
+                        except Exception as e:
+                            self.stderr.write(f'{model.__name__} {pk}: {e}')
+                self.stdout.write(f'{model.__name__}: built {built} of {len(pending)}')
@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from store_app.sessions import compact_database_sessions
+
+
+class Command(BaseCommand):
+    help = (
+        'Rewrite the carts in django_session rows as product id -> quantity and delete expired rows. '
+        'Run it once after upgrading; sessions still in the database are read by the cookie and cache engines.'
+    )
+
+    def handle(self, *args, **options):
+        compacted = compact_database_sessions()
+        self.stdout.write(self.style.SUCCESS(f'Compacted the carts of {compacted} session(s)'))
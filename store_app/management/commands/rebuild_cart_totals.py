@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from store_app.cart import mismatched_cart_totals, rebuild_cart_totals
+
+
+class Command(BaseCommand):
+    help = 'Recompute Cart.total_price from cart lines, or verify the stored totals with --check.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--check', action='store_true', help='Report drifted totals without fixing them.')
+
+    def handle(self, *args, **options):
+        mismatched = list(mismatched_cart_totals().values_list('pk', 'total_price', 'expected'))
+        for cart_id, stored, expected in mismatched:
+            self.stdout.write(f'Cart {cart_id}: stored {stored}, expected {expected}')
+
+        if options['check']:
+            if mismatched:
+                raise CommandError(f'{len(mismatched)} cart total(s) out of date')
+            self.stdout.write(self.style.SUCCESS('All cart totals match their lines'))
+            return
+
+        updated = rebuild_cart_totals()
+        self.stdout.write(self.style.SUCCESS(f'Rebuilt {updated} cart total(s), {len(mismatched)} had drifted'))
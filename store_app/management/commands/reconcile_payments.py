@@ -0,0 +1,39 @@
+from collections import Counter
+
+import stripe
+from django.core.management.base import BaseCommand
+
+import store_app.payments  # noqa: F401 - configures the Stripe API key and base
+from store_app.models import Order
+from store_app.orders import mark_order_paid
+from store_app.stock import cancel_payment_order
+
+
+class Command(BaseCommand):
+    help = (
+        'Ask Stripe about every pending or expired order with a payment intent: mark paid those whose intent '
+        'succeeded and expire those whose intent was canceled. Run it once after migrating, since older orders '
+        'carry unverified intents, and again whenever webhooks may have been missed.'
+    )
+
+    def handle(self, *args, **options):
+        counts = Counter()
+        orders = Order.objects.filter(status__in=[Order.PENDING, Order.EXPIRED]).exclude(payment_intent_id=None)
+        for order_id, payment_intent_id in orders.values_list('pk', 'payment_intent_id'):
+            try:
+                intent = stripe.PaymentIntent.retrieve(payment_intent_id)
+            except stripe.error.InvalidRequestError as e:
+                self.stderr.write(f'Order {order_id}: {payment_intent_id} is unknown to Stripe ({e.user_message})')
+                counts['unknown'] += 1
+                continue
+            if intent.status == 'succeeded':
+                mark_order_paid(payment_intent_id, intent.amount_received)
+                counts['paid'] += 1
+            elif intent.status == 'canceled':
+                counts['expired'] += cancel_payment_order(payment_intent_id)
+            else:
+                counts['unsettled'] += 1
+        self.stdout.write(self.style.SUCCESS(
+            f'{counts["paid"]} paid, {counts["expired"]} expired, {counts["unsettled"]} still awaiting payment, '
+            f'{counts["unknown"]} unknown to Stripe'
+        ))
@@ -0,0 +1,40 @@
+import logging
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import connections
+
+from store_app.stock import release_expired_reservations
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    help = (
+        'Expire orders still unpaid STOCK_RESERVATION_TTL seconds after they were placed and put their stock back. '
+        'Run it every few minutes, from cron or as a long-running process with --every.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--every', type=float, metavar='SECONDS',
+                            help='Keep running, releasing expired reservations every SECONDS.')
+
+    def handle(self, *args, **options):
+        if not options['every']:
+            self.release()
+            return
+        while True:
+            try:
+                self.release()
+            except Exception:
+                # A locked or briefly unavailable database shouldn't stop the loop.
+                logger.exception('Releasing expired reservations failed')
+            connections.close_all()
+            time.sleep(options['every'])
+
+    def release(self):
+        expired = release_expired_reservations()
+        self.stdout.write(self.style.SUCCESS(
+            f'Expired {expired} order(s) unpaid after {settings.STOCK_RESERVATION_TTL}s'
+        ))
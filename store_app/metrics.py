@@ -0,0 +1,193 @@
+"""
+Per-request timings: SQL, view, serializer and render time are collected
+while a request is handled, returned in a Server-Timing header and folded
+into per-route histograms that /metrics serves in the Prometheus text format.
+
+Collecting costs a contextvar lookup per query and per serialized object and
+one short lock per request, so it stays on in production. Histograms live in
+each worker process and carry its pid as a label.
+"""
+import os
+import threading
+from bisect import bisect_left
+from contextvars import ContextVar
+from functools import wraps
+from time import perf_counter
+
+_current = ContextVar('request_timings', default=None)
+
+DURATION_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200)
+PHASES = ('db', 'view', 'serialize', 'render')
+
+
+class RequestTimings:
+    __slots__ = ('started', 'queries', 'db', 'serialize', 'serializing', 'view_started', 'view_finished', 'finished')
+
+    def __init__(self):
+        self.started = perf_counter()
+        self.queries = 0
+        self.db = 0.0
+        self.serialize = 0.0
+        self.serializing = False
+        self.view_started = self.view_finished = self.finished = None
+
+    @property
+    def total(self):
+        return self.finished - self.started
+
+    @property
+    def view(self):
+        if self.view_started is None:
+            return 0.0
+        return (self.view_finished or self.finished) - self.view_started
+
+    @property
+    def render(self):
+        # Only DRF (template) responses are rendered after the view returns;
+        # a JsonResponse is encoded inside the view.
+        return self.finished - self.view_finished if self.view_finished is not None else 0.0
+
+    def server_timing(self):
+        return ', '.join([
+            f'db;dur={self.db * 1000:.2f};desc="{self.queries} queries"',
+            f'view;dur={self.view * 1000:.2f}',
+            f'serialize;dur={self.serialize * 1000:.2f}',
+            f'render;dur={self.render * 1000:.2f}',
+            f'total;dur={self.total * 1000:.2f}',
+        ])
+
+
+def start_request():
+    timings = RequestTimings()
+    return timings, _current.set(timings)
+
+
+def finish_request(timings, token):
+    timings.finished = perf_counter()
+    _current.reset(token)
+
+
+def current_timings():
+    return _current.get()
+
+
+def query_timer(execute, sql, params, many, context):
+    """An execute_wrapper() that adds each query to the current request."""
+    timings = _current.get()
+    if timings is None:
+        return execute(sql, params, many, context)
+    start = perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        timings.db += perf_counter() - start
+        timings.queries += 1
+
+
+def timed_serialization(func, *args, **kwargs):
+    """
+    Call func, counting it towards the request's serialize time unless it
+    runs inside another timed serialization.
+    """
+    timings = _current.get()
+    if timings is None or timings.serializing:
+        return func(*args, **kwargs)
+    timings.serializing = True
+    start = perf_counter()
+    try:
+        return func(*args, **kwargs)
+    finally:
+        timings.serialize += perf_counter() - start
+        timings.serializing = False
+
+
+def serializes(func):
+    """Decorator form of timed_serialization() for serializing functions."""
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        return timed_serialization(func, *args, **kwargs)
+    return wrapper
+
+
+class TimedSerializerMixin:
+    """
+    Count a serializer's to_representation() towards the request's serialize
+    time. Nested serializers, and the children of a many=True list, run
+    inside the outermost call and are not counted twice.
+    """
+
+    def to_representation(self, instance):
+        return timed_serialization(super().to_representation, instance)
+
+
+class Histogram:
+    def __init__(self, name, documentation, buckets, labelnames):
+        self.name = name
+        self.documentation = documentation
+        self.buckets = buckets
+        self.labelnames = labelnames + ('pid',)
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, labels, value):
+        bucket = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                # Bucket counts, then the sum and count of observations.
+                series = self._series[labels] = [0] * (len(self.buckets) + 1) + [0.0, 0]
+            series[bucket] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    def expose(self):
+        with self._lock:
+            series = {labels: list(values) for labels, values in self._series.items()}
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} histogram']
+        pid = str(os.getpid())
+        for labels, values in sorted(series.items()):
+            label_text = ','.join(
+                f'{name}="{escape_label(value)}"' for name, value in zip(self.labelnames, labels + (pid,))
+            )
+            cumulative = 0
+            for bound, count in zip(self.buckets + ('+Inf',), values):
+                cumulative += count
+                lines.append(f'{self.name}_bucket{{{label_text},le="{bound}"}} {cumulative}')
+            lines.append(f'{self.name}_sum{{{label_text}}} {values[-2]}')
+            lines.append(f'{self.name}_count{{{label_text}}} {values[-1]}')
+        return lines
+
+
+def escape_label(value):
+    return value.replace('\\', r'\\').replace('"', r'\"').replace('\n', r'\n')
+
+
+REQUEST_SECONDS = Histogram(
+    'store_request_duration_seconds', 'Time to handle a request.', DURATION_BUCKETS, ('route', 'method', 'status'),
+)
+PHASE_SECONDS = Histogram(
+    'store_request_phase_seconds', 'Time spent per request in SQL, the view, serializers and rendering.',
+    DURATION_BUCKETS, ('route', 'phase'),
+)
+QUERIES = Histogram('store_request_queries', 'SQL queries per request.', QUERY_BUCKETS, ('route',))
+
+
+def request_route(request):
+    match = getattr(request, 'resolver_match', None)
+    return match.route if match is not None else 'unmatched'
+
+
+def record(request, response, timings):
+    route = request_route(request)
+    REQUEST_SECONDS.observe((route, request.method, f'{response.status_code // 100}xx'), timings.total)
+    for phase in PHASES:
+        PHASE_SECONDS.observe((route, phase), getattr(timings, phase))
+    QUERIES.observe((route,), timings.queries)
+
+
+def render_metrics():
+    lines = []
+    for histogram in (REQUEST_SECONDS, PHASE_SECONDS, QUERIES):
+        lines.extend(histogram.expose())
+    return '\n'.join(lines) + '\n'
@@ -0,0 +1,119 @@
+from time import perf_counter
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.utils.functional import SimpleLazyObject
+from whitenoise.middleware import WhiteNoiseMiddleware as BaseWhiteNoiseMiddleware
+
+from . import metrics
+
+
+class WhiteNoiseMiddleware(BaseWhiteNoiseMiddleware):
+    """
+    WhiteNoise that can also sit in an async middleware chain.
+
+    Upstream WhiteNoiseMiddleware is sync-only, so under ASGI Django wraps
+    it in sync_to_async and every request, async views included, hops to a
+    thread and back just to get past it. Being async-capable keeps async
+    requests on the event loop.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response=None, **kwargs):
+        super().__init__(get_response, **kwargs)
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        return super().__call__(request)
+
+    async def __acall__(self, request):
+        if self.autorefresh:
+            static_file = await sync_to_async(self.find_file, thread_sensitive=False)(request.path_info)
+        else:
+            static_file = self.files.get(request.path_info)
+        if static_file is not None:
+            return await sync_to_async(self.serve, thread_sensitive=False)(static_file, request)
+        return await self.get_response(request)
+
+
+class RequestMetricsMiddleware:
+    """
+    Time each request and its SQL, view, serializer and render phases, add a
+    Server-Timing header for staff (anyone with DEBUG on) and record the
+    numbers for /metrics. Goes first in MIDDLEWARE so the total covers the
+    rest of the stack.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if not settings.METRICS_ENABLED:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+            # Async handlers run sync view hooks on the thread-sensitive
+            # executor; these only note the time, so skip the hop.
+            self.process_view = self.aprocess_view
+            self.process_template_response = self.aprocess_template_response
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        timings, token = metrics.start_request()
+        try:
+            response = self.get_response(request)
+        finally:
+            metrics.finish_request(timings, token)
+        metrics.record(request, response, timings)
+        if settings.SERVER_TIMING and (settings.DEBUG or self.is_staff(getattr(request, 'user', None))):
+            response['Server-Timing'] = timings.server_timing()
+        return response
+
+    async def __acall__(self, request):
+        timings, token = metrics.start_request()
+        try:
+            response = await self.get_response(request)
+        finally:
+            metrics.finish_request(timings, token)
+        metrics.record(request, response, timings)
+        if settings.SERVER_TIMING and (settings.DEBUG or self.is_staff(await self.auser(request))):
+            response['Server-Timing'] = timings.server_timing()
+        return response
+
+    @staticmethod
+    def is_staff(user):
+        # A DRF view authenticates onto request.user, so token users count too.
+        return user is not None and user.is_active and user.is_staff
+
+    @staticmethod
+    async def auser(request):
+        # Still lazy unless a DRF view authenticated onto it; resolving the
+        # lazy user queries, which has to go through auser() here.
+        user = getattr(request, 'user', None)
+        if isinstance(user, SimpleLazyObject) and hasattr(request, 'auser'):
+            return await request.auser()
+        return user
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        metrics.current_timings().view_started = perf_counter()
+
+    def process_template_response(self, request, response):
+        metrics.current_timings().view_finished = perf_counter()
+        return response
+
+    async def aprocess_view(self, request, view_func, view_args, view_kwargs):
+        metrics.current_timings().view_started = perf_counter()
+
+    async def aprocess_template_response(self, request, response):
+        metrics.current_timings().view_finished = perf_counter()
+        return response
@@ -0,0 +1,44 @@
+from django.db import migrations, models
+
+
+def dedupe_payment_intents(apps, schema_editor):
+    # Blank IDs become NULL, which the unique index allows any number of.
+    # Later orders sharing an intent with an earlier one have to give up the
+    # ID, so the earliest order stays the one it points to. Without it they
+    # can never be paid or expired through Stripe, so they are expired here;
+    # expired orders with no intent are the ones to review by hand.
+    Order = apps.get_model('store_app', 'Order')
+    Order.objects.filter(payment_intent_id='').update(payment_intent_id=None)
+    seen = set()
+    duplicates = []
+    for pk, payment_intent_id in (
+        Order.objects.exclude(payment_intent_id=None).order_by('id').values_list('id', 'payment_intent_id')
+    ):
+        if payment_intent_id in seen:
+            duplicates.append(pk)
+        seen.add(payment_intent_id)
+    Order.objects.filter(pk__in=duplicates).update(payment_intent_id=None, status='expired')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store_app', '0016_product_search_index'),
+    ]
+
+    # Orders that already carry an intent stay pending: create_order saved
+    # whatever payment_intent_id the client sent without asking Stripe, so
+    # they aren't known to be paid. Run reconcile_payments to settle them.
+    operations = [
+        migrations.AddField(
+            model_name='order',
+            name='status',
+            field=models.CharField(choices=[('pending', 'Pending'), ('paid', 'Paid')], default='pending', max_length=10),
+        ),
+        migrations.RunPython(dedupe_payment_intents, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='order',
+            name='payment_intent_id',
+            field=models.CharField(blank=True, max_length=255, null=True, unique=True),
+        ),
+    ]
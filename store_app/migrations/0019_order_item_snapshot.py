@@ -0,0 +1,52 @@
+# Generated by Django 5.0.6 on 2026-10-18 12:25
+
+from django.conf import settings
+from django.db import migrations, models
+
+BATCH_SIZE = 500
+
+
+def backfill_product_snapshots(apps, schema_editor):
+    # Existing items get the product's current name and thumbnail, the
+    # closest thing to what it looked like when ordered. Their price is
+    # already the unit price paid.
+    OrderItem = apps.get_model('store_app', 'OrderItem')
+    items = OrderItem.objects.select_related('product').only(
+        'id', 'product__name', 'product__image', 'product__image_variants',
+    ).order_by('id')
+    last_id = 0
+    while batch := list(items.filter(id__gt=last_id)[:BATCH_SIZE]):
+        for item in batch:
+            variants = item.product.image_variants
+            item.product_name = item.product.name
+            item.product_image = (
+                variants.get('sizes', {}).get('thumbnail', {}).get('name') or item.product.image.name or ''
+            )
+        OrderItem.objects.bulk_update(batch, ['product_name', 'product_image'])
+        last_id = batch[-1].id
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store_app', '0018_idempotency_record'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='orderitem',
+            name='product_image',
+            field=models.CharField(blank=True, max_length=255),
+        ),
+        migrations.AddField(
+            model_name='orderitem',
+            name='product_name',
+            field=models.CharField(blank=True, max_length=100),
+        ),
+        migrations.RunPython(backfill_product_snapshots, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(fields=['user', 'created_at', 'id'], name='order_user_created_at_id_idx'),
+        ),
+    ]
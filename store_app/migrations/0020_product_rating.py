@@ -0,0 +1,54 @@
+# Generated by Django 5.0.6 on 2026-10-18 12:27
+
+import django.core.validators
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+def backfill_ratings(apps, schema_editor):
+    # Same arithmetic as store_app.ratings, with ratings outside 1-5 clamped.
+    Review = apps.get_model('store_app', 'Review')
+    ProductRating = apps.get_model('store_app', 'ProductRating')
+    ratings = {}
+    for product_id, rating in Review.objects.values_list('product_id', 'rating').iterator():
+        rating = min(max(rating, 1), 5)
+        row = ratings.setdefault(product_id, ProductRating(product_id=product_id))
+        row.count += 1
+        row.total += rating
+        setattr(row, f'stars_{rating}', getattr(row, f'stars_{rating}') + 1)
+    ProductRating.objects.bulk_create(ratings.values(), batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store_app', '0019_order_item_snapshot'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProductRating',
+            fields=[
+                ('product', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='rating', serialize=False, to='store_app.product')),
+                ('count', models.PositiveIntegerField(default=0)),
+                ('total', models.PositiveIntegerField(default=0)),
+                ('stars_1', models.PositiveIntegerField(default=0)),
+                ('stars_2', models.PositiveIntegerField(default=0)),
+                ('stars_3', models.PositiveIntegerField(default=0)),
+                ('stars_4', models.PositiveIntegerField(default=0)),
+                ('stars_5', models.PositiveIntegerField(default=0)),
+            ],
+        ),
+        migrations.RunPython(backfill_ratings, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='review',
+            name='rating',
+            field=models.PositiveIntegerField(default=1, validators=[django.core.validators.MinValueValidator(1), django.core.validators.MaxValueValidator(5)]),
+        ),
+        migrations.AddIndex(
+            model_name='review',
+            index=models.Index(fields=['product', 'created_at', 'id'], name='review_product_created_at_idx'),
+        ),
+    ]
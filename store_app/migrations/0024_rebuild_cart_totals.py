@@ -0,0 +1,21 @@
+from django.db import migrations
+
+
+def fill_cart_totals(apps, schema_editor):
+    # Cart.total_price (0009) was never kept up to date before cart writes
+    # started applying price deltas to it, so existing carts read 0 and
+    # removing a line would drive them negative. Compute each from its lines.
+    from store_app.cart import rebuild_cart_totals
+
+    rebuild_cart_totals(apps.get_model('store_app', 'Cart'), apps.get_model('store_app', 'CartProduct'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store_app', '0023_order_item_reserved'),
+    ]
+
+    operations = [
+        migrations.RunPython(fill_cart_totals, migrations.RunPython.noop),
+    ]
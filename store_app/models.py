@@ -1,4 +1,6 @@
+from django.core.validators import MaxValueValidator, MinValueValidator
 from django.db import models
+from django.db.models.functions import Collate
 from django.contrib.auth.models import User
 
 class Profile(models.Model):
@@ -17,6 +19,13 @@ class Category(models.Model):
     def __str__(self):
         return self.name
 
+class ProductQuerySet(models.QuerySet):
+    def catalog(self):
+        # Everything ProductSerializer touches, loaded up front so listing
+        # N products costs a fixed number of queries.
+        return self.select_related('category', 'rating').prefetch_related('images')
+
+
 class Product(models.Model):
     name = models.CharField(max_length=100)
     description = models.TextField()
@@ -24,6 +33,26 @@ class Product(models.Model):
     category = models.ForeignKey(Category, on_delete=models.CASCADE)
     created_at = models.DateTimeField(auto_now=True)
     image = models.ImageField(upload_to='product_images/')
+    image_width = models.PositiveIntegerField(null=True, blank=True, editable=False)
+    image_height = models.PositiveIntegerField(null=True, blank=True, editable=False)
+    image_variants = models.JSONField(default=dict, blank=True, editable=False)
+    # Units left to sell, or None for products whose stock isn't tracked.
+    # Orders reserve through store_app.stock.
+    stock = models.PositiveIntegerField(null=True, blank=True)
+
+    objects = ProductQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['created_at', 'id'], name='product_created_at_id_idx'),
+            # The product list's filters and sorts; see store_app.filters.
+            models.Index(fields=['category', 'price'], name='product_category_price_idx'),
+            models.Index(fields=['category', 'created_at'], name='product_category_created_idx'),
+            models.Index(fields=['price'], name='product_price_idx'),
+            # SQLite's LIKE is case-insensitive, so only a NOCASE index can
+            # serve name prefix matches.
+            models.Index(Collate('name', 'nocase'), name='product_name_nocase_idx'),
+        ]
 
     def __str__(self):
         return self.name
@@ -31,6 +60,9 @@ class Product(models.Model):
 class ProductImage(models.Model):
     product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='images')
     image = models.ImageField(upload_to='product_images/')
+    image_width = models.PositiveIntegerField(null=True, blank=True, editable=False)
+    image_height = models.PositiveIntegerField(null=True, blank=True, editable=False)
+    image_variants = models.JSONField(default=dict, blank=True, editable=False)
 
     def __str__(self):
         return f"Image for {self.product.name}"
@@ -62,11 +94,32 @@ class CartProduct(models.Model):
 #     address_line_2 = models.CharField(max_length=100)
 #     city = models.CharField
 
+class OrderQuerySet(models.QuerySet):
+    def with_items(self):
+        # Order items carry their own product snapshot, so no product rows
+        # are needed.
+        return self.select_related('user').prefetch_related('order_items')
+
+
 class Order(models.Model):
+    PENDING = 'pending'
+    PAID = 'paid'
+    # Unpaid past its stock reservation, which has been released.
+    EXPIRED = 'expired'
+    STATUS_CHOICES = [(PENDING, 'Pending'), (PAID, 'Paid'), (EXPIRED, 'Expired')]
+
     user = models.ForeignKey(User, null=True, blank=True, on_delete=models.CASCADE)
     created_at = models.DateTimeField(auto_now_add=True)
     total_price = models.DecimalField(max_digits=10, decimal_places=2)
-    payment_intent_id = models.CharField(max_length=255, blank=True, null=True)
+    payment_intent_id = models.CharField(max_length=255, blank=True, null=True, unique=True)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=PENDING)
+
+    objects = OrderQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', 'created_at', 'id'], name='order_user_created_at_id_idx'),
+        ]
 
     def __str__(self):
         return f"Order {self.id} by {self.user.username}"
@@ -76,21 +129,72 @@ class OrderItem(models.Model):
     product = models.ForeignKey(Product, on_delete=models.CASCADE)
     quantity = models.PositiveIntegerField(default=1)
     price = models.DecimalField(max_digits=10, decimal_places=2)
+    # The product as it was when ordered: its name and the storage path of
+    # its thumbnail. Order history is rendered from these, not the product.
+    product_name = models.CharField(max_length=100, blank=True)
+    product_image = models.CharField(max_length=255, blank=True)
+    # Whether placing the order took this line's quantity off the product's
+    # stock. Lines of untracked products, or ordered before stock was tracked,
+    # have nothing to give back when the order expires.
+    reserved = models.BooleanField(default=False)
 
     def __str__(self):
-        return f"{self.product.name} x {self.quantity}"
+        return f"{self.product_name} x {self.quantity}"
 
 class Review(models.Model):
     product = models.ForeignKey(Product, on_delete=models.CASCADE)
     user = models.ForeignKey(User, on_delete=models.CASCADE)
-    rating = models.PositiveIntegerField(default=1)
+    rating = models.PositiveIntegerField(default=1, validators=[MinValueValidator(1), MaxValueValidator(5)])
     comment = models.TextField()
     created_at = models.DateTimeField(auto_now=True)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['product', 'created_at', 'id'], name='review_product_created_at_idx'),
+        ]
+
     def __str__(self):
         return f"Review of {self.product.name} by {self.user.username}"
 
 
+class ProductRating(models.Model):
+    # Running totals of a product's reviews, kept up to date by signals as
+    # reviews are saved and deleted, so nothing has to aggregate Review.
+    product = models.OneToOneField(Product, on_delete=models.CASCADE, primary_key=True, related_name='rating')
+    count = models.PositiveIntegerField(default=0)
+    total = models.PositiveIntegerField(default=0)
+    stars_1 = models.PositiveIntegerField(default=0)
+    stars_2 = models.PositiveIntegerField(default=0)
+    stars_3 = models.PositiveIntegerField(default=0)
+    stars_4 = models.PositiveIntegerField(default=0)
+    stars_5 = models.PositiveIntegerField(default=0)
+
+    def __str__(self):
+        return f"Rating of {self.product_id}"
+
+
+class IssuedPaymentIntent(models.Model):
+    # PaymentIntents created through this store. Only these, or intents an
+    # order already exists for, may reserve stock: the order endpoints are
+    # unauthenticated and never ask Stripe about the intent they're given.
+    payment_intent_id = models.CharField(max_length=255, unique=True)
+    amount = models.PositiveIntegerField()  # in cents
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return self.payment_intent_id
 
 
+class IdempotencyRecord(models.Model):
+    # sha256 of who sent the request, to which path, and its Idempotency-Key.
+    key = models.CharField(max_length=64, unique=True)
+    # sha256 of the request body, to refuse reusing a key for another request.
+    fingerprint = models.CharField(max_length=64)
+    # Null while the first request is still being handled.
+    status_code = models.PositiveSmallIntegerField(null=True)
+    content_type = models.CharField(max_length=100, blank=True)
+    body = models.BinaryField(default=b'')
+    created_at = models.DateTimeField(auto_now_add=True, db_index=True)
 
+    def __str__(self):
+        return self.key
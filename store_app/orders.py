@@ -0,0 +1,140 @@
+import logging
+from decimal import Decimal
+
+from .cart import ProductNotFound, cart_lines
+from .db import write_transaction
+from .derivatives import thumbnail_name
+from .models import Cart, IssuedPaymentIntent, Order, OrderItem, Product
+from .stock import OutOfStock, line_quantities, order_quantities, reserve_stock
+
+logger = logging.getLogger(__name__)
+
+
+class EmptyCart(Exception):
+    pass
+
+
+class UnknownPaymentIntent(Exception):
+    def __init__(self, payment_intent_id):
+        super().__init__(f'Payment intent {payment_intent_id} was not created by this store')
+        self.payment_intent_id = payment_intent_id
+
+
+def resolve_order_lines(items, product_key='product_id'):
+    """
+    Turn cart items ({product_key: id, 'quantity': n}) into (product, quantity)
+    pairs, loading every product in a single query. Raises ProductNotFound
+    before anything is written if any ID is unknown.
+    """
+    product_ids = [int(item[product_key]) for item in items]
+    products = Product.objects.in_bulk(product_ids)
+    missing = [product_id for product_id in product_ids if product_id not in products]
+    if missing:
+        raise ProductNotFound(missing)
+    return [(products[int(item[product_key])], item['quantity']) for item in items]
+
+
+@write_transaction
+def place_order(lines, total_price, user=None, payment_intent_id=None):
+    """
+    Create an order and all of its items in one short write transaction:
+    the stock reservation, one INSERT for the order and one bulk INSERT for
+    the items. Raises OutOfStock, writing nothing, if any product is short.
+    """
+    reserved = reserve_stock(line_quantities(lines))
+    order = Order.objects.create(
+        user=user,
+        total_price=total_price,
+        payment_intent_id=payment_intent_id,
+    )
+    add_order_items(order, lines, reserved)
+    return order
+
+
+def add_order_items(order, lines, reserved=()):
+    """Insert the order's lines, marking those of the products in reserved as holding stock."""
+    OrderItem.objects.bulk_create([
+        OrderItem(
+            order=order, product=product, quantity=quantity, price=product.price, product_name=product.name,
+            product_image=thumbnail_name(product.image.name, product.image_variants),
+            reserved=product.pk in reserved,
+        )
+        for product, quantity in lines
+    ])
+
+
+@write_transaction
+def record_payment_order(payment_intent_id, lines, user=None, total_price=None):
+    """
+    Get or create the order for a PaymentIntent, returning (order, created).
+    A new order records total_price, or the sum of its lines if None.
+
+    The unique payment_intent_id makes this an indexed lookup, so a retried
+    confirmation returns the existing order instead of placing another. If
+    the succeeded webhook got there first the order exists without items,
+    and the items from the confirmation are attached to it. Stock is
+    reserved along with the items, raising OutOfStock if any product is
+    short. Intents the store didn't issue and has no order for raise
+    UnknownPaymentIntent, so made-up ids can't hold stock.
+    """
+    if not (
+        IssuedPaymentIntent.objects.filter(payment_intent_id=payment_intent_id).exists()
+        or Order.objects.filter(payment_intent_id=payment_intent_id).exists()
+    ):
+        raise UnknownPaymentIntent(payment_intent_id)
+    if total_price is None:
+        total_price = sum(product.price * quantity for product, quantity in lines)
+    order, created = Order.objects.get_or_create(
+        payment_intent_id=payment_intent_id,
+        defaults={'user': user, 'total_price': total_price},
+    )
+    if created or not order.order_items.exists():
+        if order.user_id is None and user is not None:
+            order.user = user
+            order.save(update_fields=['user'])
+        reserved = reserve_stock(line_quantities(lines))
+        add_order_items(order, lines, reserved)
+    return order, created
+
+
+@write_transaction
+def mark_order_paid(payment_intent_id, amount_received):
+    """
+    Record that Stripe captured amount_received (in cents) for the intent,
+    creating the order if the customer's confirmation has not arrived yet.
+    Safe to repeat, as Stripe may deliver an event more than once.
+
+    An order that expired before the payment went through takes its stock
+    back; if that is no longer there the order is still paid for, and is
+    logged for someone to resolve.
+    """
+    order = Order.objects.filter(payment_intent_id=payment_intent_id).first()
+    if order is not None and order.status == Order.EXPIRED:
+        try:
+            reserve_stock(order_quantities([order.pk]))
+        except OutOfStock as e:
+            logger.error("Order %s was paid after expiring and is short of stock: %s", order.pk, e)
+    order, _ = Order.objects.update_or_create(
+        payment_intent_id=payment_intent_id,
+        defaults={'status': Order.PAID, 'total_price': Decimal(amount_received) / 100},
+    )
+    return order
+
+
+@write_transaction
+def checkout_cart(cart_id, user=None):
+    """
+    Turn a stored cart into an order with a fixed number of statements
+    regardless of cart size: one cart lookup, one joined read of the lines,
+    the order inserts and one cascade delete of the cart and its lines.
+    Raises Cart.DoesNotExist or EmptyCart.
+    """
+    cart = Cart.objects.get(id=cart_id)
+    lines = [(cart_product.product, cart_product.quantity) for cart_product in cart_lines(cart)]
+    if not lines:
+        raise EmptyCart
+
+    total_price = sum(product.price * quantity for product, quantity in lines)
+    order = place_order(lines, total_price, user=user)
+    cart.delete()
+    return order
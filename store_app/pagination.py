@@ -0,0 +1,133 @@
+from base64 import b64decode, b64encode
+from urllib import parse
+
+from django.core.exceptions import ValidationError
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import CursorPagination, PageNumberPagination
+from rest_framework.utils.urls import replace_query_param
+
+
+class KeysetCursorPagination(CursorPagination):
+    """
+    Cursor pagination whose cursor holds every ordering value of the row it
+    stops at, not just the first. DRF's CursorPagination seeks on
+    ordering[0] only and steps through ties with an OFFSET that gives up
+    past offset_cutoff; here a page after the row (v, id) filters on
+    ``col > v OR (col = v AND id > id)``, so runs of ties of any length
+    page in order. ordering must end in a unique field.
+    """
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.page_size = self.get_page_size(request)
+        if not self.page_size:
+            return None
+        self.base_url = request.build_absolute_uri()
+        self.model = queryset.model
+        position, reverse = self.decode_keyset(request)
+
+        ordering = [flip(field) if reverse else field for field in self.ordering]
+        queryset = queryset.order_by(*ordering)
+        if position is not None:
+            queryset = queryset.filter(self.seek(ordering, position))
+        rows = list(queryset[:self.page_size + 1])
+        has_more = len(rows) > self.page_size
+        rows = rows[:self.page_size]
+        if reverse:
+            rows.reverse()
+
+        # A cursor always points at a real row, so the side it came from
+        # has rows; the other side has more if the page overflowed.
+        self.has_next = bool(rows) and (reverse or has_more)
+        self.has_previous = bool(rows) and (has_more if reverse else position is not None)
+        self.page = rows
+        return rows
+
+    def seek(self, ordering, position):
+        """Q for the rows after ``position`` in ``ordering``."""
+        seek, ties = Q(), Q()
+        for field, value in zip(ordering, position):
+            name = field.lstrip('-')
+            after = Q(**{f"{name}__{'lt' if field.startswith('-') else 'gt'}": value})
+            seek |= ties & after
+            ties &= Q(**{name: value})
+        # The redundant bound on the first column lets SQLite turn the OR
+        # into a range seek on the index.
+        first = ordering[0]
+        bound = Q(**{f"{first.lstrip('-')}__{'lte' if first.startswith('-') else 'gte'}": position[0]})
+        return bound & seek
+
+    def position_of(self, row):
+        names = [field.lstrip('-') for field in self.ordering]
+        return [str(row[name] if isinstance(row, dict) else getattr(row, name)) for name in names]
+
+    def decode_keyset(self, request):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if encoded is None:
+            return None, False
+        try:
+            tokens = parse.parse_qs(b64decode(encoded.encode('ascii')).decode('ascii'))
+            reverse = bool(int(tokens.get('r', ['0'])[0]))
+            values = tokens['p']
+            if len(values) != len(self.ordering):
+                raise ValueError
+            position = [
+                self.model._meta.get_field(field.lstrip('-')).to_python(value)
+                for field, value in zip(self.ordering, values)
+            ]
+        except (TypeError, ValueError, KeyError, ValidationError):
+            raise NotFound(self.invalid_cursor_message)
+        return position, reverse
+
+    def encode_keyset(self, row, reverse):
+        tokens = {'p': self.position_of(row)}
+        if reverse:
+            tokens['r'] = '1'
+        encoded = b64encode(parse.urlencode(tokens, doseq=True).encode('ascii')).decode('ascii')
+        return replace_query_param(self.base_url, self.cursor_query_param, encoded)
+
+    def get_next_link(self):
+        return self.encode_keyset(self.page[-1], reverse=False) if self.has_next else None
+
+    def get_previous_link(self):
+        return self.encode_keyset(self.page[0], reverse=True) if self.has_previous else None
+
+
+def flip(field):
+    return field[1:] if field.startswith('-') else f'-{field}'
+
+
+class ProductCursorPagination(KeysetCursorPagination):
+    # Keyset pagination over (created_at, id), backed by
+    # product_created_at_id_idx. Each page is a range seek on the index, so
+    # page N costs the same as page 1. get_products swaps in the ordering of
+    # the requested sort.
+    ordering = ('-created_at', '-id')
+    page_size = 24
+    page_size_query_param = 'page_size'
+    max_page_size = 100
+
+
+class OrderCursorPagination(KeysetCursorPagination):
+    # A user's order history, newest first, seeking on
+    # order_user_created_at_id_idx.
+    ordering = ('-created_at', '-id')
+    page_size = 20
+    page_size_query_param = 'page_size'
+    max_page_size = 100
+
+
+class ReviewCursorPagination(KeysetCursorPagination):
+    # A product's reviews, newest first, seeking on
+    # review_product_created_at_idx.
+    ordering = ('-created_at', '-id')
+    page_size = 20
+    page_size_query_param = 'page_size'
+    max_page_size = 100
+
+
+class SearchPagination(PageNumberPagination):
+    # Relevance isn't a stable keyset, so search results are paged by number.
+    page_size = 24
+    page_size_query_param = 'page_size'
+    max_page_size = 100
@@ -0,0 +1,55 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+
+import stripe
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from rest_framework.request import Request
+from rest_framework.settings import api_settings
+
+stripe.api_key = settings.STRIPE_SECRET_KEY
+stripe.api_base = settings.STRIPE_API_BASE
+stripe.default_http_client = stripe.http_client.RequestsClient(timeout=settings.STRIPE_TIMEOUT)
+
+# Stripe calls block on the network, so they run on their own small pool.
+# Its size caps how many payment requests can be in flight against Stripe
+# per worker; everything else keeps being served by the event loop.
+_stripe_pool = ThreadPoolExecutor(max_workers=settings.STRIPE_MAX_CONCURRENCY, thread_name_prefix='stripe')
+
+
+class StripeTimeout(stripe.error.APIConnectionError):
+    pass
+
+
+async def stripe_call(func, *args, **kwargs):
+    """
+    Await a blocking stripe-python call (e.g. stripe.PaymentIntent.create)
+    on the Stripe pool, giving up after STRIPE_TIMEOUT seconds.
+    """
+    loop = asyncio.get_running_loop()
+    try:
+        return await asyncio.wait_for(
+            loop.run_in_executor(_stripe_pool, partial(func, *args, **kwargs)),
+            timeout=settings.STRIPE_TIMEOUT,
+        )
+    except asyncio.TimeoutError:
+        raise StripeTimeout(f'Stripe did not respond within {settings.STRIPE_TIMEOUT}s')
+
+
+def _parse_api_request(request):
+    api_request = Request(
+        request,
+        parsers=[parser() for parser in api_settings.DEFAULT_PARSER_CLASSES],
+        authenticators=[auth() for auth in api_settings.DEFAULT_AUTHENTICATION_CLASSES],
+    )
+    return api_request.data, api_request.user
+
+
+async def read_api_request(request):
+    """
+    Parse the body and authenticate an async view's request the same way
+    the DRF function views do, returning (data, user). Raises DRF's
+    APIException subclasses for malformed bodies or bad credentials.
+    """
+    return await sync_to_async(_parse_api_request)(request)
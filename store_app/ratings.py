@@ -0,0 +1,61 @@
+"""
+Incremental upkeep of ProductRating. Each review saved or deleted moves its
+product's count, total and histogram bucket by one review, so ratings are
+never recomputed from the Review table.
+"""
+from django.db.models import Count, F, Q, Sum
+from django.db.models.functions import Greatest, Least
+
+from .db import write_transaction
+from .models import ProductRating, Review
+
+STARS = range(1, 6)
+
+
+def clamp_rating(rating):
+    # Reviews saved before ratings were validated may fall outside 1-5.
+    return min(max(rating, 1), 5)
+
+
+def add_rating(product_id, rating):
+    ProductRating.objects.get_or_create(product_id=product_id)
+    _adjust(product_id, rating, 1)
+
+
+def remove_rating(product_id, rating):
+    # No row to create here: when the product itself is being deleted its
+    # rating row goes with it.
+    _adjust(product_id, rating, -1)
+
+
+def _adjust(product_id, rating, step):
+    rating = clamp_rating(rating)
+    ProductRating.objects.filter(product_id=product_id).update(**{
+        'count': F('count') + step,
+        'total': F('total') + step * rating,
+        f'stars_{rating}': F(f'stars_{rating}') + step,
+    })
+
+
+@write_transaction
+def save_review(serializer, **fields):
+    """Save a ReviewSerializer, and with it the rating update, in one write transaction."""
+    return serializer.save(**fields)
+
+
+@write_transaction
+def rebuild_ratings():
+    """
+    Recompute every ProductRating from the Review table, for reviews written
+    without signals (bulk_create, raw SQL). Returns the number of products
+    with reviews.
+    """
+    rows = Review.objects.annotate(stars=Greatest(Least('rating', 5), 1)).values('product_id').annotate(
+        count=Count('id'),
+        total=Sum('stars'),
+        **{f'stars_{stars}': Count('id', filter=Q(stars=stars)) for stars in STARS},
+    )
+    ratings = [ProductRating(**row) for row in rows]
+    ProductRating.objects.all().delete()
+    ProductRating.objects.bulk_create(ratings)
+    return len(ratings)
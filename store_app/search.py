@@ -0,0 +1,115 @@
+import re
+
+from django.db import connection
+from django.db.models.expressions import RawSQL
+
+from .models import Product
+
+FTS_TABLE = 'store_app_product_fts'
+
+# External-content FTS5 index over Product.name/description, kept in sync by
+# triggers. Everything is IF NOT EXISTS so it can be re-applied after a
+# migration rebuilds store_app_product (which drops its triggers).
+SEARCH_INDEX_SQL = [
+    f"""
+    CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5(
+        name, description,
+        content='store_app_product', content_rowid='id',
+        tokenize='unicode61 remove_diacritics 2'
+    )
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_insert AFTER INSERT ON store_app_product BEGIN
+        INSERT INTO {FTS_TABLE}(rowid, name, description) VALUES (new.id, new.name, new.description);
+    END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_delete AFTER DELETE ON store_app_product BEGIN
+        INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, name, description)
+        VALUES ('delete', old.id, old.name, old.description);
+    END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_update AFTER UPDATE OF name, description ON store_app_product BEGIN
+        INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, name, description)
+        VALUES ('delete', old.id, old.name, old.description);
+        INSERT INTO {FTS_TABLE}(rowid, name, description) VALUES (new.id, new.name, new.description);
+    END
+    """,
+]
+TRIGGER_NAMES = [f'{FTS_TABLE}_insert', f'{FTS_TABLE}_delete', f'{FTS_TABLE}_update']
+
+# bm25 column weights: a hit in the name counts for more than one in the description.
+RANK = f'bm25({FTS_TABLE}, 10.0, 1.0)'
+
+
+def ensure_search_index(using_connection=connection, rebuild=False):
+    """
+    Create the FTS table and its triggers if any are missing, and reindex
+    the catalog when they were (or when ``rebuild`` is set).
+    """
+    if using_connection.vendor != 'sqlite':
+        return
+    with using_connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT count(*) FROM sqlite_master WHERE type = 'trigger' AND name IN (%s, %s, %s)",
+            TRIGGER_NAMES,
+        )
+        missing = cursor.fetchone()[0] < len(TRIGGER_NAMES)
+        for statement in SEARCH_INDEX_SQL:
+            cursor.execute(statement)
+        if missing or rebuild:
+            cursor.execute(f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('rebuild')")
+
+
+def match_expression(query):
+    """
+    Turn free text into an FTS5 query: every word must match, each as a
+    prefix, and FTS syntax characters in the input are never interpreted.
+    """
+    terms = re.findall(r'\w+', query or '')
+    return ' '.join(f'"{term}"*' for term in terms)
+
+
+def matching_product_ids(query):
+    """A subquery of product ids matching ``query``, for filter(pk__in=...)."""
+    match = match_expression(query)
+    if not match:
+        return RawSQL(f'SELECT rowid FROM {FTS_TABLE} WHERE 0', ())
+    return RawSQL(f'SELECT rowid FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s', (match,))
+
+
+class ProductSearchResults:
+    """
+    Lazily evaluated, BM25-ranked search results that Django's Paginator can
+    count and slice. Each slice is one ranked LIMIT/OFFSET lookup on the FTS
+    index plus the catalog queries for just that page of products.
+    """
+
+    def __init__(self, query):
+        self.match = match_expression(query)
+
+    def count(self):
+        if not self.match:
+            return 0
+        with connection.cursor() as cursor:
+            cursor.execute(f'SELECT count(*) FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s', [self.match])
+            return cursor.fetchone()[0]
+
+    def __len__(self):
+        return self.count()
+
+    def __getitem__(self, index):
+        if not isinstance(index, slice):
+            return self[index:index + 1][0]
+        start = index.start or 0
+        if not self.match or index.stop is None or index.stop <= start:
+            return []
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'SELECT rowid FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s ORDER BY {RANK} LIMIT %s OFFSET %s',
+                [self.match, index.stop - start, start],
+            )
+            ids = [row[0] for row in cursor.fetchall()]
+        products = Product.objects.catalog().in_bulk(ids)
+        return [products[product_id] for product_id in ids if product_id in products]
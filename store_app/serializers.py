@@ -1,44 +1,78 @@
 from rest_framework import serializers
 from django.contrib.auth.models import User
+from .fast_serializers import image_sizes, image_srcset, media_url, rating_summary
+from .metrics import TimedSerializerMixin
+from .ratings import STARS
 from .models import Profile, Category, Product, ProductImage, Cart, CartProduct, Order, OrderItem, Review
 
-class UserSerializer(serializers.ModelSerializer):
+class UserSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     class Meta:
         model = User
         fields = ['id', 'username', 'email', 'first_name', 'last_name']
 
-class ProfileSerializer(serializers.ModelSerializer):
+class ProfileSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     user = UserSerializer(read_only=True)
 
     class Meta:
         model = Profile
         fields = ['id', 'user', 'first_name', 'last_name', 'email', 'created_at']
 
-class CategorySerializer(serializers.ModelSerializer):
+class CategorySerializer(TimedSerializerMixin, serializers.ModelSerializer):
     class Meta:
         model = Category
         fields = ['id', 'name']
 
-class ProductImageSerializer(serializers.ModelSerializer):
+class ImageVariantsMixin(serializers.Serializer):
+    image_sizes = serializers.SerializerMethodField()
+    image_srcset = serializers.SerializerMethodField()
+
+    def get_image_sizes(self, obj):
+        return image_sizes(obj.image_variants)
+
+    def get_image_srcset(self, obj):
+        return image_srcset(obj.image_variants)
+
+class ProductImageSerializer(TimedSerializerMixin, ImageVariantsMixin, serializers.ModelSerializer):
     class Meta:
         model = ProductImage
-        fields = ['id', 'product', 'image']
+        fields = ['id', 'product', 'image', 'image_width', 'image_height', 'image_sizes', 'image_srcset']
 
-class ProductSerializer(serializers.ModelSerializer):
+class ProductSerializer(TimedSerializerMixin, ImageVariantsMixin, serializers.ModelSerializer):
     images = ProductImageSerializer(many=True, read_only=True)
+    rating = serializers.SerializerMethodField()
 
     class Meta:
         model = Product
-        fields = ['id', 'name', 'description', 'price', 'category', 'created_at', 'image', 'images']
+        fields = ['id', 'name', 'description', 'price', 'category', 'created_at', 'image', 'image_width',
+                  'image_height', 'image_sizes', 'image_srcset', 'images', 'rating']
 
-class CartProductSerializer(serializers.ModelSerializer):
+    def get_rating(self, obj):
+        rating = getattr(obj, 'rating', None)
+        if rating is None:
+            return rating_summary(0, 0, [0] * len(STARS))
+        return rating_summary(rating.count, rating.total, [getattr(rating, f'stars_{stars}') for stars in STARS])
+
+class CartProductSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     product = ProductSerializer(read_only=True)
 
     class Meta:
         model = CartProduct
         fields = ['id', 'product', 'quantity']
 
-class CartSerializer(serializers.ModelSerializer):
+class CartOperationSerializer(serializers.Serializer):
+    op = serializers.ChoiceField(choices=['add', 'set', 'remove'])
+    product_id = serializers.IntegerField(min_value=1)
+    quantity = serializers.IntegerField(min_value=0, default=1)
+
+    def validate(self, data):
+        if data['op'] == 'add' and data['quantity'] < 1:
+            raise serializers.ValidationError({'quantity': 'Added quantities must be at least 1.'})
+        return data
+
+class CartBatchSerializer(serializers.Serializer):
+    operations = CartOperationSerializer(many=True, allow_empty=False, max_length=100)
+
+class CartSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     user = UserSerializer(read_only=True)
     cart_products = CartProductSerializer(many=True, read_only=True, source='cartproduct_set')
 
@@ -46,27 +80,31 @@ class CartSerializer(serializers.ModelSerializer):
         model = Cart
         fields = ['id', 'user', 'created_at', 'total_price', 'cart_products']
 
-class OrderItemSerializer(serializers.ModelSerializer):
-    product = ProductSerializer(read_only=True)
+class OrderItemSerializer(TimedSerializerMixin, serializers.ModelSerializer):
+    product_image = serializers.SerializerMethodField()
 
     class Meta:
         model = OrderItem
-        fields = ['id', 'order', 'product', 'quantity', 'price']
+        fields = ['id', 'order', 'product', 'product_name', 'product_image', 'quantity', 'price']
+
+    def get_product_image(self, obj):
+        return media_url(obj.product_image)
 
-class OrderSerializer(serializers.ModelSerializer):
+class OrderSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     user = UserSerializer(read_only=True)
     order_items = OrderItemSerializer(many=True, read_only=True)
 
     class Meta:
         model = Order
-        fields = ['id', 'user', 'created_at', 'total_price', 'order_items', 'payment_intent_id'] 
+        fields = ['id', 'user', 'created_at', 'total_price', 'order_items', 'payment_intent_id', 'status']
 
 
-class ReviewSerializer(serializers.ModelSerializer):
-    user = UserSerializer(read_only=True)
-    product = ProductSerializer(read_only=True)
+class ReviewSerializer(TimedSerializerMixin, serializers.ModelSerializer):
+    # Reviews are public, so only the reviewer's username is shown.
+    user = serializers.CharField(source='user.username', read_only=True)
 
     class Meta:
         model = Review
         fields = ['id', 'product', 'user', 'rating', 'comment', 'created_at']
+        read_only_fields = ['product']
 
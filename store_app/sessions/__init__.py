@@ -0,0 +1,53 @@
+"""
+Session engines that keep anonymous sessions out of SQLite.
+
+SESSION_STORAGE=cache or cookie picks one of these instead of the default
+database sessions, so browsing and filling a cart never takes the database
+write lock. Sessions created while the database backend was in use are
+still read: when the new store has nothing for a session key in the
+database backend's format, the django_session row is loaded, its cart
+compacted, and the session saved to the new store on the way out. The row
+itself is left for clearsessions.
+"""
+import re
+
+from django.contrib.sessions.backends.db import SessionStore as DatabaseStore
+from django.contrib.sessions.models import Session
+from django.utils import timezone
+
+from ..cart import compact_session_cart
+from ..db import write_transaction
+
+# Keys the database backend hands out: 32 characters of [a-z0-9].
+DATABASE_KEY = re.compile(r'[a-z0-9]{32}')
+
+
+class LegacySessionMixin:
+    def load(self):
+        session_key = self.session_key
+        session_data = super().load()
+        if session_data or not session_key or not DATABASE_KEY.fullmatch(session_key):
+            return session_data
+        session_data = DatabaseStore(session_key).load()
+        if session_data:
+            compact_session_cart(session_data)
+            self.modified = True
+        return session_data
+
+
+@write_transaction
+def compact_database_sessions():
+    """
+    Delete expired django_session rows and rewrite the carts of the rest in
+    the compact format. Returns the number of sessions rewritten.
+    """
+    DatabaseStore.clear_expired()
+    store = DatabaseStore()
+    compacted = []
+    for session in Session.objects.filter(expire_date__gt=timezone.now()).iterator():
+        session_data = store.decode(session.session_data)
+        if compact_session_cart(session_data):
+            session.session_data = store.encode(session_data)
+            compacted.append(session)
+    Session.objects.bulk_update(compacted, ['session_data'], batch_size=500)
+    return len(compacted)
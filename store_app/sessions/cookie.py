@@ -0,0 +1,7 @@
+from django.contrib.sessions.backends import signed_cookies
+
+from . import LegacySessionMixin
+
+
+class SessionStore(LegacySessionMixin, signed_cookies.SessionStore):
+    pass
@@ -0,0 +1,136 @@
+from django.contrib.auth.models import User
+from django.contrib.auth.signals import user_logged_in
+from django.db import connections, transaction
+from django.db.backends.signals import connection_created
+from django.db.models.signals import post_delete, post_migrate, post_save, pre_delete, pre_save
+from django.dispatch import receiver
+
+from .authentication import forget_user
+from .cache import invalidate_catalog
+from .cart import merge_session_cart, remove_from_carts, reprice_carts
+from .images import delete_derivatives, schedule_derivatives
+from .metrics import query_timer
+from .models import Category, Product, ProductImage, Profile, Review
+from .ratings import add_rating, remove_rating
+from .search import FTS_TABLE, ensure_search_index
+
+
+@receiver([post_save, post_delete], sender=Product)
+@receiver([post_save, post_delete], sender=ProductImage)
+@receiver([post_save, post_delete], sender=Category)
+def catalog_changed(sender, **kwargs):
+    invalidate_catalog()
+
+
+@receiver(pre_save, sender=Product)
+@receiver(pre_save, sender=ProductImage)
+def note_image_change(sender, instance, **kwargs):
+    # An uncommitted FieldFile is a fresh upload that the save is about to
+    # write to storage.
+    instance._image_uploaded = bool(instance.image) and not instance.image._committed
+    previous = sender.objects.filter(pk=instance.pk).values('image', 'image_variants').first() if instance.pk else None
+    instance._stale_variants = None
+    if previous and (instance._image_uploaded or previous['image'] != instance.image.name):
+        # The derivatives belong to the image being replaced; don't serve or
+        # keep them once the new one is saved.
+        instance._stale_variants = previous['image_variants']
+        instance.image_width = instance.image_height = None
+        instance.image_variants = {}
+
+
+@receiver(post_save, sender=Product)
+@receiver(post_save, sender=ProductImage)
+def build_image_derivatives(sender, instance, **kwargs):
+    stale, instance._stale_variants = getattr(instance, '_stale_variants', None), None
+    if stale:
+        transaction.on_commit(lambda: delete_derivatives(stale))
+    if getattr(instance, '_image_uploaded', False):
+        instance._image_uploaded = False
+        transaction.on_commit(lambda: schedule_derivatives(instance))
+
+
+@receiver(post_delete, sender=Product)
+@receiver(post_delete, sender=ProductImage)
+def delete_image_derivatives(sender, instance, **kwargs):
+    if instance.image_variants:
+        transaction.on_commit(lambda: delete_derivatives(instance.image_variants))
+
+
+@receiver(pre_save, sender=Product)
+def note_previous_price(sender, instance, **kwargs):
+    instance._previous_price = (
+        Product.objects.filter(pk=instance.pk).values_list('price', flat=True).first() if instance.pk else None
+    )
+
+
+@receiver(post_save, sender=Product)
+def product_price_changed(sender, instance, created, **kwargs):
+    # Covers the admin and update_product alike; queryset.update() bypasses
+    # signals, so run rebuild_cart_totals after bulk price changes.
+    previous = getattr(instance, '_previous_price', None)
+    if not created and previous is not None and previous != instance.price:
+        reprice_carts(instance, previous)
+
+
+@receiver(pre_delete, sender=Product)
+def product_deleted(sender, instance, **kwargs):
+    # pre_delete: the cascade removes the cart lines before post_delete.
+    remove_from_carts(instance)
+
+
+@receiver(pre_save, sender=Review)
+def note_previous_rating(sender, instance, **kwargs):
+    instance._previous_rating = (
+        Review.objects.filter(pk=instance.pk).values_list('product_id', 'rating').first() if instance.pk else None
+    )
+
+
+@receiver(post_save, sender=Review)
+def review_saved(sender, instance, **kwargs):
+    previous = getattr(instance, '_previous_rating', None)
+    current = (instance.product_id, instance.rating)
+    if previous != current:
+        if previous is not None:
+            remove_rating(*previous)
+        add_rating(*current)
+        invalidate_catalog()
+
+
+@receiver(post_delete, sender=Review)
+def review_deleted(sender, instance, **kwargs):
+    remove_rating(instance.product_id, instance.rating)
+    invalidate_catalog()
+
+
+@receiver([post_save, post_delete], sender=User)
+def user_changed(sender, instance, **kwargs):
+    forget_user(instance.pk)
+
+
+@receiver([post_save, post_delete], sender=Profile)
+def profile_changed(sender, instance, **kwargs):
+    forget_user(instance.user_id)
+
+
+@receiver(user_logged_in)
+def merge_cart_on_login(sender, request, user, **kwargs):
+    # Session logins; token logins merge in CartMergingTokenObtainPairView.
+    if request is not None and hasattr(request, 'session'):
+        merge_session_cart(user, request.session)
+
+
+@receiver(post_migrate)
+def restore_search_index(sender, using, **kwargs):
+    # Migrations that rebuild store_app_product drop the FTS triggers along
+    # with the old table; put them back and reindex if that happened.
+    connection = connections[using]
+    if sender.name == 'store_app' and FTS_TABLE in connection.introspection.table_names():
+        ensure_search_index(connection)
+
+
+@receiver(connection_created)
+def install_query_timer(sender, connection, **kwargs):
+    # Wrappers outlive reconnects, so only install once per connection
+    # object. It goes first so execute_wrapper() blocks still pop their own.
+    if query_timer not in connection.execute_wrappers:
+        connection.execute_wrappers.insert(0, query_timer)
@@ -0,0 +1,39 @@
+"""
+SQLite backend tuned for several gunicorn workers sharing one database file.
+
+Accepts two extra OPTIONS on top of Django's sqlite3 backend:
+
+* ``pragmas``: a {name: value} dict applied to every new connection, e.g.
+  WAL journaling, ``synchronous``, ``busy_timeout``, ``mmap_size`` and
+  ``cache_size``. ``PRAGMAS`` in the TEST settings overrides them for the
+  test database, which tests and benchmarks run against.
+* Connections honour ``begin_immediate`` (set by store_app.db.immediate_atomic)
+  so write transactions take the write lock up front with BEGIN IMMEDIATE
+  instead of failing when a deferred read transaction tries to upgrade.
+"""
+from django.db.backends.sqlite3 import base
+
+
+class DatabaseWrapper(base.DatabaseWrapper):
+    begin_immediate = False
+
+    def get_connection_params(self):
+        kwargs = super().get_connection_params()
+        kwargs.pop('pragmas', None)
+        return kwargs
+
+    def get_new_connection(self, conn_params):
+        conn = super().get_new_connection(conn_params)
+        for name, value in self.pragmas().items():
+            conn.execute(f'PRAGMA {name} = {value}')
+        return conn
+
+    def pragmas(self):
+        pragmas = dict(self.settings_dict['OPTIONS'].get('pragmas', {}))
+        test = self.settings_dict.get('TEST', {})
+        if test.get('NAME') and str(self.settings_dict['NAME']) == str(test['NAME']):
+            pragmas.update(test.get('PRAGMAS', {}))
+        return pragmas
+
+    def _start_transaction_under_autocommit(self):
+        self.cursor().execute('BEGIN IMMEDIATE' if self.begin_immediate else 'BEGIN')
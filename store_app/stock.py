@@ -0,0 +1,121 @@
+"""
+Stock reservation for orders.
+
+Product.stock counts the units still available, or is NULL for products
+whose stock isn't tracked. An order takes its quantities off every product
+in one conditional UPDATE, run inside the order's write transaction:
+
+    UPDATE store_app_product SET stock = stock - CASE id WHEN ... END
+    WHERE id IN (...) AND (stock IS NULL OR stock >= CASE id WHEN ... END)
+
+If fewer rows match than the order has products, one of them is short and
+OutOfStock rolls the whole order back. Nothing is read first, so an order
+holds the write lock for one statement longer than it did without stock,
+and concurrent orders can't both take the last unit.
+
+Order lines record whether their product's stock was taken, so only what
+was reserved is ever put back.
+
+Orders placed for a payment intent keep their reservation while they wait
+for Stripe. Those still unpaid after STOCK_RESERVATION_TTL seconds, or whose
+intent is canceled, are expired and their stock put back by
+release_expired_reservations, which the release_expired_reservations command
+runs (every few minutes with --every, as the Dockerfile does).
+"""
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Case, F, IntegerField, Q, Sum, Value, When
+from django.utils import timezone
+
+from .db import write_transaction
+from .models import Order, OrderItem, Product
+
+
+class OutOfStock(Exception):
+    def __init__(self, product_ids):
+        self.product_ids = product_ids
+        super().__init__(f'Not enough stock for product with ID {product_ids[0]}')
+
+
+def line_quantities(lines):
+    """{product id: total quantity} for (product, quantity) order lines."""
+    quantities = {}
+    for product, quantity in lines:
+        quantity = int(quantity)
+        if quantity < 0:
+            raise ValueError('Quantities cannot be negative')
+        quantities[product.pk] = quantities.get(product.pk, 0) + quantity
+    return quantities
+
+
+def order_quantities(order_ids):
+    """{product id: total quantity} of the reserved lines of the orders."""
+    return dict(
+        OrderItem.objects.filter(order_id__in=order_ids, reserved=True).values('product_id')
+        .annotate(quantity=Sum('quantity')).values_list('product_id', 'quantity')
+    )
+
+
+def _per_product(quantities):
+    return Case(*[When(pk=pk, then=Value(quantity)) for pk, quantity in quantities.items()],
+                output_field=IntegerField())
+
+
+def reserve_stock(quantities):
+    """
+    Take {product id: quantity} off stock, or raise OutOfStock naming the
+    products that are short and take nothing. Call it inside the order's
+    transaction so a failure undoes the order too. Returns the ids of the
+    products whose stock is tracked, which are the ones actually reserved.
+    """
+    if not quantities:
+        return set()
+    wanted = _per_product(quantities)
+    with transaction.atomic():
+        reserved = Product.objects.filter(pk__in=quantities).filter(Q(stock=None) | Q(stock__gte=wanted)).update(
+            stock=F('stock') - wanted,
+        )
+        if reserved == len(quantities):
+            # Still under the write lock, so no stock can have been switched
+            # on or off since the UPDATE.
+            return set(Product.objects.filter(pk__in=quantities, stock__isnull=False).values_list('pk', flat=True))
+        # Put back the products that did have enough.
+        transaction.set_rollback(True)
+    available = dict(Product.objects.filter(pk__in=quantities).values_list('pk', 'stock'))
+    raise OutOfStock([
+        pk for pk, quantity in quantities.items()
+        if pk not in available or (available[pk] is not None and available[pk] < quantity)
+    ])
+
+
+def release_stock(quantities):
+    """Put {product id: quantity} back, for reserved lines only (see order_quantities)."""
+    if quantities:
+        Product.objects.filter(pk__in=quantities, stock__isnull=False).update(stock=F('stock') + _per_product(quantities))
+
+
+def expire_orders(orders):
+    """
+    Mark the pending orders among orders expired and put their stock back.
+    Returns how many were expired.
+    """
+    order_ids = list(orders.filter(status=Order.PENDING).values_list('pk', flat=True))
+    if order_ids:
+        release_stock(order_quantities(order_ids))
+        Order.objects.filter(pk__in=order_ids).update(status=Order.EXPIRED)
+    return len(order_ids)
+
+
+@write_transaction
+def release_expired_reservations(now=None):
+    """Expire orders left unpaid for STOCK_RESERVATION_TTL seconds."""
+    cutoff = (now or timezone.now()) - timedelta(seconds=settings.STOCK_RESERVATION_TTL)
+    return expire_orders(Order.objects.filter(payment_intent_id__isnull=False, created_at__lt=cutoff))
+
+
+@write_transaction
+def cancel_payment_order(payment_intent_id):
+    """Expire the order for a canceled payment intent, if it is still pending."""
+    return expire_orders(Order.objects.filter(payment_intent_id=payment_intent_id))
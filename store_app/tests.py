@@ -1,3 +1,1793 @@
-from django.test import TestCase
+import asyncio
+import io
+import itertools
+import json
+import os
+import re
+import shutil
+import tempfile
+import threading
+import time
+from datetime import date, datetime, timedelta, timezone as dt_timezone
+from decimal import Decimal
+from importlib import import_module
+from unittest import mock
 
-# Create your tests here.
+from asgiref.sync import sync_to_async
+
+from django.apps import apps as django_apps
+from django.contrib.auth.models import User
+from django.contrib.sessions.backends.db import SessionStore as DatabaseSessionStore
+from django.contrib.sessions.models import Session
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.db import connection, connections
+from django.http import JsonResponse
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from django.utils.translation import gettext_lazy
+from PIL import Image
+from rest_framework.exceptions import ParseError
+from rest_framework.renderers import JSONRenderer
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import AccessToken
+
+from .models import (
+    Cart, CartProduct, Category, IdempotencyRecord, IssuedPaymentIntent, Product, ProductImage, ProductRating, Profile, Order, OrderItem,
+    Review,
+)
+from .pagination import ProductCursorPagination
+from .serializers import CategorySerializer, OrderSerializer, ProductSerializer
+from .authentication import cached_user, user_cache, user_cache_key
+from .bench import compare
+from .cache import catalog_cache, catalog_version
+from .derivatives import DERIVATIVE_WIDTHS
+from .images import wait_for_derivatives
+from .fastjson import FastJSONParser, FastJSONRenderer, FastJsonResponse
+from .filters import PRODUCT_SORTS, filter_products
+from .fast_serializers import order_values, product_values, serialize_categories, serialize_orders, serialize_products
+from .orders import checkout_cart, place_order
+from .ratings import rebuild_ratings
+from .stock import release_expired_reservations
+from .fake_stripe import FakeStripe
+
+
+def make_image(name='upload.png', size=(64, 48)):
+    buffer = io.BytesIO()
+    Image.new('RGB', size, 'crimson').save(buffer, format='PNG')
+    return SimpleUploadedFile(name, buffer.getvalue(), content_type='image/png')
+
+
+class TempMediaMixin:
+    def setUp(self):
+        super().setUp()
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root, ignore_errors=True)
+        media = override_settings(MEDIA_ROOT=media_root)
+        media.enable()
+        self.addCleanup(media.disable)
+
+
+def issue_intent(payment_intent_id, amount=1000):
+    # As create_payment_intent records the intents it creates.
+    IssuedPaymentIntent.objects.create(payment_intent_id=payment_intent_id, amount=amount)
+    return payment_intent_id
+
+
+def make_products(category, count, images_per_product=2):
+    products = Product.objects.bulk_create([
+        Product(
+            name=f'Product {i}',
+            description=f'Description {i}',
+            price=Decimal('10.00') + i,
+            category=category,
+            image=f'product_images/product-{i}.jpg',
+        )
+        for i in range(count)
+    ])
+    ProductImage.objects.bulk_create([
+        ProductImage(product=product, image=f'product_images/extra-{product.pk}-{n}.jpg')
+        for product in products
+        for n in range(images_per_product)
+    ])
+    return products
+
+
+class CatalogQueryTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.category = Category.objects.create(name='Dhaka')
+
+    def assertListQueriesConstant(self, url, queries):
+        for count in (1, 25):
+            catalog_cache().clear()
+            Product.objects.all().delete()
+            make_products(self.category, count)
+            with self.assertNumQueries(queries):
+                response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+
+    def test_get_products_query_count_is_constant(self):
+        # products + prefetched images
+        self.assertListQueriesConstant(reverse('get_products'), 2)
+
+    def test_get_product_detail_query_count(self):
+        catalog_cache().clear()
+        product = make_products(self.category, 1, images_per_product=5)[0]
+        with self.assertNumQueries(2):
+            response = self.client.get(reverse('get_product_detail', args=[product.pk]))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.data['images']), 5)
+
+    def test_get_orders_query_count_is_constant(self):
+        user = User.objects.create_user(username='ram', password='secret')
+        self.client.force_authenticate(user)
+        for count in (1, 10):
+            Order.objects.all().delete()
+            products = make_products(self.category, count)
+            for product in products:
+                order = Order.objects.create(user=user, total_price=product.price)
+                OrderItem.objects.create(order=order, product=product, quantity=1, price=product.price)
+            # orders joined to the user + items, which carry product snapshots
+            with self.assertNumQueries(2):
+                response = self.client.get(reverse('get_orders'))
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(len(response.data['results']), count)
+
+
+class ProductPaginationTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        catalog_cache().clear()
+        self.category = Category.objects.create(name='Pokhara')
+        self.products = make_products(self.category, 30, images_per_product=0)
+
+    def test_cursor_pages_cover_catalog_newest_first(self):
+        seen = []
+        url = reverse('get_products')
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            self.assertLessEqual(len(response.data['results']), ProductCursorPagination.page_size)
+            seen.extend(item['id'] for item in response.data['results'])
+            url = response.data['next']
+        expected = list(Product.objects.order_by('-created_at', '-id').values_list('id', flat=True))
+        self.assertEqual(seen, expected)
+
+    def test_next_page_costs_same_queries_as_first(self):
+        first = self.client.get(reverse('get_products'), {'page_size': 5})
+        with self.assertNumQueries(2):
+            second = self.client.get(first.data['next'])
+        self.assertEqual(len(second.data['results']), 5)
+        self.assertIsNotNone(second.data['previous'])
+
+    def follow(self, url, link):
+        pages = []
+        while url:
+            body = self.client.get(url).json()
+            pages.append([item['id'] for item in body['results']])
+            url = body[link]
+        return pages
+
+    def test_ties_longer_than_offset_cutoff_page_by_id(self):
+        make_products(self.category, ProductCursorPagination.offset_cutoff + 300, images_per_product=0)
+        Product.objects.update(price=Decimal('10.00'))
+        for sort, ids in (('price', 'id'), ('-price', '-id')):
+            expected = list(Product.objects.order_by(ids).values_list('id', flat=True))
+            pages = self.follow(f"{reverse('get_products')}?sort={sort}&page_size=100", 'next')
+            self.assertEqual(len(pages), -(-len(expected) // 100))
+            self.assertEqual([pk for page in pages for pk in page], expected)
+
+    def test_previous_links_walk_back(self):
+        url = f"{reverse('get_products')}?sort=price&page_size=7"
+        forward = self.follow(url, 'next')
+        last = self.client.get(url).json()
+        while last['next']:
+            last = self.client.get(last['next']).json()
+        backward = self.follow(last['previous'], 'previous')
+        self.assertEqual(backward, forward[-2::-1])
+
+    def test_bad_cursor_is_a_404(self):
+        for cursor in ('garbage', 'cD1ub3Q', 'cD14JnA9MQ=='):
+            response = self.client.get(reverse('get_products'), {'cursor': cursor})
+            self.assertEqual(response.status_code, 404, cursor)
+
+    def test_page_seek_uses_created_at_index(self):
+        paginator = ProductCursorPagination()
+        product = self.products[-1]
+        for sort, index in (('newest', 'product_created_at_id_idx'), ('price', 'product_price_idx'),
+                            ('-price', 'product_price_idx')):
+            paginator.ordering = PRODUCT_SORTS[sort]
+            seek = paginator.seek(list(paginator.ordering), [getattr(product, field.lstrip('-'))
+                                                             for field in paginator.ordering])
+            plan = product_values(Product.objects.filter(seek)).order_by(*paginator.ordering)[:25].explain()
+            self.assertIn(index, plan, sort)
+            self.assertNotIn('TEMP B-TREE', plan, sort)
+
+
+class ProductFilterTests(TestCase):
+    FILTERS = [
+        {},
+        {'category': '1'},
+        {'min_price': '12', 'max_price': '30'},
+        {'max_price': '30'},
+        {'name_prefix': 'dha'},
+        {'category': '1', 'min_price': '12', 'max_price': '30'},
+        {'category': '1', 'name_prefix': 'dha'},
+    ]
+
+    def setUp(self):
+        catalog_cache().clear()
+        self.client = APIClient()
+        self.categories = [Category.objects.create(name='Kaski'), Category.objects.create(name='Lamjung')]
+        self.products = Product.objects.bulk_create([
+            Product(name=name, description='', price=Decimal(price), category=self.categories[n % 2],
+                    image=f'product_images/{n}.jpg')
+            for n, (name, price) in enumerate([
+                ('Dhaka topi', '15.00'), ('dhaka shawl', '40.00'), ('Singing bowl', '25.00'),
+                ('Pashmina', '15.00'), ('Dhido mix', '5.00'), ('Thangka', '120.00'),
+            ])
+        ])
+
+    def names(self, params, page_size=24):
+        response = self.client.get(reverse('get_products'), {**params, 'page_size': page_size})
+        self.assertEqual(response.status_code, 200)
+        names, body = [], response.json()
+        while True:
+            names += [product['name'] for product in body['results']]
+            if not body['next']:
+                return names
+            body = self.client.get(body['next']).json()
+
+    def test_filters(self):
+        category = str(self.categories[0].pk)
+        self.assertEqual(sorted(self.names({'category': category})), ['Dhaka topi', 'Dhido mix', 'Singing bowl'])
+        self.assertEqual(sorted(self.names({'min_price': '15', 'max_price': '25'})),
+                         ['Dhaka topi', 'Pashmina', 'Singing bowl'])
+        self.assertEqual(sorted(self.names({'name_prefix': 'DHA'})), ['Dhaka topi', 'dhaka shawl'])
+        self.assertEqual(self.names({'category': category, 'name_prefix': 'dh', 'max_price': '10'}), ['Dhido mix'])
+        self.assertEqual(self.names({'name_prefix': '%'}), [])
+
+    def test_sorts_page_through_ties(self):
+        self.assertEqual(self.names({'sort': 'price'}, page_size=2),
+                         ['Dhido mix', 'Dhaka topi', 'Pashmina', 'Singing bowl', 'dhaka shawl', 'Thangka'])
+        self.assertEqual(self.names({'sort': '-price'}, page_size=2),
+                         ['Thangka', 'dhaka shawl', 'Singing bowl', 'Pashmina', 'Dhaka topi', 'Dhido mix'])
+        self.assertEqual(self.names({}, page_size=4), self.names({'sort': 'newest'}, page_size=4))
+
+    def test_invalid_filters(self):
+        for params in ({'sort': 'name'}, {'category': 'kaski'}, {'min_price': 'cheap'}, {'max_price': '-1'},
+                       {'min_price': 'NaN'}):
+            response = self.client.get(reverse('get_products'), params)
+            self.assertEqual(response.status_code, 400, params)
+            self.assertIn('error', response.json())
+
+    def test_every_filter_and_sort_uses_an_index(self):
+        for params, sort in itertools.product(self.FILTERS, PRODUCT_SORTS):
+            queryset, ordering = filter_products(Product.objects.all(), {**params, 'sort': sort})
+            plan = product_values(queryset).order_by(*ordering)[:25].explain()
+            product_steps = [line for line in plan.splitlines() if re.search(r'\bstore_app_product\b', line)]
+            self.assertEqual(len(product_steps), 1, plan)
+            # Either a seek on a filter's index, or a walk of the sort's index
+            # that stops after a page of matches; never a table scan.
+            self.assertRegex(product_steps[0], r'(SEARCH|SCAN) store_app_product USING INDEX product_', (params, sort))
+            if 'SCAN' in product_steps[0]:
+                self.assertNotIn('TEMP B-TREE', plan, (params, sort))
+
+
+class CatalogCacheTests(TestCase):
+    def setUp(self):
+        catalog_cache().clear()
+        self.client = APIClient()
+        self.category = Category.objects.create(name='Lalitpur')
+        self.product = make_products(self.category, 3)[0]
+
+    def test_repeat_reads_skip_the_database(self):
+        for url in (reverse('get_products'), reverse('get_product_detail', args=[self.product.pk]),
+                    reverse('category-list')):
+            first = self.client.get(url)
+            with self.assertNumQueries(0):
+                second = self.client.get(url)
+            self.assertEqual(first.json(), second.json())
+
+    def test_missing_product_is_not_cached(self):
+        url = reverse('get_product_detail', args=[9999])
+        self.assertEqual(self.client.get(url).status_code, 404)
+        with self.assertNumQueries(1):
+            self.assertEqual(self.client.get(url).status_code, 404)
+
+    def test_writes_bump_the_catalog_version(self):
+        for write in (
+            lambda: Product.objects.filter(pk=self.product.pk).get().save(),
+            lambda: ProductImage.objects.create(product=self.product, image='product_images/new.jpg'),
+            lambda: self.product.images.first().delete(),
+            lambda: Category.objects.create(name='Bhaktapur'),
+        ):
+            version = catalog_version()
+            with self.captureOnCommitCallbacks(execute=True):
+                write()
+            self.assertNotEqual(catalog_version(), version)
+
+    def test_update_is_visible_after_commit(self):
+        url = reverse('get_product_detail', args=[self.product.pk])
+        self.client.get(url)
+        self.product.name = 'Dhaka Topi'
+        with self.captureOnCommitCallbacks(execute=True):
+            self.product.save()
+        self.assertEqual(self.client.get(url).json()['name'], 'Dhaka Topi')
+
+
+class BenchCompareTests(SimpleTestCase):
+    def test_compare_reports_regressions(self):
+        baseline = {'get_orders': {'p50_ms': 10.0, 'p95_ms': 20.0, 'p99_ms': 30.0, 'queries': 5, 'bytes': 900}}
+        results = {'get_orders': {'p50_ms': 10.5, 'p95_ms': 30.0, 'p99_ms': 15.0, 'queries': 6, 'bytes': 900},
+                   'get_products': {'p50_ms': 1.0, 'p95_ms': 2.0, 'p99_ms': 3.0, 'queries': 0, 'bytes': 100}}
+        self.assertEqual(compare(results, baseline, threshold=10), [
+            ('get_orders', 'p95_ms', 20.0, 30.0, 50.0, True),
+            ('get_orders', 'p99_ms', 30.0, 15.0, -50.0, False),
+            ('get_orders', 'queries', 5, 6, 20.0, True),
+        ])
+
+
+class OrderCreationTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.category = Category.objects.create(name='Kathmandu')
+        self.products = make_products(self.category, 20, images_per_product=0)
+        for count in (1, 2, 20):
+            issue_intent(f'pi_test_{count}')
+
+    def post_order(self, count):
+        return self.client.post(reverse('create_order'), {
+            'total_price': '100.00',
+            'payment_intent_id': f'pi_test_{count}',
+            'products': [{'product_id': p.pk, 'quantity': 2} for p in self.products[:count]],
+        }, format='json')
+
+    def test_create_order_statement_count_is_constant(self):
+        counts = []
+        for count in (1, 20):
+            with CaptureQueriesContext(connection) as queries:
+                response = self.post_order(count)
+            self.assertEqual(response.status_code, 201)
+            counts.append(len(queries))
+        self.assertEqual(counts[0], counts[1])
+        order = Order.objects.latest('id')
+        self.assertEqual(order.order_items.count(), 20)
+        self.assertEqual(
+            sorted(order.order_items.values_list('price', flat=True)),
+            sorted(p.price for p in self.products),
+        )
+
+    def test_repeated_intent_returns_the_existing_order(self):
+        first = self.post_order(2)
+        self.assertEqual(first.status_code, 201)
+        order = Order.objects.get()
+        self.assertEqual(order.total_price, Decimal('100.00'))
+
+        retry = self.post_order(2)
+        self.assertEqual(retry.status_code, 200)
+        self.assertEqual(retry.json()['id'], order.pk)
+        self.assertEqual(len(retry.json()['order_items']), 2)
+        self.assertEqual(Order.objects.count(), 1)
+
+    def test_unknown_product_writes_nothing(self):
+        response = self.client.post(reverse('create_order'), {
+            'total_price': '10.00',
+            'products': [{'product_id': self.products[0].pk, 'quantity': 1}, {'product_id': 9999, 'quantity': 1}],
+        }, format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('9999', response.json()['error'])
+        self.assertFalse(Order.objects.exists())
+
+    def test_guest_order_returns_serialized_items(self):
+        response = self.client.post(reverse('create_guest_order'), {
+            'email': 'guest@example.com',
+            'total_price': '21.00',
+            'items': [{'product': self.products[0].pk, 'quantity': 1}, {'product': self.products[1].pk, 'quantity': 1}],
+        }, format='json')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual([item['product'] for item in response.data['order_items']],
+                         [self.products[0].pk, self.products[1].pk])
+
+    def test_guest_order_unknown_product(self):
+        response = self.client.post(reverse('create_guest_order'), {
+            'email': 'guest@example.com',
+            'total_price': '1.00',
+            'items': [{'product': 9999, 'quantity': 1}],
+        }, format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.data['error'], 'One or more products not found')
+        self.assertFalse(Order.objects.exists())
+
+
+class OrderHistoryTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.user = User.objects.create_user(username='hari', password='secret')
+        self.client.force_authenticate(self.user)
+        self.product = make_products(Category.objects.create(name='Janakpur'), 1, images_per_product=0)[0]
+
+    def test_items_keep_product_snapshot(self):
+        Product.objects.filter(pk=self.product.pk).update(image_variants={'sizes': {
+            'thumbnail': {'name': 'product_images/derivatives/product-0-thumbnail.webp', 'width': 160, 'height': 120},
+        }})
+        self.product.refresh_from_db()
+        place_order([(self.product, 2)], Decimal('20.00'), user=self.user)
+        Product.objects.filter(pk=self.product.pk).update(name='Renamed', price=Decimal('99.00'), image_variants={})
+
+        item = self.client.get(reverse('get_orders')).json()['results'][0]['order_items'][0]
+        self.assertEqual(item['product'], self.product.pk)
+        self.assertEqual(item['product_name'], 'Product 0')
+        self.assertEqual(item['product_image'], '/media/product_images/derivatives/product-0-thumbnail.webp')
+        self.assertEqual(item['price'], '10.00')
+
+    def test_items_without_thumbnail_use_product_image(self):
+        order = place_order([(self.product, 1)], Decimal('10.00'), user=self.user)
+        self.assertEqual(order.order_items.get().product_image, 'product_images/product-0.jpg')
+
+    def test_history_is_paginated_newest_first(self):
+        orders = [place_order([(self.product, 1)], Decimal('10.00'), user=self.user) for _ in range(25)]
+        place_order([(self.product, 1)], Decimal('10.00'), user=User.objects.create(username='sita'))
+
+        first = self.client.get(reverse('get_orders')).json()
+        second = self.client.get(first['next']).json()
+        self.assertEqual([order['id'] for order in first['results'] + second['results']],
+                         [order.pk for order in reversed(orders)])
+        self.assertEqual(len(first['results']), 20)
+        self.assertIsNone(second['next'])
+
+
+class CheckoutTests(TestCase):
+    def setUp(self):
+        self.category = Category.objects.create(name='Janakpur')
+        self.products = make_products(self.category, 30, images_per_product=0)
+
+    def make_cart(self, username, size):
+        cart = Cart.objects.create(user=User.objects.create(username=username))
+        CartProduct.objects.bulk_create([
+            CartProduct(cart=cart, product=product, quantity=3) for product in self.products[:size]
+        ])
+        return cart
+
+    def test_checkout_statement_count_is_constant(self):
+        counts = []
+        for size in (1, 30):
+            cart = self.make_cart(f'shopper-{size}', size)
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.post(reverse('checkout'), {'cart_id': cart.pk})
+            self.assertEqual(response.status_code, 200)
+            counts.append(len(queries))
+
+            order = Order.objects.get(pk=response.json()['order_id'])
+            self.assertEqual(order.order_items.count(), size)
+            self.assertEqual(order.total_price, sum(p.price * 3 for p in self.products[:size]))
+            self.assertFalse(Cart.objects.filter(pk=cart.pk).exists())
+            self.assertFalse(CartProduct.objects.filter(cart_id=cart.pk).exists())
+        self.assertEqual(counts[0], counts[1])
+
+    def test_empty_and_missing_carts(self):
+        cart = self.make_cart('empty', 0)
+        self.assertEqual(self.client.post(reverse('checkout'), {'cart_id': cart.pk}).status_code, 400)
+        self.assertEqual(self.client.post(reverse('checkout'), {'cart_id': 9999}).status_code, 404)
+        self.assertFalse(Order.objects.exists())
+
+
+class CartReadTests(TestCase):
+    def setUp(self):
+        self.category = Category.objects.create(name='Chitwan')
+        self.products = make_products(self.category, 12, images_per_product=0)
+
+    def test_user_cart_is_read_in_one_query(self):
+        user = User.objects.create(username='sita')
+        cart = Cart.objects.create(user=user)
+        client = APIClient()
+        client.force_authenticate(user)
+        for size in (1, 12):
+            CartProduct.objects.filter(cart=cart).delete()
+            CartProduct.objects.bulk_create([
+                CartProduct(cart=cart, product=product, quantity=2) for product in self.products[:size]
+            ])
+            with self.assertNumQueries(1):
+                response = client.get(reverse('get_cart'))
+            self.assertEqual(len(response.json()['cart']), size)
+        self.assertEqual(response.json()['cart'][0], {
+            'id': CartProduct.objects.filter(cart=cart).order_by('id').first().id,
+            'product': {'id': self.products[0].id, 'name': 'Product 0', 'price': '10.00'},
+            'quantity': 2,
+        })
+
+    def test_user_without_cart(self):
+        client = APIClient()
+        client.force_authenticate(User.objects.create(username='hari'))
+        self.assertEqual(client.get(reverse('get_cart')).json(), {'cart': []})
+
+    def test_session_cart_query_count_is_constant(self):
+        for product in self.products:
+            response = self.client.post(reverse('add_to_cart'), {'product_id': product.pk, 'quantity': 1})
+            self.assertEqual(response.status_code, 200)
+        self.client.post(reverse('add_to_cart'), {'product_id': self.products[0].pk, 'quantity': 2})
+
+        # the session row, then one in_bulk for all products
+        with self.assertNumQueries(2):
+            response = self.client.get(reverse('get_cart'))
+        cart = response.json()['cart']
+        self.assertEqual(len(cart), 12)
+        self.assertEqual(cart[0], {
+            'id': str(self.products[0].pk),
+            'product': {'id': self.products[0].pk, 'name': 'Product 0', 'price': '10.00'},
+            'quantity': 3,
+        })
+
+
+class SessionCartTests(TestCase):
+    def setUp(self):
+        self.category = Category.objects.create(name='Dolakha')
+        self.products = make_products(self.category, 3, images_per_product=0)
+
+    def legacy_session(self):
+        session = DatabaseSessionStore()
+        session['cart'] = {
+            str(product.pk): {'id': product.pk, 'name': product.name, 'price': str(product.price), 'quantity': 2}
+            for product in self.products[:2]
+        }
+        session.create()
+        return session
+
+    def test_logout_revokes_the_session_server_side(self):
+        User.objects.create_user(username='dawa', password='secret')
+        self.client.login(username='dawa', password='secret')
+        stolen = self.client.cookies[settings.SESSION_COOKIE_NAME].value
+        self.client.logout()
+        thief = APIClient()
+        thief.cookies[settings.SESSION_COOKIE_NAME] = stolen
+        self.assertEqual(thief.get(reverse('get_profile')).status_code, 403)
+
+    @override_settings(SESSION_ENGINE='store_app.sessions.cache')
+    def test_anonymous_add_to_cart_stores_quantities_without_touching_the_database(self):
+        self.client.post(reverse('add_to_cart'), {'product_id': self.products[0].pk, 'quantity': 1})
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post(reverse('add_to_cart'), {'product_id': self.products[0].pk, 'quantity': 2})
+        self.assertEqual(response.json()['product'], {
+            'id': self.products[0].pk, 'name': 'Product 0', 'price': '10.00', 'quantity': 3,
+        })
+        # Only the product lookup; nothing reads or writes django_session.
+        self.assertEqual(len(queries), 1)
+        self.assertFalse(Session.objects.exists())
+        self.assertEqual(self.client.session['cart'], {str(self.products[0].pk): 3})
+
+    @override_settings(SESSION_ENGINE='store_app.sessions.cookie')
+    def test_cookie_engine(self):
+        self.client.post(reverse('add_to_cart'), {'product_id': self.products[1].pk, 'quantity': 4})
+        self.assertFalse(Session.objects.exists())
+        self.assertEqual(self.client.get(reverse('get_cart')).json()['cart'][0]['quantity'], 4)
+
+    def test_legacy_database_sessions_are_moved_over(self):
+        for engine in ('store_app.sessions.cookie', 'store_app.sessions.cache'):
+            with self.subTest(engine=engine), override_settings(SESSION_ENGINE=engine):
+                legacy = self.legacy_session()
+                client = self.client_class()
+                client.cookies[settings.SESSION_COOKIE_NAME] = legacy.session_key
+                response = client.post(reverse('add_to_cart'), {'product_id': self.products[0].pk, 'quantity': 1})
+                self.assertEqual(response.json()['product']['quantity'], 3)
+                # The session now lives in the new store under a new key.
+                self.assertNotEqual(client.cookies[settings.SESSION_COOKIE_NAME].value, legacy.session_key)
+                self.assertEqual(client.session['cart'], {str(self.products[0].pk): 3, str(self.products[1].pk): 2})
+                with CaptureQueriesContext(connection) as queries:
+                    client.get(reverse('get_cart'))
+                self.assertFalse(any('django_session' in query['sql'] for query in queries))
+
+    def test_compact_session_carts_command(self):
+        legacy = self.legacy_session()
+        expired = self.legacy_session()
+        Session.objects.filter(pk=expired.session_key).update(expire_date=timezone.now() - timedelta(days=1))
+        out = io.StringIO()
+        call_command('compact_session_carts', stdout=out)
+        self.assertIn('Compacted the carts of 1 session(s)', out.getvalue())
+        self.assertEqual(list(Session.objects.values_list('pk', flat=True)), [legacy.session_key])
+        self.assertEqual(DatabaseSessionStore(legacy.session_key).load()['cart'], {
+            str(self.products[0].pk): 2, str(self.products[1].pk): 2,
+        })
+
+
+class CartTotalTests(TempMediaMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.category = Category.objects.create(name='Gorkha')
+        self.products = make_products(self.category, 3, images_per_product=0)
+        self.user = User.objects.create_user(username='gita', password='secret')
+        self.client = APIClient()
+        self.client.force_login(self.user)
+
+    def add(self, product, quantity):
+        response = self.client.post(reverse('add_to_cart'), {'product_id': product.pk, 'quantity': quantity})
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def cart_total(self):
+        return Cart.objects.get(user=self.user).total_price
+
+    def test_add_and_delete_apply_deltas(self):
+        first, second = self.products[0], self.products[1]
+        self.add(first, 2)
+        line = self.add(second, 1)
+        self.add(first, 1)
+        self.assertEqual(self.cart_total(), first.price * 3 + second.price)
+
+        response = self.client.delete(reverse('delete_cart_item', args=[line['cart_product_id']]))
+        self.assertEqual(response.status_code, 204)
+        self.assertEqual(self.cart_total(), first.price * 3)
+        call_command('rebuild_cart_totals', '--check', stdout=io.StringIO())
+
+    def test_price_update_reprices_carts(self):
+        product = self.products[0]
+        self.add(product, 4)
+        other = Cart.objects.create(user=User.objects.create(username='other'))
+        CartProduct.objects.create(cart=other, product=product, quantity=1)
+        call_command('rebuild_cart_totals', stdout=io.StringIO())
+
+        response = self.client.put(reverse('update_product', args=[product.pk]), {
+            'name': product.name,
+            'description': product.description,
+            'price': '12.50',
+            'category': self.category.pk,
+            'image': make_image(),
+        }, format='multipart')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.cart_total(), Decimal('50.00'))
+        self.assertEqual(Cart.objects.get(pk=other.pk).total_price, Decimal('12.50'))
+        call_command('rebuild_cart_totals', '--check', stdout=io.StringIO())
+
+    def test_admin_edits_and_deletes_keep_totals(self):
+        kept, edited, deleted = self.products
+        self.add(kept, 1)
+        self.add(edited, 2)
+        self.add(deleted, 3)
+
+        edited.price = Decimal('7.25')
+        edited.save()
+        self.assertEqual(self.cart_total(), kept.price + Decimal('14.50') + deleted.price * 3)
+        edited.save()
+        self.assertEqual(self.cart_total(), kept.price + Decimal('14.50') + deleted.price * 3)
+
+        Product.objects.filter(pk=deleted.pk).delete()
+        self.assertEqual(self.cart_total(), kept.price + Decimal('14.50'))
+        call_command('rebuild_cart_totals', '--check', stdout=io.StringIO())
+
+    def test_migration_fills_totals_of_existing_carts(self):
+        self.add(self.products[0], 2)
+        Cart.objects.update(total_price=0)
+        import_module('store_app.migrations.0024_rebuild_cart_totals').fill_cart_totals(django_apps, None)
+        self.assertEqual(self.cart_total(), self.products[0].price * 2)
+
+    def test_rebuild_command_repairs_drift(self):
+        self.add(self.products[2], 2)
+        Cart.objects.update(total_price=Decimal('1.00'))
+        with self.assertRaises(CommandError):
+            call_command('rebuild_cart_totals', '--check', stdout=io.StringIO())
+        call_command('rebuild_cart_totals', stdout=io.StringIO())
+        self.assertEqual(self.cart_total(), self.products[2].price * 2)
+        call_command('rebuild_cart_totals', '--check', stdout=io.StringIO())
+
+
+class CartBatchTests(TestCase):
+    def setUp(self):
+        self.category = Category.objects.create(name='Solukhumbu')
+        self.products = make_products(self.category, 20, images_per_product=0)
+        self.user = User.objects.create_user(username='ram', password='secret')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def batch(self, *operations, client=None):
+        return (client or self.client).post(reverse('update_cart'), {'operations': list(operations)}, format='json')
+
+    def quantities(self):
+        return dict(CartProduct.objects.filter(cart__user=self.user).values_list('product_id', 'quantity'))
+
+    def test_operations_apply_in_order_and_keep_the_total(self):
+        first, second, third = self.products[:3]
+        self.batch({'op': 'add', 'product_id': first.pk, 'quantity': 2}, {'op': 'add', 'product_id': second.pk})
+        response = self.batch(
+            {'op': 'add', 'product_id': first.pk, 'quantity': 3},
+            {'op': 'remove', 'product_id': second.pk},
+            {'op': 'set', 'product_id': third.pk, 'quantity': 4},
+            {'op': 'add', 'product_id': third.pk, 'quantity': 1},
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.quantities(), {first.pk: 5, third.pk: 5})
+        self.assertEqual([item['quantity'] for item in response.json()['cart']], [5, 5])
+        self.assertEqual(Cart.objects.get(user=self.user).total_price, first.price * 5 + third.price * 5)
+
+        self.batch({'op': 'set', 'product_id': first.pk, 'quantity': 0})
+        self.assertEqual(self.quantities(), {third.pk: 5})
+        call_command('rebuild_cart_totals', '--check', stdout=io.StringIO())
+
+    def test_statement_count_does_not_grow_with_the_batch(self):
+        Cart.objects.create(user=self.user)
+        counts = []
+        for products in (self.products[:2], self.products[2:20]):
+            CartProduct.objects.create(cart=Cart.objects.get(user=self.user), product=products[0], quantity=1)
+            with CaptureQueriesContext(connection) as queries:
+                response = self.batch(
+                    *[{'op': 'add', 'product_id': product.pk, 'quantity': 2} for product in products[:-1]],
+                    {'op': 'remove', 'product_id': products[-1].pk},
+                )
+            self.assertEqual(response.status_code, 200)
+            counts.append(len(queries))
+        self.assertEqual(counts[0], counts[1])
+        self.assertTrue(any('ON CONFLICT' in query['sql'] for query in queries))
+
+    def test_unknown_products_change_nothing(self):
+        self.batch({'op': 'add', 'product_id': self.products[0].pk})
+        response = self.batch({'op': 'add', 'product_id': self.products[1].pk}, {'op': 'add', 'product_id': 9999})
+        self.assertEqual(response.status_code, 404)
+        self.assertEqual(response.json()['product_ids'], [9999])
+        self.assertEqual(self.quantities(), {self.products[0].pk: 1})
+
+    def test_invalid_operations(self):
+        for operations in ([], [{'op': 'double', 'product_id': 1}], [{'op': 'add', 'product_id': 1, 'quantity': 0}]):
+            with self.subTest(operations=operations):
+                self.assertEqual(self.batch(*operations).status_code, 400)
+        self.assertFalse(Cart.objects.exists())
+
+    def test_anonymous_batch_edits_the_session_cart(self):
+        client = APIClient()
+        first, second = self.products[:2]
+        client.post(reverse('add_to_cart'), {'product_id': first.pk, 'quantity': 1})
+        response = self.batch(
+            {'op': 'add', 'product_id': first.pk, 'quantity': 2},
+            {'op': 'set', 'product_id': second.pk, 'quantity': 1},
+            {'op': 'remove', 'product_id': second.pk},
+            client=client,
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(client.session['cart'], {str(first.pk): 3})
+        self.assertFalse(Cart.objects.exists())
+
+
+class LoginCartMergeTests(TestCase):
+    def setUp(self):
+        self.category = Category.objects.create(name='Mustang')
+        self.products = make_products(self.category, 20, images_per_product=0)
+        self.user = User.objects.create_user(username='maya', password='secret')
+
+    def anonymous_cart(self, products, quantity=2):
+        client = APIClient()
+        for product in products:
+            client.post(reverse('add_to_cart'), {'product_id': product.pk, 'quantity': quantity})
+        return client
+
+    def quantities(self):
+        return dict(CartProduct.objects.filter(cart__user=self.user).values_list('product_id', 'quantity'))
+
+    def test_token_login_merges_the_session_cart(self):
+        first, second = self.products[:2]
+        cart = Cart.objects.create(user=self.user, total_price=first.price)
+        CartProduct.objects.create(cart=cart, product=first, quantity=1)
+        client = self.anonymous_cart([first, second])
+
+        response = client.post(reverse('token_obtain_pair'), {'username': 'maya', 'password': 'secret'})
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('access', response.json())
+        self.assertEqual(self.quantities(), {first.pk: 3, second.pk: 2})
+        self.assertEqual(Cart.objects.get(pk=cart.pk).total_price, first.price * 3 + second.price * 2)
+        self.assertNotIn('cart', client.session)
+        call_command('rebuild_cart_totals', '--check', stdout=io.StringIO())
+
+    def test_merge_cost_does_not_grow_with_the_cart(self):
+        Cart.objects.create(user=self.user)
+        counts = []
+        for products in (self.products[:1], self.products[1:20]):
+            client = self.anonymous_cart(products)
+            with CaptureQueriesContext(connection) as queries:
+                client.post(reverse('token_obtain_pair'), {'username': 'maya', 'password': 'secret'})
+            counts.append(len(queries))
+        self.assertEqual(counts[0], counts[1])
+        self.assertEqual(len(self.quantities()), 20)
+
+    def test_failed_login_keeps_the_session_cart(self):
+        client = self.anonymous_cart(self.products[:1])
+        response = client.post(reverse('token_obtain_pair'), {'username': 'maya', 'password': 'wrong'})
+        self.assertEqual(response.status_code, 401)
+        self.assertEqual(client.session['cart'], {str(self.products[0].pk): 2})
+        self.assertFalse(Cart.objects.exists())
+
+    def test_session_login_merges_and_skips_deleted_products(self):
+        client = self.anonymous_cart(self.products[:2])
+        Product.objects.filter(pk=self.products[1].pk).delete()
+        client.login(username='maya', password='secret')
+        self.assertEqual(self.quantities(), {self.products[0].pk: 2})
+        self.assertNotIn('cart', client.session)
+
+    def test_login_without_a_session_cart_writes_nothing(self):
+        with self.assertNumQueries(2):
+            # the user and the token blacklist's outstanding token
+            response = APIClient().post(reverse('token_obtain_pair'), {'username': 'maya', 'password': 'secret'})
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(Cart.objects.exists())
+
+
+class JWTReadPathTests(TestCase):
+    def setUp(self):
+        user_cache().clear()
+        self.user = User.objects.create_user(username='bina', password='secret')
+        self.profile = Profile.objects.create(user=self.user, first_name='Bina', last_name='Rai', email='bina@example.com')
+        self.product = make_products(Category.objects.create(name='Ilam'), 1, images_per_product=0)[0]
+        place_order([(self.product, 1)], Decimal('10.00'), user=self.user)
+        CartProduct.objects.create(cart=Cart.objects.create(user=self.user), product=self.product, quantity=2)
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {AccessToken.for_user(self.user)}')
+
+    def auth_queries(self, url):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        # Order rows join auth_user for the username; a lookup would select from it.
+        return response, [query['sql'] for query in queries if 'FROM "auth_user"' in query['sql']]
+
+    def test_reads_trust_the_token(self):
+        response, queries = self.auth_queries(reverse('get_orders'))
+        self.assertEqual(queries, [])
+        self.assertEqual(len(response.json()['results']), 1)
+        response, queries = self.auth_queries(reverse('get_cart'))
+        self.assertEqual(queries, [])
+        self.assertEqual(response.json()['cart'][0]['quantity'], 2)
+
+    def test_profile_is_read_from_the_user_cache(self):
+        with self.assertNumQueries(1):
+            self.assertEqual(self.client.get(reverse('get_profile')).json()['first_name'], 'Bina')
+        with self.assertNumQueries(0):
+            response = self.client.get(reverse('get_profile'))
+        self.assertEqual(response.json()['user']['username'], 'bina')
+
+    def test_saves_invalidate_the_cached_user(self):
+        self.client.get(reverse('get_profile'))
+        with self.captureOnCommitCallbacks(execute=True):
+            self.profile.first_name = 'Binita'
+            self.profile.save()
+        self.assertEqual(self.client.get(reverse('get_profile')).json()['first_name'], 'Binita')
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user.is_active = False
+            self.user.save()
+        # SessionAuthentication comes first and has no WWW-Authenticate, so 403.
+        self.assertEqual(self.client.get(reverse('get_profile')).status_code, 403)
+
+    def test_unknown_users_are_not_cached(self):
+        self.assertIsNone(cached_user(9999))
+        self.assertIsNone(user_cache().get(user_cache_key(9999)))
+        token = AccessToken.for_user(User(pk=9999, username='ghost'))
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {token}')
+        self.assertEqual(self.client.get(reverse('get_profile')).status_code, 403)
+
+
+@override_settings(IMAGE_DERIVATIVE_WORKERS=0)
+class ImageDerivativeTests(TempMediaMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        catalog_cache().clear()
+        self.client = APIClient()
+        self.category = Category.objects.create(name='Mustang')
+
+    def test_upload_builds_sizes_and_srcset(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(reverse('add_product'), {
+                'name': 'Pashmina',
+                'description': 'Shawl',
+                'price': '45.00',
+                'category': self.category.pk,
+                'image': make_image('shawl.png', size=(2000, 1000)),
+            }, format='multipart')
+        self.assertEqual(response.status_code, 201)
+
+        product = Product.objects.get(pk=response.data['id'])
+        self.assertEqual((product.image_width, product.image_height), (2000, 1000))
+        self.assertEqual(product.image_variants['source'], product.image.name)
+
+        data = self.client.get(reverse('get_product_detail', args=[product.pk])).json()
+        self.assertEqual(set(data['image_sizes']), set(DERIVATIVE_WIDTHS))
+        self.assertEqual(data['image_sizes']['thumbnail']['width'], 160)
+        self.assertEqual(data['image_sizes']['thumbnail']['height'], 80)
+        self.assertTrue(data['image_sizes']['card']['url'].endswith('.webp'))
+        self.assertIn(f"{data['image_sizes']['detail']['url']} 1200w", data['image_srcset'])
+        with Image.open(f"{settings.MEDIA_ROOT}/{product.image_variants['sizes']['card']['name']}") as card:
+            self.assertEqual((card.format, card.size), ('WEBP', (480, 240)))
+
+    def test_small_images_are_not_upscaled(self):
+        product = Product(name='Topi', description='', price=5, category=self.category)
+        product.image = make_image('topi.png', size=(100, 50))
+        with self.captureOnCommitCallbacks(execute=True):
+            product.save()
+        product.refresh_from_db()
+        widths = {size: variant['width'] for size, variant in product.image_variants['sizes'].items()}
+        self.assertEqual(widths, {size: 100 for size in DERIVATIVE_WIDTHS})
+
+    def test_backfill_command(self):
+        product = make_products(self.category, 1, images_per_product=0)[0]
+        Product.objects.filter(pk=product.pk).update(image=default_storage.save('product_images/old.png', make_image()))
+        call_command('build_image_derivatives', '--workers', '1', stdout=io.StringIO(), stderr=io.StringIO())
+        product.refresh_from_db()
+        self.assertEqual(product.image_variants['source'], product.image.name)
+        self.assertEqual(product.image_width, 64)
+
+    def upload(self, product, name):
+        product.image = make_image(name, size=(300, 200))
+        with self.captureOnCommitCallbacks(execute=True):
+            product.save()
+        product.refresh_from_db()
+        return [variant['name'] for variant in product.image_variants['sizes'].values()]
+
+    @override_settings(STORAGES={**settings.STORAGES, 'default': {
+        'BACKEND': 'django.core.files.storage.InMemoryStorage',
+    }})
+    def test_derivatives_are_written_through_default_storage(self):
+        product = Product(name='Khukuri', description='', price=30, category=self.category)
+        names = self.upload(product, 'khukuri.png')
+        self.assertTrue(all(default_storage.exists(name) for name in names))
+        with default_storage.open(names[0]) as thumbnail, Image.open(thumbnail) as image:
+            self.assertEqual(image.format, 'WEBP')
+        self.assertEqual(os.listdir(settings.MEDIA_ROOT), [])
+
+    def test_replacing_or_deleting_an_image_removes_its_derivatives(self):
+        product = Product(name='Thangka', description='', price=90, category=self.category)
+        old = self.upload(product, 'old.png')
+        OrderItem.objects.create(order=Order.objects.create(total_price=90), product=product, quantity=1,
+                                 price=90, product_name='Thangka', product_image=old[0])
+
+        new = self.upload(product, 'new.png')
+        self.assertTrue(all(default_storage.exists(name) for name in new))
+        # The thumbnail a past order shows is kept; the other sizes go.
+        self.assertEqual([default_storage.exists(name) for name in old], [True] + [False] * (len(old) - 1))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            product.delete()
+        self.assertFalse(any(default_storage.exists(name) for name in new))
+
+    def test_renaming_the_image_clears_stale_sizes(self):
+        product = Product(name='Dhaka', description='', price=20, category=self.category)
+        self.upload(product, 'dhaka.png')
+        product.image = default_storage.save('product_images/other.png', make_image())
+        product.save()
+        product.refresh_from_db()
+        self.assertEqual((product.image_variants, product.image_width), ({}, None))
+
+
+@override_settings(IMAGE_DERIVATIVE_WORKERS=1)
+class ImageDerivativePoolTests(TempMediaMixin, TransactionTestCase):
+    # The pool stores results from its own thread and connection, so the
+    # product has to be committed for it to see.
+    def test_upload_builds_sizes_in_the_process_pool(self):
+        product = Product(name='Bowl', description='', price=40, category=Category.objects.create(name='Dang'))
+        product.image = make_image('bowl.png', size=(600, 300))
+        product.save()
+        wait_for_derivatives()
+
+        product.refresh_from_db()
+        self.assertEqual(product.image_variants['source'], product.image.name)
+        self.assertEqual(product.image_variants['sizes']['card']['width'], 480)
+        self.assertTrue(all(default_storage.exists(variant['name'])
+                            for variant in product.image_variants['sizes'].values()))
+
+
+class ProductSearchTests(TestCase):
+    def setUp(self):
+        catalog_cache().clear()
+        self.client = APIClient()
+        category = Category.objects.create(name='Textiles')
+        self.topi = Product.objects.create(name='Dhaka Topi', description='Traditional woven cap',
+                                           price=15, category=category, image='product_images/topi.jpg')
+        self.shawl = Product.objects.create(name='Pashmina Shawl', description='Soft shawl, pairs with a topi',
+                                            price=80, category=category, image='product_images/shawl.jpg')
+        self.bowl = Product.objects.create(name='Singing Bowl', description='Hand hammered brass',
+                                           price=40, category=category, image='product_images/bowl.jpg')
+
+    def search(self, q, **params):
+        response = self.client.get(reverse('search_products'), {'q': q, **params})
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def test_results_are_ranked_and_prefix_matched(self):
+        results = self.search('top')['results']
+        self.assertEqual([item['id'] for item in results], [self.topi.pk, self.shawl.pk])
+
+    def test_index_follows_updates_and_deletes(self):
+        self.bowl.name = 'Prayer Wheel'
+        self.bowl.save()
+        self.assertEqual(self.search('bowl')['count'], 0)
+        self.assertEqual(self.search('prayer')['count'], 1)
+        self.topi.delete()
+        self.assertEqual([item['id'] for item in self.search('topi')['results']], [self.shawl.pk])
+
+    def test_fts_syntax_in_query_is_literal(self):
+        self.assertEqual(self.search('shawl" OR NEAR(*')['count'], 0)
+        self.assertEqual(self.search('***')['count'], 0)
+        response = self.client.get(reverse('search_products'))
+        self.assertEqual(response.status_code, 400)
+
+    def test_pages_have_constant_query_count(self):
+        make_products(Category.objects.first(), 30, images_per_product=1)
+        first = self.search('description', page_size=10)
+        self.assertEqual(first['count'], 30)
+        catalog_cache().clear()
+        # count + ranked ids + products + images
+        with self.assertNumQueries(4):
+            response = self.client.get(first['next'])
+        self.assertEqual(len(response.json()['results']), 10)
+
+    @override_settings(STORAGES={
+        'default': {'BACKEND': 'django.core.files.storage.FileSystemStorage'},
+        'staticfiles': {'BACKEND': 'django.contrib.staticfiles.storage.StaticFilesStorage'},
+    })
+    def test_admin_search_uses_index(self):
+        admin = User.objects.create_superuser(username='admin', password='secret', email='a@example.com')
+        self.client.force_login(admin)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('admin:store_app_product_changelist'), {'q': 'shawl'})
+        self.assertContains(response, 'Pashmina Shawl')
+        self.assertNotContains(response, 'Singing Bowl')
+        self.assertFalse(any('LIKE' in query['sql'] for query in queries))
+
+
+class SQLiteConnectionTests(TransactionTestCase):
+    def test_pragmas_are_applied(self):
+        with connection.cursor() as cursor:
+            cursor.execute('PRAGMA journal_mode')
+            self.assertEqual(cursor.fetchone()[0], 'wal')
+            cursor.execute('PRAGMA busy_timeout')
+            self.assertEqual(cursor.fetchone()[0], settings.SQLITE_PRAGMAS['busy_timeout'])
+            cursor.execute('PRAGMA synchronous')
+            self.assertEqual(cursor.fetchone()[0], 1)  # NORMAL
+
+    def test_test_pragmas_only_apply_to_the_test_database(self):
+        wrapper = connections['default'].__class__({
+            **connection.settings_dict, 'NAME': settings.BASE_DIR / 'db.sqlite3',
+            'OPTIONS': {'pragmas': {'journal_mode': 'delete', 'busy_timeout': 5000}},
+        })
+        self.assertEqual(wrapper.pragmas(), {'journal_mode': 'delete', 'busy_timeout': 5000})
+        wrapper.settings_dict['NAME'] = wrapper.settings_dict['TEST']['NAME']
+        self.assertEqual(wrapper.pragmas(), {'journal_mode': 'wal', 'busy_timeout': 5000})
+
+    def test_order_writes_begin_immediate(self):
+        category = Category.objects.create(name='Ilam')
+        product = make_products(category, 1, images_per_product=0)[0]
+        with CaptureQueriesContext(connection) as queries:
+            self.client.post(reverse('create_order'), {
+                'total_price': '10.00',
+                'products': [{'product_id': product.pk, 'quantity': 1}],
+            }, content_type='application/json')
+        self.assertIn('BEGIN IMMEDIATE', [query['sql'] for query in queries])
+
+    def test_concurrent_checkouts_never_hit_lock_errors(self):
+        category = Category.objects.create(name='Dolakha')
+        products = make_products(category, 10, images_per_product=0)
+        workers, checkouts_per_worker = 8, 15
+        errors = []
+        start = threading.Barrier(workers)
+
+        def shop(worker):
+            try:
+                start.wait()
+                for n in range(checkouts_per_worker):
+                    user = User.objects.create(username=f'shopper-{worker}-{n}')
+                    cart = Cart.objects.create(user=user)
+                    CartProduct.objects.bulk_create([
+                        CartProduct(cart=cart, product=product, quantity=1) for product in products
+                    ])
+                    checkout_cart(cart.pk, user=user)
+            except Exception as e:
+                errors.append(e)
+            finally:
+                connections.close_all()
+
+        threads = [threading.Thread(target=shop, args=(worker,)) for worker in range(workers)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(errors, [])
+        self.assertEqual(Order.objects.count(), workers * checkouts_per_worker)
+        self.assertEqual(OrderItem.objects.count(), workers * checkouts_per_worker * len(products))
+        self.assertFalse(Cart.objects.exists())
+
+
+WEBHOOK_SECRET = 'whsec_test'
+
+
+class PaymentViewTests(TestCase):
+    def setUp(self):
+        catalog_cache().clear()
+        self.fake = FakeStripe()
+        self.fake.__enter__()
+        self.addCleanup(self.fake.__exit__, None, None, None)
+        self.category = Category.objects.create(name='Rara')
+        self.products = make_products(self.category, 3, images_per_product=1)
+
+    async def test_create_payment_intent(self):
+        response = await self.async_client.post(reverse('create-payment-intent'), {'amount': 2500},
+                                                content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+        body = response.json()
+        self.assertEqual(self.fake.intents[body['payment_intent']]['amount'], 2500)
+        self.assertTrue(body['clientSecret'].startswith(body['payment_intent']))
+        self.assertTrue(await IssuedPaymentIntent.objects.filter(payment_intent_id=body['payment_intent']).aexists())
+
+    async def test_create_confirm_intent(self):
+        response = await self.async_client.post(reverse('create-confirm-intent'), {
+            'amount': 1200, 'confirmation_token_id': 'ctoken_fake',
+        }, content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['status'], 'succeeded')
+
+    async def create_intent(self, amount, confirm=False):
+        intent = self.fake.create_intent(amount, confirm=confirm)
+        await sync_to_async(issue_intent)(intent['id'], amount)
+        return intent
+
+    def confirm(self, intent_id, cart):
+        return self.async_client.post(reverse('confirm_order'), {'payment_intent_id': intent_id, 'cart': cart},
+                                      content_type='application/json')
+
+    def deliver(self, intent_id, secret=WEBHOOK_SECRET):
+        payload, signature = self.fake.signed_event(intent_id, secret)
+        return self.async_client.post(reverse('stripe-webhook'), payload, content_type='application/json',
+                                      headers={'Stripe-Signature': signature})
+
+    async def test_confirm_order(self):
+        intent = await self.create_intent(3100, confirm=True)
+        cart = [{'product_id': self.products[0].pk, 'quantity': 1}, {'product_id': self.products[2].pk, 'quantity': 2}]
+        response = await self.confirm(intent['id'], cart)
+        self.assertEqual(response.status_code, 201)
+        body = response.json()
+        self.assertEqual(body['payment_intent_id'], intent['id'])
+        self.assertEqual(body['status'], Order.PENDING)
+        self.assertEqual([item['product'] for item in body['order_items']],
+                         [self.products[0].pk, self.products[2].pk])
+        # Confirmation is a local lookup; only creating the intent hit Stripe.
+        self.assertEqual(self.fake.requests, [])
+
+        retry = await self.confirm(intent['id'], cart)
+        self.assertEqual(retry.status_code, 200)
+        self.assertEqual(retry.json()['id'], body['id'])
+        self.assertEqual(await Order.objects.acount(), 1)
+        self.assertEqual(await OrderItem.objects.acount(), 2)
+
+    async def test_made_up_intents_reserve_nothing(self):
+        await Product.objects.filter(pk=self.products[0].pk).aupdate(stock=3)
+        cart = [{'product_id': self.products[0].pk, 'quantity': 3}]
+        response = await self.confirm('pi_made_up', cart)
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('pi_made_up', response.json()['error'])
+        response = await self.async_client.post(reverse('create_order'), {
+            'total_price': '10.00', 'payment_intent_id': 'pi_made_up', 'products': cart,
+        }, content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(await Order.objects.aexists())
+        self.assertEqual((await Product.objects.aget(pk=self.products[0].pk)).stock, 3)
+
+    def test_reconcile_payments(self):
+        succeeded = self.fake.create_intent(1000, confirm=True)
+        canceled = self.fake.create_intent(1100)
+        self.fake.intents[canceled['id']]['status'] = 'canceled'
+        waiting = self.fake.create_intent(1200)
+        orders = {
+            intent_id: Order.objects.create(total_price=Decimal('10.00'), payment_intent_id=intent_id)
+            for intent_id in (succeeded['id'], canceled['id'], waiting['id'], 'pi_client_made_up')
+        }
+        out, err = io.StringIO(), io.StringIO()
+        call_command('reconcile_payments', stdout=out, stderr=err)
+        self.assertIn('1 paid, 1 expired, 1 still awaiting payment, 1 unknown to Stripe', out.getvalue())
+        self.assertIn('pi_client_made_up', err.getvalue())
+        self.assertEqual(
+            {intent_id: Order.objects.get(pk=order.pk).status for intent_id, order in orders.items()},
+            {succeeded['id']: Order.PAID, canceled['id']: Order.EXPIRED, waiting['id']: Order.PENDING,
+             'pi_client_made_up': Order.PENDING},
+        )
+
+    async def test_confirm_order_errors(self):
+        paid = await self.create_intent(500, confirm=True)
+        for payload, message in (
+            ({'cart': []}, 'Payment intent ID is required'),
+            ({'payment_intent_id': paid['id'], 'cart': []}, 'Cart items are required'),
+            ({'payment_intent_id': paid['id'], 'cart': [{'product_id': 9999, 'quantity': 1}]}, 'Product with ID 9999 not found'),
+        ):
+            response = await self.async_client.post(reverse('confirm_order'), payload, content_type='application/json')
+            self.assertEqual(response.status_code, 400)
+            self.assertEqual(response.json()['error'], message)
+        self.assertFalse(await Order.objects.aexists())
+
+    @override_settings(STRIPE_WEBHOOK_SECRET=WEBHOOK_SECRET)
+    async def test_webhook_marks_order_paid(self):
+        intent = await self.create_intent(3100, confirm=True)
+        await self.confirm(intent['id'], [{'product_id': self.products[0].pk, 'quantity': 1}])
+        for _ in range(2):  # Stripe may deliver an event more than once.
+            response = await self.deliver(intent['id'])
+            self.assertEqual(response.status_code, 200)
+        order = await Order.objects.aget(payment_intent_id=intent['id'])
+        self.assertEqual(order.status, Order.PAID)
+        self.assertEqual(order.total_price, Decimal('31.00'))
+        self.assertEqual(await order.order_items.acount(), 1)
+
+    @override_settings(STRIPE_WEBHOOK_SECRET=WEBHOOK_SECRET)
+    async def test_webhook_before_confirmation(self):
+        intent = await self.create_intent(1500, confirm=True)
+        await self.deliver(intent['id'])
+        response = await self.confirm(intent['id'], [{'product_id': self.products[1].pk, 'quantity': 3}])
+        self.assertEqual(response.status_code, 200)
+        body = response.json()
+        self.assertEqual(body['status'], Order.PAID)
+        self.assertEqual(body['total_price'], '15.00')
+        self.assertEqual([item['quantity'] for item in body['order_items']], [3])
+        self.assertEqual(await Order.objects.acount(), 1)
+
+    async def test_webhook_rejects_bad_signatures(self):
+        intent = self.fake.create_intent(1500, confirm=True)
+        with override_settings(STRIPE_WEBHOOK_SECRET=''):
+            self.assertEqual((await self.deliver(intent['id'])).status_code, 400)
+        with override_settings(STRIPE_WEBHOOK_SECRET=WEBHOOK_SECRET):
+            self.assertEqual((await self.deliver(intent['id'], secret='whsec_wrong')).status_code, 400)
+            response = await self.async_client.post(reverse('stripe-webhook'), '{}', content_type='application/json')
+            self.assertEqual(response.status_code, 400)
+        self.assertFalse(await Order.objects.aexists())
+
+    async def test_slow_stripe_does_not_block_other_requests(self):
+        self.fake.latency = 0.3
+        payments = 6
+
+        async def pay():
+            return await self.async_client.post(reverse('create-payment-intent'), {'amount': 100},
+                                                content_type='application/json')
+
+        async def browse():
+            response = await self.async_client.get(reverse('get_products'))
+            return response, time.perf_counter()
+
+        start = time.perf_counter()
+        *paid, (catalog, browsed_at) = await asyncio.gather(*[pay() for _ in range(payments)], browse())
+        elapsed = time.perf_counter() - start
+
+        self.assertTrue(all(response.status_code == 200 for response in paid))
+        self.assertEqual(catalog.status_code, 200)
+        # Serial Stripe calls would take payments * latency.
+        self.assertLess(elapsed, payments * self.fake.latency / 2)
+        self.assertLess(browsed_at - start, self.fake.latency)
+
+    @override_settings(STRIPE_TIMEOUT=0.1)
+    async def test_stripe_timeout(self):
+        self.fake.latency = 0.5
+        start = time.perf_counter()
+        response = await self.async_client.post(reverse('create-payment-intent'), {'amount': 100},
+                                                content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('did not respond', response.json()['error'])
+        self.assertLess(time.perf_counter() - start, 0.4)
+
+
+class IdempotencyTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.category = Category.objects.create(name='Mustang')
+        self.products = make_products(self.category, 2, images_per_product=0)
+
+    def guest_order(self, key, quantity=1):
+        return self.client.post(reverse('create_guest_order'), {
+            'email': 'guest@example.com',
+            'total_price': '10.00',
+            'items': [{'product': self.products[0].pk, 'quantity': quantity}],
+        }, format='json', headers={'Idempotency-Key': key})
+
+    def test_retry_replays_first_response(self):
+        first = self.guest_order('key-1')
+        with CaptureQueriesContext(connection) as queries:
+            retry = self.guest_order('key-1')
+        self.assertEqual(first.status_code, 201)
+        self.assertEqual(retry.status_code, 201)
+        self.assertEqual(retry.content, first.content)
+        self.assertEqual(retry['Idempotent-Replayed'], 'true')
+        self.assertNotIn('store_app_order', ' '.join(query['sql'] for query in queries))
+        self.assertEqual(Order.objects.count(), 1)
+
+        self.assertEqual(self.guest_order('key-2').status_code, 201)
+        self.assertEqual(Order.objects.count(), 2)
+
+    def test_key_reused_for_another_request(self):
+        self.guest_order('key-1')
+        response = self.guest_order('key-1', quantity=2)
+        self.assertEqual(response.status_code, 422)
+        self.assertEqual(Order.objects.count(), 1)
+
+    def test_keys_are_scoped_to_user(self):
+        self.guest_order('key-1')
+        self.client.force_login(User.objects.create(username='pasang'))
+        self.assertNotIn('Idempotent-Replayed', self.guest_order('key-1'))
+        self.assertEqual(Order.objects.count(), 2)
+
+    def test_expired_keys_are_processed_again(self):
+        self.guest_order('key-1')
+        with override_settings(IDEMPOTENCY_KEY_TTL=0):
+            self.assertNotIn('Idempotent-Replayed', self.guest_order('key-1'))
+        self.assertEqual(Order.objects.count(), 2)
+        self.assertEqual(IdempotencyRecord.objects.count(), 1)
+
+    @override_settings(IDEMPOTENCY_WAIT=0.1)
+    def test_duplicate_of_stuck_request_conflicts(self):
+        self.guest_order('key-1')
+        IdempotencyRecord.objects.update(status_code=None)
+        response = self.guest_order('key-1')
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(response['Retry-After'], '1')
+        self.assertEqual(Order.objects.count(), 1)
+
+    def test_requests_without_key_are_untouched(self):
+        self.client.post(reverse('create_order'), {
+            'total_price': '10.00', 'products': [{'product_id': self.products[0].pk, 'quantity': 1}],
+        }, format='json')
+        self.assertFalse(IdempotencyRecord.objects.exists())
+
+    async def test_async_confirm_order(self):
+        with FakeStripe() as fake:
+            intent = fake.create_intent(1000, confirm=True)
+        await sync_to_async(issue_intent)(intent['id'])
+        payload = {'payment_intent_id': intent['id'], 'cart': [{'product_id': self.products[1].pk, 'quantity': 1}]}
+        responses = [
+            await self.async_client.post(reverse('confirm_order'), payload, content_type='application/json',
+                                         headers={'Idempotency-Key': 'confirm-1'})
+            for _ in range(2)
+        ]
+        self.assertEqual([response.status_code for response in responses], [201, 201])
+        self.assertEqual(responses[1].content, responses[0].content)
+        self.assertEqual(responses[1]['Idempotent-Replayed'], 'true')
+
+
+class IdempotencyConcurrencyTests(TransactionTestCase):
+    def test_concurrent_duplicates_wait_for_first_response(self):
+        category = Category.objects.create(name='Humla')
+        product = make_products(category, 1, images_per_product=0)[0]
+        workers = 6
+        responses, errors = [], []
+        start = threading.Barrier(workers)
+
+        def retry():
+            try:
+                start.wait()
+                responses.append(APIClient().post(reverse('create_guest_order'), {
+                    'email': 'guest@example.com',
+                    'total_price': '10.00',
+                    'items': [{'product': product.pk, 'quantity': 1}],
+                }, format='json', headers={'Idempotency-Key': 'flaky-network'}))
+            except Exception as e:
+                errors.append(e)
+            finally:
+                connections.close_all()
+
+        threads = [threading.Thread(target=retry) for _ in range(workers)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(errors, [])
+        self.assertEqual(Order.objects.count(), 1)
+        # Every duplicate waits for the first response and replays it.
+        self.assertEqual({response.status_code for response in responses}, {201})
+        self.assertEqual({response.content for response in responses}, {responses[0].content})
+        self.assertEqual({response.json()['id'] for response in responses}, {Order.objects.get().pk})
+        self.assertEqual(sum(response.has_header('Idempotent-Replayed') for response in responses), workers - 1)
+
+
+@override_settings(STRIPE_WEBHOOK_SECRET=WEBHOOK_SECRET, STOCK_RESERVATION_TTL=60)
+class StockReservationTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.products = make_products(Category.objects.create(name='Manang'), 3, images_per_product=0)
+        Product.objects.filter(pk=self.products[0].pk).update(stock=5)
+        Product.objects.filter(pk=self.products[1].pk).update(stock=2)
+
+    def stock(self):
+        return list(Product.objects.order_by('pk').values_list('stock', flat=True))
+
+    def order(self, quantities, payment_intent_id=None):
+        return self.client.post(reverse('create_order'), {
+            'total_price': '10.00',
+            'payment_intent_id': payment_intent_id,
+            'products': [{'product_id': self.products[n].pk, 'quantity': q} for n, q in quantities],
+        }, format='json')
+
+    def test_orders_reserve_stock_in_one_statement(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.order([(0, 2), (1, 1), (2, 7), (0, 1)])
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(self.stock(), [2, 1, None])
+        self.assertEqual(len([query for query in queries if query['sql'].startswith('UPDATE "store_app_product"')]), 1)
+
+    def test_short_order_writes_nothing(self):
+        response = self.order([(0, 1), (1, 3)])
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(response.json()['product_ids'], [self.products[1].pk])
+        self.assertEqual(self.stock(), [5, 2, None])
+        self.assertFalse(Order.objects.exists())
+        self.assertEqual(self.order([(0, -1)]).status_code, 400)
+        self.assertEqual(self.stock(), [5, 2, None])
+
+    def test_checkout_out_of_stock_keeps_cart(self):
+        cart = Cart.objects.create(user=User.objects.create(username='pemba'))
+        CartProduct.objects.create(cart=cart, product=self.products[1], quantity=3)
+        response = self.client.post(reverse('checkout'), {'cart_id': cart.pk})
+        self.assertEqual(response.status_code, 409)
+        self.assertTrue(CartProduct.objects.filter(cart=cart).exists())
+
+    def test_unpaid_orders_release_stock_on_expiry(self):
+        self.order([(0, 3)], payment_intent_id=issue_intent('pi_unpaid'))
+        self.order([(0, 1)], payment_intent_id=issue_intent('pi_paid'))
+        self.order([(1, 1)])
+        Order.objects.filter(payment_intent_id='pi_paid').update(status=Order.PAID)
+        self.assertEqual(self.stock(), [1, 1, None])
+
+        self.assertEqual(release_expired_reservations(), 0)
+        later = timezone.now() + timedelta(seconds=61)
+        self.assertEqual(release_expired_reservations(now=later), 1)
+        self.assertEqual(release_expired_reservations(now=later), 0)
+        self.assertEqual(self.stock(), [4, 1, None])
+        self.assertEqual(Order.objects.get(payment_intent_id='pi_unpaid').status, Order.EXPIRED)
+
+    def test_expiry_releases_only_reserved_lines(self):
+        self.order([(0, 2), (2, 4)], payment_intent_id=issue_intent('pi_unpaid'))
+        self.assertEqual(
+            dict(OrderItem.objects.values_list('product_id', 'reserved')),
+            {self.products[0].pk: True, self.products[2].pk: False},
+        )
+        Product.objects.filter(pk=self.products[2].pk).update(stock=1)
+
+        later = timezone.now() + timedelta(seconds=61)
+        self.assertEqual(release_expired_reservations(now=later), 1)
+        self.assertEqual(self.stock(), [5, 2, 1])
+
+    def webhook(self, fake, intent_id, event_type):
+        payload, signature = fake.signed_event(intent_id, WEBHOOK_SECRET, event_type)
+        return self.client.post(reverse('stripe-webhook'), payload, content_type='application/json',
+                                headers={'Stripe-Signature': signature})
+
+    def test_canceled_intent_releases_and_late_payment_reclaims(self):
+        with FakeStripe() as fake:
+            intent = fake.create_intent(1000)
+            issue_intent(intent['id'])
+            self.order([(0, 2)], payment_intent_id=intent['id'])
+            self.assertEqual(self.webhook(fake, intent['id'], 'payment_intent.canceled').status_code, 200)
+            self.assertEqual(self.stock()[0], 5)
+            self.assertEqual(Order.objects.get().status, Order.EXPIRED)
+
+            fake.intents[intent['id']]['amount_received'] = 1000
+            self.webhook(fake, intent['id'], 'payment_intent.succeeded')
+        self.assertEqual(self.stock()[0], 3)
+        self.assertEqual(Order.objects.get().status, Order.PAID)
+
+
+class StockConcurrencyTests(TransactionTestCase):
+    def test_concurrent_orders_never_oversell(self):
+        stock, workers, orders_per_worker = 20, 8, 5
+        product = make_products(Category.objects.create(name='Mugu'), 1, images_per_product=0)[0]
+        Product.objects.filter(pk=product.pk).update(stock=stock)
+        statuses, errors = [], []
+        start = threading.Barrier(workers)
+
+        def shop():
+            client = APIClient()
+            try:
+                start.wait()
+                for _ in range(orders_per_worker):
+                    statuses.append(client.post(reverse('create_order'), {
+                        'total_price': '10.00', 'products': [{'product_id': product.pk, 'quantity': 1}],
+                    }, format='json').status_code)
+            except Exception as e:
+                errors.append(e)
+            finally:
+                connections.close_all()
+
+        threads = [threading.Thread(target=shop) for _ in range(workers)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(errors, [])
+        self.assertEqual(sorted(statuses), [201] * stock + [409] * (workers * orders_per_worker - stock))
+        self.assertEqual(Product.objects.get(pk=product.pk).stock, 0)
+        self.assertEqual(Order.objects.count(), stock)
+
+
+class CartConcurrencyTests(TransactionTestCase):
+    def test_concurrent_adds_keep_lines_and_total_together(self):
+        product = make_products(Category.objects.create(name='Bajura'), 1, images_per_product=0)[0]
+        user = User.objects.create_user(username='tashi', password='secret')
+        workers, adds_per_worker = 6, 5
+        errors = []
+        start = threading.Barrier(workers)
+
+        def add():
+            client = APIClient()
+            client.force_login(user)
+            try:
+                start.wait()
+                for _ in range(adds_per_worker):
+                    client.post(reverse('add_to_cart'), {'product_id': product.pk, 'quantity': 1})
+            except Exception as e:
+                errors.append(e)
+            finally:
+                connections.close_all()
+
+        threads = [threading.Thread(target=add) for _ in range(workers)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(errors, [])
+        self.assertEqual(CartProduct.objects.get().quantity, workers * adds_per_worker)
+        self.assertEqual(Cart.objects.get().total_price, product.price * workers * adds_per_worker)
+
+
+def server_timing(response):
+    metrics = {}
+    for entry in response['Server-Timing'].split(', '):
+        name, *params = entry.split(';')
+        metrics[name] = dict(param.split('=', 1) for param in params)
+    return metrics
+
+
+class RequestMetricsTests(TestCase):
+    def setUp(self):
+        catalog_cache().clear()
+        self.user = User.objects.create(username='dawa', is_staff=True)
+        category = Category.objects.create(name='Solukhumbu')
+        products = make_products(category, 3, images_per_product=1)
+        for _ in range(2):
+            place_order([(product, 1) for product in products], Decimal('30.00'), user=self.user)
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def test_server_timing_header(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('get_orders'))
+        timing = server_timing(response)
+        self.assertEqual(set(timing), {'db', 'view', 'serialize', 'render', 'total'})
+        self.assertEqual(timing['db']['desc'], f'"{len(queries)} queries"')
+        for phase in ('view', 'serialize', 'render'):
+            self.assertGreater(float(timing[phase]['dur']), 0)
+        self.assertLessEqual(float(timing['view']['dur']), float(timing['total']['dur']))
+
+    def test_server_timing_is_only_for_staff(self):
+        User.objects.filter(pk=self.user.pk).update(is_staff=False)
+        self.user.refresh_from_db()
+        self.client.force_authenticate(self.user)
+        self.assertFalse(self.client.get(reverse('get_orders')).has_header('Server-Timing'))
+        self.assertFalse(APIClient().get(reverse('get_products')).has_header('Server-Timing'))
+        with override_settings(DEBUG=True):
+            self.assertTrue(APIClient().get(reverse('get_products')).has_header('Server-Timing'))
+
+    @override_settings(DEBUG=True)
+    async def test_async_views_count_queries_from_sync_to_async(self):
+        with FakeStripe():
+            response = await self.async_client.post(reverse('create-payment-intent'), {'amount': 100},
+                                                    content_type='application/json')
+        # Recording the issued intent.
+        self.assertEqual(server_timing(response)['db']['desc'], '"1 queries"')
+        response = await self.async_client.post(reverse('confirm_order'), {
+            'payment_intent_id': response.json()['payment_intent'], 'cart': [{'product_id': (await Product.objects.afirst()).pk, 'quantity': 1}],
+        }, content_type='application/json')
+        self.assertEqual(response.status_code, 201)
+        self.assertNotEqual(server_timing(response)['db']['desc'], '"0 queries"')
+
+    def route_count(self, body, route):
+        prefix = f'store_request_duration_seconds_count{{route="{route}",method="GET",status="2xx"'
+        return next((int(line.split()[-1]) for line in body.splitlines() if line.startswith(prefix)), 0)
+
+    @override_settings(METRICS_TOKEN='scrape-me')
+    def test_metrics_endpoint(self):
+        scrape = {'Authorization': 'Bearer scrape-me'}
+        before = self.route_count(self.client.get(reverse('metrics'), headers=scrape).content.decode(), 'orders/get/')
+        for _ in range(3):
+            self.client.get(reverse('get_orders'))
+        response = self.client.get(reverse('metrics'), headers=scrape)
+        self.assertEqual(response['Content-Type'], 'text/plain; version=0.0.4; charset=utf-8')
+        body = response.content.decode()
+        self.assertEqual(self.route_count(body, 'orders/get/'), before + 3)
+        self.assertIn('# TYPE store_request_phase_seconds histogram', body)
+        self.assertRegex(body, r'store_request_queries_bucket\{route="orders/get/",pid="\d+",le="\+Inf"\} \d+')
+
+    def test_metrics_are_hidden_without_a_token(self):
+        self.assertEqual(self.client.get(reverse('metrics')).status_code, 404)
+
+    @override_settings(METRICS_TOKEN='scrape-me')
+    def test_metrics_token(self):
+        self.assertEqual(self.client.get(reverse('metrics')).status_code, 401)
+        response = self.client.get(reverse('metrics'), headers={'Authorization': 'Bearer scrape-me'})
+        self.assertEqual(response.status_code, 200)
+
+
+class FastSerializerTests(TestCase):
+    def setUp(self):
+        catalog_cache().clear()
+        self.category = Category.objects.create(name='Bhaktapur')
+        self.products = make_products(self.category, 6, images_per_product=2)
+        variants = {'source': 'x', 'sizes': {
+            'thumbnail': {'name': 'product_images/derivatives/a b-thumbnail.webp', 'width': 160, 'height': 120},
+            'card': {'name': 'product_images/derivatives/a b-card.webp', 'width': 480, 'height': 360},
+        }}
+        Product.objects.filter(pk=self.products[0].pk).update(image_width=640, image_height=480, image_variants=variants)
+        ProductImage.objects.filter(product=self.products[1]).update(image_variants=variants)
+        Product.objects.filter(pk=self.products[2].pk).update(image='', price=Decimal('7.5'))
+        reviewer = User.objects.create(username='reviewer')
+        for rating in (5, 4, 4):
+            Review.objects.create(product=self.products[3], user=reviewer, rating=rating, comment='Ramro')
+
+    def assertSameJSON(self, fast, slow):
+        self.assertEqual(JSONRenderer().render(fast), JSONRenderer().render(slow))
+
+    def test_products_match_product_serializer(self):
+        queryset = Product.objects.order_by('-created_at', '-id')
+        self.assertSameJSON(
+            serialize_products(product_values(queryset)),
+            ProductSerializer(queryset.catalog(), many=True).data,
+        )
+
+    def test_orders_match_order_serializer(self):
+        user = User.objects.create(username='sita', email='sita@example.com', first_name='Sita')
+        place_order([(self.products[0], 2), (self.products[2], 1)], Decimal('27.50'), user=user)
+        place_order([(self.products[1], 1), (self.products[0], 1)], Decimal('21.00'), payment_intent_id='pi_guest')
+        Order.objects.create(user=user, total_price=Decimal('0'))
+        self.assertSameJSON(serialize_orders(order_values(Order.objects.all())),
+                            OrderSerializer(Order.objects.with_items(), many=True).data)
+        self.assertEqual(serialize_orders(order_values(Order.objects.none())), [])
+
+    def test_categories_match_category_serializer(self):
+        Category.objects.create(name='Gorkha')
+        self.assertSameJSON(serialize_categories(), CategorySerializer(Category.objects.all(), many=True).data)
+
+    def test_media_urls_follow_media_url_setting(self):
+        with override_settings(MEDIA_URL='https://cdn.example.com/media/'):
+            row = serialize_products(product_values(Product.objects.filter(pk=self.products[0].pk)))[0]
+        self.assertEqual(row['image'], 'https://cdn.example.com/media/product_images/product-0.jpg')
+        self.assertEqual(row['image_sizes']['card']['url'],
+                         'https://cdn.example.com/media/product_images/derivatives/a%20b-card.webp')
+        row = serialize_products(product_values(Product.objects.filter(pk=self.products[0].pk)))[0]
+        self.assertEqual(row['image'], '/media/product_images/product-0.jpg')
+
+
+class FastJSONTests(TestCase):
+    payload = {
+        'price': Decimal('12.50'),
+        'prices': [Decimal('0.10'), Decimal('1E+2')],
+        'created_at': datetime(2024, 5, 1, 9, 30, 15, 123456, tzinfo=dt_timezone.utc),
+        'local': datetime(2024, 5, 1, 9, 30, tzinfo=dt_timezone(timedelta(hours=5, minutes=45))),
+        'day': date(2024, 5, 1),
+        'label': gettext_lazy('Order'),
+        'name': 'धाका टोपी   "quoted"',
+        'counts': {1: 'one', 'two': (2, 2.5, None, True)},
+    }
+
+    def test_renderer_matches_json_renderer(self):
+        category = Category.objects.create(name='Palpa')
+        make_products(category, 3)
+        catalog = ProductSerializer(Product.objects.catalog(), many=True).data
+        for data in (self.payload, catalog, [], None):
+            self.assertEqual(FastJSONRenderer().render(data), JSONRenderer().render(data))
+        indented = 'application/json; indent=2'
+        self.assertEqual(FastJSONRenderer().render(self.payload, indented), JSONRenderer().render(self.payload, indented))
+        with mock.patch('store_app.fastjson.orjson', None):
+            self.assertEqual(FastJSONRenderer().render(self.payload), JSONRenderer().render(self.payload))
+
+    def test_parser(self):
+        body = '{"name": "धाका", "quantity": 2, "price": 1.5}'.encode()
+        self.assertEqual(FastJSONParser().parse(io.BytesIO(body)), {'name': 'धाका', 'quantity': 2, 'price': 1.5})
+        for invalid in (b'{"name": ', b'{"price": NaN}', b'\xff'):
+            with self.assertRaises(ParseError):
+                FastJSONParser().parse(io.BytesIO(invalid))
+
+    def test_json_response_keeps_django_encoding(self):
+        response = FastJsonResponse(self.payload)
+        self.assertEqual(response['Content-Type'], 'application/json')
+        self.assertEqual(json.loads(response.content), json.loads(JsonResponse(self.payload).content))
+        self.assertEqual(json.loads(response.content)['price'], '12.50')
+        with mock.patch('store_app.fastjson.orjson', None):
+            self.assertEqual(FastJsonResponse(self.payload).content, JsonResponse(self.payload).content)
+        self.assertEqual(FastJsonResponse([1], safe=False).content, b'[1]')
+        with self.assertRaises(TypeError):
+            FastJsonResponse([1])
+
+    def test_api_views_use_fast_json(self):
+        catalog_cache().clear()
+        category = Category.objects.create(name='Ilam')
+        make_products(category, 2)
+        response = self.client.get(reverse('get_products'))
+        self.assertIsInstance(response.accepted_renderer, FastJSONRenderer)
+        self.assertEqual({product['price'] for product in response.json()['results']}, {'10.00', '11.00'})
+
+
+class ProductRatingTests(TestCase):
+    def setUp(self):
+        catalog_cache().clear()
+        self.client = APIClient()
+        self.user = User.objects.create_user(username='gita', password='secret')
+        self.products = make_products(Category.objects.create(name='Mustang'), 2, images_per_product=0)
+
+    def rating(self, product):
+        return ProductSerializer(Product.objects.catalog().get(pk=product.pk)).data['rating']
+
+    def review(self, rating, product=None):
+        return Review.objects.create(product=product or self.products[0], user=self.user, rating=rating, comment='')
+
+    def test_ratings_follow_review_changes(self):
+        self.assertEqual(self.rating(self.products[0]), {
+            'count': 0, 'average': None, 'histogram': {'1': 0, '2': 0, '3': 0, '4': 0, '5': 0},
+        })
+        five, three = self.review(5), self.review(3)
+        self.review(4)
+        self.assertEqual(self.rating(self.products[0]), {
+            'count': 3, 'average': 4.0, 'histogram': {'1': 0, '2': 0, '3': 1, '4': 1, '5': 1},
+        })
+
+        three.rating = 1
+        three.save()
+        five.product = self.products[1]
+        five.save()
+        self.assertEqual(self.rating(self.products[0]), {
+            'count': 2, 'average': 2.5, 'histogram': {'1': 1, '2': 0, '3': 0, '4': 1, '5': 0},
+        })
+        self.assertEqual(self.rating(self.products[1])['histogram']['5'], 1)
+
+        Review.objects.filter(product=self.products[0]).delete()
+        self.assertEqual(self.rating(self.products[0])['count'], 0)
+        self.products[1].delete()
+        self.assertFalse(ProductRating.objects.filter(product_id=self.products[1].pk).exists())
+
+    def test_rebuild_matches_incremental_ratings(self):
+        for rating in (1, 2, 2, 5):
+            self.review(rating)
+        self.review(4, product=self.products[1])
+        Review.objects.bulk_create([Review(product=self.products[1], user=self.user, rating=9, comment='')])
+        incremental = list(ProductRating.objects.order_by('pk').values())
+        self.assertEqual(rebuild_ratings(), 2)
+        rebuilt = list(ProductRating.objects.order_by('pk').values())
+        self.assertEqual(rebuilt[0], incremental[0])
+        self.assertEqual((rebuilt[1]['count'], rebuilt[1]['total'], rebuilt[1]['stars_5']), (2, 9, 1))
+
+    def test_reviewing_refreshes_cached_catalog(self):
+        url = reverse('get_product_detail', args=[self.products[0].pk])
+        self.assertEqual(self.client.get(url).data['rating']['count'], 0)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.review(5)
+        self.assertEqual(self.client.get(url).data['rating']['count'], 1)
+
+
+class ProductReviewsViewTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.user = User.objects.create_user(username='bikash', password='secret')
+        self.product = make_products(Category.objects.create(name='Dolpa'), 1, images_per_product=0)[0]
+        self.url = reverse('product_reviews', args=[self.product.pk])
+
+    def test_list_is_paginated_newest_first(self):
+        reviews = [Review.objects.create(product=self.product, user=self.user, rating=4, comment=f'{n}')
+                   for n in range(25)]
+        with self.assertNumQueries(2):
+            first = self.client.get(self.url).json()
+        second = self.client.get(first['next']).json()
+        self.assertEqual([review['id'] for review in first['results'] + second['results']],
+                         [review.pk for review in reversed(reviews)])
+        self.assertEqual(first['results'][0]['user'], 'bikash')
+        self.assertEqual(self.client.get(reverse('product_reviews', args=[9999])).status_code, 404)
+
+    def test_create_review(self):
+        self.assertEqual(self.client.post(self.url, {'rating': 5, 'comment': 'Ramro'}).status_code, 403)
+        self.client.force_authenticate(self.user)
+        self.assertEqual(self.client.post(self.url, {'rating': 6, 'comment': 'Ramro'}).status_code, 400)
+
+        response = self.client.post(self.url, {'rating': 5, 'comment': 'Ramro'}, format='json')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual((response.data['product'], response.data['user']), (self.product.pk, 'bikash'))
+        self.assertEqual(ProductRating.objects.get(product=self.product).stars_5, 1)
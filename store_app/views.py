@@ -1,11 +1,12 @@
 from rest_framework.response import Response
-from rest_framework.permissions import IsAuthenticated, IsAdminUser
-from rest_framework.decorators import api_view, permission_classes, parser_classes
+from rest_framework.permissions import IsAuthenticated, IsAuthenticatedOrReadOnly, IsAdminUser
+from rest_framework.decorators import api_view, authentication_classes, permission_classes, parser_classes
+from rest_framework.authentication import SessionAuthentication
 from rest_framework.parsers import MultiPartParser, FormParser
-from rest_framework import status
+from rest_framework import exceptions, status
 from django.contrib.auth.models import User
 from django.db import transaction
-from django.http import JsonResponse
+from django.http import HttpResponse
 from rest_framework import generics
 from django.shortcuts import get_object_or_404
 from django.core.exceptions import ObjectDoesNotExist
@@ -14,144 +15,207 @@ from django.views.decorators.csrf import csrf_exempt
 
 from .models import *
 from .serializers import *
+from .pagination import OrderCursorPagination, ProductCursorPagination, ReviewCursorPagination, SearchPagination
+from .search import ProductSearchResults
+from .authentication import StatelessJWTAuthentication
+from .cache import cache_catalog_response
+from .fastjson import FastJsonResponse
+from .filters import InvalidFilter, filter_products
+from .fast_serializers import order_values, product_values, serialize_categories, serialize_orders, serialize_products
+from .idempotency import idempotent
+from .metrics import render_metrics
+from .orders import (
+    EmptyCart, ProductNotFound, UnknownPaymentIntent, checkout_cart, mark_order_paid, place_order, record_payment_order,
+    resolve_order_lines,
+)
+from .payments import read_api_request, stripe_call
+from .ratings import save_review
+from .stock import OutOfStock, cancel_payment_order
+from .cart import (
+    add_to_session_cart, add_to_user_cart, apply_cart_operations, apply_session_cart_operations, merge_session_cart,
+    read_cart, remove_cart_line,
+)
+from rest_framework_simplejwt.exceptions import InvalidToken, TokenError
+from rest_framework_simplejwt.views import TokenObtainPairView
+from asgiref.sync import sync_to_async
 import stripe
 from django.conf import settings
+import hmac
 import json
 import logging
 
 logger = logging.getLogger(__name__)
 
-stripe.api_key = settings.STRIPE_SECRET_KEY
 
-@csrf_exempt
-@api_view(['POST'])
-@permission_classes([])
-def confirm_order(request):
-    try:
-        logger.debug("Request data: %s", request.data)
-        payment_intent_id = request.data.get('payment_intent_id')
-        if not payment_intent_id:
-            logger.error("Payment intent ID is missing")
-            return Response({'error': 'Payment intent ID is required'}, status=status.HTTP_400_BAD_REQUEST)
+def order_payload(order):
+    return OrderSerializer(Order.objects.with_items().get(pk=order.pk)).data
 
-        # Retrieve the PaymentIntent details from Stripe
-        try:
-            payment_intent = stripe.PaymentIntent.retrieve(payment_intent_id)
-            logger.debug("Payment intent retrieved: %s", payment_intent)
-        except stripe.error.StripeError as e:
-            logger.error("Stripe error when retrieving PaymentIntent: %s", str(e))
-            return Response({'error': 'Failed to retrieve PaymentIntent from Stripe'}, status=status.HTTP_400_BAD_REQUEST)
 
-        # Log the entire payment intent for debugging
-        logger.debug("Full payment intent object: %s", payment_intent)
+def out_of_stock(error):
+    return {'error': str(error), 'product_ids': error.product_ids}
 
-        # Extract details from the payment intent
-        total_price = payment_intent.amount_received / 100  # Stripe amount is in cents
 
-        email = None
-        if payment_intent.charges and payment_intent.charges.data:
-            email = payment_intent.charges.data[0].billing_details.email
-        else:
-            logger.error("No charges found in payment intent or billing details missing")
-            return Response({'error': 'No charges found in payment intent or billing details missing'}, status=status.HTTP_400_BAD_REQUEST)
+# Payments. These are async views so a slow Stripe round trip parks a
+# coroutine instead of a whole worker; Stripe calls go through stripe_call().
+# Confirming an order never calls Stripe: the order is recorded as pending
+# and stripe_webhook marks it paid when payment_intent.succeeded arrives.
+@idempotent
+@csrf_exempt
+@require_POST
+async def confirm_order(request):
+    try:
+        data, user = await read_api_request(request)
+    except exceptions.APIException as e:
+        return FastJsonResponse({'error': str(e.detail)}, status=e.status_code)
 
-        items = request.data.get('cart')  # Get cart items from request data
+    try:
+        logger.debug("Request data: %s", data)
+        payment_intent_id = data.get('payment_intent_id')
+        if not payment_intent_id:
+            logger.error("Payment intent ID is missing")
+            return FastJsonResponse({'error': 'Payment intent ID is required'}, status=status.HTTP_400_BAD_REQUEST)
+
+        items = data.get('cart')  # Get cart items from request data
         if not items:
             logger.error("Items metadata is missing")
-            return Response({'error': 'Cart items are required'}, status=status.HTTP_400_BAD_REQUEST)
+            return FastJsonResponse({'error': 'Cart items are required'}, status=status.HTTP_400_BAD_REQUEST)
 
-        with transaction.atomic():
-            # Create a new order
-            user = request.user if request.user.is_authenticated else None
-            order = Order.objects.create(
-                user=user,
-                total_price=total_price,
-                payment_intent_id=payment_intent_id  # Ensure this is added
-            )
+        try:
+            lines = await sync_to_async(resolve_order_lines)(items)
+        except ProductNotFound as e:
+            logger.error("Product with ID %s not found", e.product_ids[0])
+            return FastJsonResponse({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
 
-            # Create order items
-            for item in items:
-                try:
-                    product = Product.objects.get(id=item['product_id'])
-                except Product.DoesNotExist:
-                    logger.error("Product with ID %s not found", item['product_id'])
-                    return Response({'error': f'Product with ID {item["product_id"]} not found'}, status=status.HTTP_400_BAD_REQUEST)
-
-                OrderItem.objects.create(
-                    order=order,
-                    product=product,
-                    quantity=item['quantity'],
-                    price=product.price
-                )
-
-            order_serialized = OrderSerializer(order)
-            logger.debug("Order created successfully: %s", order_serialized.data)
-            return Response(order_serialized.data, status=status.HTTP_201_CREATED)
-    except stripe.error.StripeError as e:
-        logger.error("Stripe error: %s", str(e))
-        return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        user = user if user.is_authenticated else None
+        try:
+            order, created = await sync_to_async(record_payment_order)(payment_intent_id, lines, user=user)
+        except OutOfStock as e:
+            logger.warning("Order for %s is out of stock: %s", payment_intent_id, e)
+            return FastJsonResponse(out_of_stock(e), status=status.HTTP_409_CONFLICT)
+        except UnknownPaymentIntent as e:
+            logger.warning("Rejected order for %s: %s", payment_intent_id, e)
+            return FastJsonResponse({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+        order_data = await sync_to_async(order_payload)(order)
+        logger.debug("Order recorded: %s", order_data)
+        return FastJsonResponse(order_data, status=status.HTTP_201_CREATED if created else status.HTTP_200_OK)
     except Exception as e:
         logger.error("Unexpected error: %s", str(e))
-        return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        return FastJsonResponse({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
 
 
+@csrf_exempt
+@require_POST
+async def stripe_webhook(request):
+    if not settings.STRIPE_WEBHOOK_SECRET:
+        logger.error("Stripe webhook received but STRIPE_WEBHOOK_SECRET is not set")
+        return FastJsonResponse({'error': 'Webhook is not configured'}, status=status.HTTP_400_BAD_REQUEST)
 
+    try:
+        event = stripe.Webhook.construct_event(
+            request.body.decode(), request.headers.get('Stripe-Signature', ''), settings.STRIPE_WEBHOOK_SECRET,
+        )
+    except (ValueError, stripe.error.SignatureVerificationError) as e:
+        logger.warning("Rejected Stripe webhook: %s", e)
+        return FastJsonResponse({'error': 'Invalid webhook signature'}, status=status.HTTP_400_BAD_REQUEST)
 
+    if event.type == 'payment_intent.succeeded':
+        intent = event.data.object
+        order = await sync_to_async(mark_order_paid)(intent.id, intent.amount_received)
+        logger.debug("Order %s paid by %s", order.pk, intent.id)
+    elif event.type == 'payment_intent.canceled':
+        await sync_to_async(cancel_payment_order)(event.data.object.id)
+    return FastJsonResponse({'received': True})
 
-# @csrf_exempt
-# @require_POST
-@api_view(['POST'])
-@permission_classes([])
-def create_payment_intent(request):
-    print('CREATE PAYMENT INTENT: REQUEST: ', request.data)
+
+@csrf_exempt
+@require_POST
+async def create_payment_intent(request):
     try:
-        amount = request.data['amount']
-        
-        intent = stripe.PaymentIntent.create(
+        data, user = await read_api_request(request)
+        amount = data['amount']
+
+        intent = await stripe_call(
+            stripe.PaymentIntent.create,
             amount = amount,
             currency = 'usd'
         )
-        print ('INTENT >>>>>>>>>>>>', intent)
-        return JsonResponse({'clientSecret': intent.client_secret, 'payment_intent': intent.id})
+        await IssuedPaymentIntent.objects.acreate(payment_intent_id=intent.id, amount=amount)
+        logger.debug("Payment intent created: %s", intent.id)
+        return FastJsonResponse({'clientSecret': intent.client_secret, 'payment_intent': intent.id})
     except Exception as e:
-        print('ERROR: ', e)
-        return JsonResponse({'error': str(e)}, status=400)
+        logger.error("Could not create payment intent: %s", e)
+        return FastJsonResponse({'error': str(e)}, status=400)
 
 
-@api_view(['POST'])
-@permission_classes([])
-def create_confirm_intent(request):
+@csrf_exempt
+@require_POST
+async def create_confirm_intent(request):
     try:
-        response = stripe.PaymentIntent.create(
+        data, user = await read_api_request(request)
+        response = await stripe_call(
+            stripe.PaymentIntent.create,
             confirm=True,
-            amount = request.data['amount'],
+            amount = data['amount'],
             currency = 'usd',
             automatic_payment_methods= {'enabled': True},
-            confirmation_token=request.data['confirmation_token_id']
+            confirmation_token=data['confirmation_token_id']
         )
-        print(response)
-        return Response(response)
+        await IssuedPaymentIntent.objects.acreate(payment_intent_id=response.id, amount=data['amount'])
+        return FastJsonResponse(response)
     except Exception as e:
-        print('ERROR: ', e)
-        return Response(str(e), status=400)
+        logger.error("Could not create and confirm payment intent: %s", e)
+        return FastJsonResponse(str(e), status=400, safe=False)
 
 
 # Products
 @api_view(['GET'])
+@cache_catalog_response
 def get_products(request):
-    products = Product.objects.all()
+    try:
+        queryset, ordering = filter_products(Product.objects.all(), request.query_params)
+    except InvalidFilter as e:
+        return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+    paginator = ProductCursorPagination()
+    paginator.ordering = ordering
+    rows = paginator.paginate_queryset(product_values(queryset), request)
+    return paginator.get_paginated_response(serialize_products(rows))
+
+@api_view(['GET'])
+@cache_catalog_response
+def search_products(request):
+    query = request.query_params.get('q', '').strip()
+    if not query:
+        return Response({'error': 'q is required'}, status=status.HTTP_400_BAD_REQUEST)
+    paginator = SearchPagination()
+    products = paginator.paginate_queryset(ProductSearchResults(query), request)
     serializer = ProductSerializer(products, many=True)
-    return Response(serializer.data, status=status.HTTP_200_OK)
+    return paginator.get_paginated_response(serializer.data)
 
 @api_view(['GET'])
+@cache_catalog_response
 def get_product_detail(request, pk):
     try:
-        product = Product.objects.get(pk=pk)
+        product = Product.objects.catalog().get(pk=pk)
     except Product.DoesNotExist:
         return Response({'error': 'Product not found'}, status=status.HTTP_404_NOT_FOUND)
     serializer = ProductSerializer(product)
     return Response(serializer.data, status=status.HTTP_200_OK)
 
+@api_view(['GET', 'POST'])
+@permission_classes([IsAuthenticatedOrReadOnly])
+def product_reviews(request, pk):
+    if not Product.objects.filter(pk=pk).exists():
+        return Response({'error': 'Product not found'}, status=status.HTTP_404_NOT_FOUND)
+    if request.method == 'POST':
+        serializer = ReviewSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        save_review(serializer, product_id=pk, user=request.user)
+        return Response(serializer.data, status=status.HTTP_201_CREATED)
+    paginator = ReviewCursorPagination()
+    reviews = paginator.paginate_queryset(Review.objects.filter(product_id=pk).select_related('user'), request)
+    return paginator.get_paginated_response(ReviewSerializer(reviews, many=True).data)
+
 # @csrf_exempt
 @require_POST
 @api_view(['POST'])
@@ -183,6 +247,21 @@ def create_user(request):
     except Exception as e:
         return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
 
+class CartMergingTokenObtainPairView(TokenObtainPairView):
+    """
+    TokenObtainPairView that moves the anonymous session cart into the
+    user's cart on a successful login.
+    """
+
+    def post(self, request, *args, **kwargs):
+        serializer = self.get_serializer(data=request.data)
+        try:
+            serializer.is_valid(raise_exception=True)
+        except TokenError as e:
+            raise InvalidToken(e.args[0])
+        merge_session_cart(serializer.user, request.session)
+        return Response(serializer.validated_data, status=status.HTTP_200_OK)
+
 @api_view(['GET'])
 @permission_classes([IsAuthenticated])
 def get_profile(request):
@@ -193,41 +272,9 @@ def get_profile(request):
 
 # Cart
 @api_view(['GET'])
+@authentication_classes([SessionAuthentication, StatelessJWTAuthentication])
 def get_cart(request):
-    if request.user.is_authenticated:
-        try:
-            cart = Cart.objects.get(user=request.user)
-            cart_items = CartProduct.objects.filter(cart=cart)
-            items = [
-                {
-                    'id': item.id,
-                    'product': {
-                        'id': item.product.id,
-                        'name': item.product.name,
-                        'price': item.product.price,
-                    },
-                    'quantity': item.quantity,
-                }
-                for item in cart_items
-            ]
-            return JsonResponse({'cart': items})
-        except Cart.DoesNotExist:
-            return JsonResponse({'cart': []})
-    else:
-        session_cart = request.session.get('cart', {})
-        cart_items = []
-        for product_id, quantity in session_cart.items():
-            product = Product.objects.get(id=product_id)
-            cart_items.append({
-                'id': product_id,
-                'product': {
-                    'id': product.id,
-                    'name': product.name,
-                    'price': product.price,
-                },
-                'quantity': quantity,
-            })
-        return JsonResponse({'cart': cart_items})
+    return FastJsonResponse({'cart': read_cart(request)})
 
 @csrf_exempt
 @require_POST
@@ -237,14 +284,7 @@ def add_to_cart(request):
     product = get_object_or_404(Product, id=product_id)
 
     if request.user.is_authenticated:
-        user = request.user
-        cart, created = Cart.objects.get_or_create(user=user)
-        cart_product, created = CartProduct.objects.get_or_create(cart=cart, product=product)
-        if not created:
-            cart_product.quantity += quantity
-        else:
-            cart_product.quantity = quantity
-        cart_product.save()
+        cart_product = add_to_user_cart(request.user, product, quantity)
         cart_data = {
             'message': 'Item added to cart successfully',
             'cart_product_id': cart_product.id,
@@ -256,34 +296,45 @@ def add_to_cart(request):
             }
         }
     else:
-        session_cart = request.session.get('cart', {})
-        if str(product_id) in session_cart:
-            session_cart[str(product_id)]['quantity'] += quantity
-        else:
-            session_cart[str(product_id)] = {
+        # The session middleware saves the session once, after the response.
+        cart_data = {
+            'message': 'Item added to cart successfully',
+            'product': {
                 'id': product.id,
                 'name': product.name,
                 'price': str(product.price),
-                'quantity': quantity
+                'quantity': add_to_session_cart(request.session, product.id, quantity)
             }
-        request.session['cart'] = session_cart
-        request.session.save()
-        cart_data = {
-            'message': 'Item added to cart successfully',
-            'product': session_cart[str(product_id)]
         }
 
-    return JsonResponse(cart_data)
+    return FastJsonResponse(cart_data)
+
+
+# Batch edits: {"operations": [{"op": "add" | "set" | "remove", "product_id":
+# ..., "quantity": ...}, ...]}, applied in order; responds with the new cart.
+@api_view(['POST'])
+def update_cart(request):
+    serializer = CartBatchSerializer(data=request.data)
+    serializer.is_valid(raise_exception=True)
+    operations = serializer.validated_data['operations']
+    try:
+        if request.user.is_authenticated:
+            apply_cart_operations(request.user, operations)
+        else:
+            apply_session_cart_operations(request.session, operations)
+    except ProductNotFound as e:
+        return FastJsonResponse({'error': str(e), 'product_ids': e.product_ids}, status=404)
+    return FastJsonResponse({'cart': read_cart(request)})
 
 
 # Order
 @api_view(['GET'])
+@authentication_classes([SessionAuthentication, StatelessJWTAuthentication])
 @permission_classes([IsAuthenticated])
 def get_orders(request):
-    orders = Order.objects.filter(user=request.user)
-    serializer = OrderSerializer(orders, many=True)
-    print(serializer.data)
-    return Response(serializer.data, status=status.HTTP_200_OK)
+    paginator = OrderCursorPagination()
+    rows = paginator.paginate_queryset(order_values(Order.objects.filter(user_id=request.user.pk)), request)
+    return paginator.get_paginated_response(serialize_orders(rows))
     
    
 
@@ -304,12 +355,14 @@ def add_product(request):
 @parser_classes([MultiPartParser, FormParser])
 def update_product(request, pk):
     try:
-        product = Product.objects.get(pk=pk)
+        product = Product.objects.catalog().get(pk=pk)
     except Product.DoesNotExist:
         return Response({'error': 'Product not found'}, status=status.HTTP_404_NOT_FOUND)
     serializer = ProductSerializer(product, data=request.data)
     if serializer.is_valid():
-        serializer.save()
+        # Carts holding the product are repriced by the post_save signal.
+        with transaction.atomic():
+            serializer.save()
         return Response(serializer.data, status=status.HTTP_200_OK)
     return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
@@ -324,6 +377,7 @@ def update_product(request, pk):
 #     return Response(status=status.HTTP_204_NO_CONTENT)
 
 
+@idempotent
 @csrf_exempt
 @require_POST
 @api_view(['POST'])
@@ -335,23 +389,12 @@ def create_guest_order(request):
             return Response({'error': f'{field} is required'}, status=status.HTTP_400_BAD_REQUEST)
     
     try:
-        with transaction.atomic():
-            order = Order.objects.create(
-                user=None,
-                total_price=request.data['total_price']
-            )
+        lines = resolve_order_lines(request.data['items'], product_key='product')
+        order = place_order(lines, request.data['total_price'])
 
-            for item in request.data['items']:
-                product = Product.objects.get(id=item['product'])
-                OrderItem.objects.create(
-                    order=order,
-                    product=product,
-                    quantity=item['quantity'],
-                    price=product.price
-                )
-        
-        order_serialized = OrderSerializer(order)
-        return Response(order_serialized.data, status=status.HTTP_201_CREATED)
+        return Response(order_payload(order), status=status.HTTP_201_CREATED)
+    except OutOfStock as e:
+        return Response(out_of_stock(e), status=status.HTTP_409_CONFLICT)
     except Product.DoesNotExist:
         return Response({'error': 'One or more products not found'}, status=status.HTTP_400_BAD_REQUEST)
     except Exception as e:
@@ -365,6 +408,7 @@ class ProductImageDetailView(generics.RetrieveUpdateDestroyAPIView):
     queryset = ProductImage.objects.all()
     serializer_class = ProductImageSerializer
 
+@idempotent
 @csrf_exempt
 @require_POST
 def checkout(request):
@@ -372,97 +416,74 @@ def checkout(request):
     cart_id = request.POST.get('cart_id')
 
     if not cart_id:
-        return JsonResponse({'error': 'Cart ID is required'}, status=400)
-
-    try:
-        cart = Cart.objects.get(id=cart_id)
-    except ObjectDoesNotExist:
-        return JsonResponse({'error': 'Cart not found'}, status=404)
-
-    if not cart.cart_products.exists():
-        return JsonResponse({'error': 'Cart is empty'}, status=400)
+        return FastJsonResponse({'error': 'Cart ID is required'}, status=400)
 
     if request.user.is_authenticated:
         user = request.user
     else:
         user = None
 
-    order = Order.objects.create(user=user, total_price=0)
-    total_price = 0
-
-    for cart_product in CartProduct.objects.filter(cart=cart):
-        OrderItem.objects.create(
-            order=order,
-            product=cart_product.product,
-            quantity=cart_product.quantity,
-            price=cart_product.product.price
-        )
-        total_price += cart_product.product.price * cart_product.quantity
-        cart_product.delete()
-
-    order.total_price = total_price
-    order.save()
-    cart.delete()
+    try:
+        order = checkout_cart(cart_id, user=user)
+    except ObjectDoesNotExist:
+        return FastJsonResponse({'error': 'Cart not found'}, status=404)
+    except EmptyCart:
+        return FastJsonResponse({'error': 'Cart is empty'}, status=400)
+    except OutOfStock as e:
+        return FastJsonResponse(out_of_stock(e), status=409)
 
-    return JsonResponse({'message': 'Order placed successfully', 'order_id': order.id})
+    return FastJsonResponse({'message': 'Order placed successfully', 'order_id': order.id})
 
 @csrf_exempt
 @api_view(['DELETE'])
 def delete_cart_item(request, pk):
-    print(f"Received CartProduct ID for deletion: {pk}")
-    try: 
-        cart_product = get_object_or_404(CartProduct, pk=pk)
-        cart_product.delete()
+    try:
+        remove_cart_line(pk)
         return Response(status=status.HTTP_204_NO_CONTENT)
     except CartProduct.DoesNotExist:
-        return Response({'error': 'Item not found'})
+        return Response({'error': 'Item not found'}, status=status.HTTP_404_NOT_FOUND)
     
 
 
     
 
+@idempotent
 @csrf_exempt
 @api_view(['POST'])
 @permission_classes([])
 def create_order(request):
     try:
         data = request.data
-
-        print('received data: ', data)
-
         total_price = data.get('total_price')
-        print('total price: ', total_price)
-
         payment_intent_id = data.get('payment_intent_id')
-        print('payment id', payment_intent_id);
-
         user = request.user if request.user.is_authenticated else None
 
-        order = Order.objects.create(
-            user=user,
-            total_price=total_price,
-            payment_intent_id=payment_intent_id,
-        )
-        print('user: ', user)
-
-        for item in data['products']:
-            product = get_object_or_404(Product, id=item['product_id'])
-            OrderItem.objects.create(
-                order=order,
-                product=product,
-                quantity=item['quantity'],
-                price=product.price
-            )
-            print('order items: ', product)
+        lines = resolve_order_lines(data['products'])
+        if payment_intent_id:
+            order, created = record_payment_order(payment_intent_id, lines, user=user, total_price=total_price)
+            if not created:
+                # A repeated confirmation: answer with the order it made.
+                return FastJsonResponse(order_payload(order), status=200)
+        else:
+            place_order(lines, total_price, user=user)
 
-        return JsonResponse({'message': 'Order created successfully'}, status=201)
+        return FastJsonResponse({'message': 'Order created successfully'}, status=201)
+    except OutOfStock as e:
+        return FastJsonResponse(out_of_stock(e), status=409)
     except Exception as e:
-        return JsonResponse({'error': str(e)}, status=400)
- 
+        return FastJsonResponse({'error': str(e)}, status=400)
 
 
 @api_view(['GET'])
+@cache_catalog_response
 def category_list(request):
-    categories = Category.objects.all()
-    serializer = CategorySerializer(categories, many=True)
-    return Response(serializer.data)
+    return Response(serialize_categories())
+
+
+def prometheus_metrics(request):
+    if not settings.METRICS_TOKEN:
+        return HttpResponse(status=404)
+    expected = f'Bearer {settings.METRICS_TOKEN}'
+    if not hmac.compare_digest(request.headers.get('Authorization', ''), expected):
+        return HttpResponse(status=401)
+    return HttpResponse(render_metrics(), content_type='text/plain; version=0.0.4; charset=utf-8')